@@ -40,6 +40,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'yourgrades.middleware.RequestStatsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -85,6 +86,18 @@ AUTH_PASSWORD_VALIDATORS = [
         'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
     },
 ]
+AUTHENTICATION_BACKENDS = [
+    'django.contrib.auth.backends.ModelBackend',
+    'yourgrades.backends.ActivationTokenBackend',
+]
+
+# Create accounts with unusable passwords and one-time activation tokens
+# instead of hashed initial passwords, the hash is computed at first login
+GRADEBOOK_DEFERRED_CREDENTIALS = env.bool(
+    'GRADEBOOK_DEFERRED_CREDENTIALS',
+    default=False
+)
+
 APPEND_SLASH = False
 NOSE_ARGS = ['--nocapture', '--nologcapture']
 
@@ -13,3 +13,12 @@ DATABASES = {
 ALLOWED_HOSTS = [f'{env("ACC_NAME")}.pythonanywhere.com']
 STATIC_ROOT = f'/home/{env("ACC_NAME")}/static/'
 DEBUG = False
+
+# Cache shared by all worker processes, so cached timetables are invalidated
+# everywhere when lesson dates change
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': f'/home/{env("ACC_NAME")}/cache/',
+    }
+}
@@ -0,0 +1,198 @@
+"""
+Grade analytics on NumPy arrays. load() reads grades of a class, subject or
+student with one query into parallel arrays (from_grades() takes grades that
+are loaded already), the statistics are computed for all students or
+subjects at once with bincount and sort based group operations instead of
+loops over model instances.
+"""
+import numpy as np
+from .models import Grades
+
+GRADES = np.arange(1, 7)
+
+# Trends are grade changes per this number of days
+TREND_DAYS = 30
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class GradeArrays:
+    """
+    Parallel arrays of loaded grades: grade, weight, student and subject
+    (indexes into student_ids and subject_ids) and timestamp (POSIX seconds).
+    """
+
+    def __init__(self, rows):
+        count = len(rows)
+        if count:
+            grades, weights, students, subjects, dates = zip(*rows)
+        else:
+            grades = weights = students = subjects = dates = ()
+        self.grade = np.fromiter(grades, np.int64, count)
+        self.weight = np.fromiter(weights, np.int64, count)
+        self.student_ids, self.student = np.unique(
+            np.fromiter(students, np.int64, count),
+            return_inverse=True
+        )
+        self.subject_ids, self.subject = np.unique(
+            np.fromiter(subjects, np.int64, count),
+            return_inverse=True
+        )
+        self.timestamp = np.fromiter(
+            (date.timestamp() for date in dates),
+            np.float64,
+            count
+        )
+
+    def __len__(self):
+        return len(self.grade)
+
+    def groups(self, by):
+        """
+        Returns (group index of every grade, group ids) for by 'student' or
+        'subject'.
+        """
+        return getattr(self, by), getattr(self, f'{by}_ids')
+
+
+def load(**filters):
+    """
+    Returns GradeArrays of grades matching filters, e.g.
+    load(subject=subject) or load(subject__school_class=school_class).
+    """
+    rows = Grades.objects.filter(**filters).order_by().values_list(
+        'grade',
+        'weight',
+        'student_id',
+        'subject_id',
+        'date'
+    )
+    return GradeArrays(list(rows))
+
+
+def from_grades(grades):
+    """
+    Returns GradeArrays of already loaded Grades instances, e.g. the grades
+    of load_grade_matrix(), without querying them again.
+    """
+    return GradeArrays([
+        (grade.grade, grade.weight, grade.student_id, grade.subject_id,
+         grade.date)
+        for grade in grades
+    ])
+
+
+def divide(numerators, denominators):
+    # NaN where a group has nothing to divide by
+    result = np.full(len(numerators), np.nan)
+    np.divide(numerators, denominators, out=result, where=denominators != 0)
+    return result
+
+
+def counts(index, size):
+    return np.bincount(index, minlength=size)
+
+
+def weighted_averages(index, size, grade, weight):
+    return divide(
+        np.bincount(index, weights=grade * weight, minlength=size),
+        np.bincount(index, weights=weight, minlength=size)
+    )
+
+
+def means(index, size, grade):
+    return divide(
+        np.bincount(index, weights=grade, minlength=size),
+        counts(index, size)
+    )
+
+
+def standard_deviations(index, size, grade):
+    # Population standard deviation, from the mean of squares
+    squares = divide(
+        np.bincount(index, weights=grade * grade, minlength=size),
+        counts(index, size)
+    )
+    return np.sqrt(np.maximum(squares - means(index, size, grade) ** 2, 0))
+
+
+def medians(index, size, grade):
+    group_counts = counts(index, size)
+    ordered = grade[np.lexsort((grade, index))]
+    starts = np.cumsum(group_counts) - group_counts
+    result = np.full(size, np.nan)
+    present = group_counts > 0
+    low = starts[present] + (group_counts[present] - 1) // 2
+    high = starts[present] + group_counts[present] // 2
+    result[present] = (ordered[low] + ordered[high]) / 2
+    return result
+
+
+def histograms(index, size, grade):
+    """
+    Returns (size, 6) array of counts of grades 1-6 of every group.
+    """
+    return np.bincount(
+        index * len(GRADES) + grade - GRADES[0],
+        minlength=size * len(GRADES)
+    ).reshape(size, len(GRADES))
+
+
+def trends(index, size, grade, timestamp):
+    """
+    Returns least squares slopes of grades over time, in grade change per
+    TREND_DAYS. NaN for groups with all grades given at the same time.
+    """
+    days = timestamp / SECONDS_PER_DAY
+    centered = days - divide(
+        np.bincount(index, weights=days, minlength=size),
+        counts(index, size)
+    )[index]
+    return divide(
+        np.bincount(index, weights=centered * grade, minlength=size),
+        np.bincount(index, weights=centered * centered, minlength=size)
+    ) * TREND_DAYS
+
+
+def to_python(values):
+    # Template friendly floats rounded like GradeAverage.average, None for NaN
+    return [
+        None if np.isnan(value) else round(value, 2)
+        for value in values.tolist()
+    ]
+
+
+def summarize(arrays, by):
+    """
+    Returns {student or subject id: {'count', 'weighted_average', 'mean',
+    'median', 'std', 'trend', 'histogram'}} of arrays grouped by 'student'
+    or 'subject'.
+    """
+    index, ids = arrays.groups(by)
+    size = len(ids)
+    grade = arrays.grade
+    columns = {
+        'count': counts(index, size).tolist(),
+        'weighted_average': to_python(
+            weighted_averages(index, size, grade, arrays.weight)
+        ),
+        'mean': to_python(means(index, size, grade)),
+        'median': to_python(medians(index, size, grade)),
+        'std': to_python(standard_deviations(index, size, grade)),
+        'trend': to_python(trends(index, size, grade, arrays.timestamp)),
+        'histogram': histograms(index, size, grade).tolist(),
+    }
+    return {
+        group_id: {name: values[number] for name, values in columns.items()}
+        for number, group_id in enumerate(ids.tolist())
+    }
+
+
+def distribution(arrays):
+    """
+    Returns counts of grades 1-6 of all loaded grades.
+    """
+    return np.bincount(
+        arrays.grade - GRADES[0],
+        minlength=len(GRADES)
+    ).tolist()
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class YourgradesConfig(AppConfig):
     name = 'yourgrades'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,36 @@
+"""
+Authentication with one-time activation tokens, used when accounts are
+created with GRADEBOOK_DEFERRED_CREDENTIALS.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from .models import ActivationToken
+
+
+def deferred_credentials():
+    return getattr(settings, 'GRADEBOOK_DEFERRED_CREDENTIALS', False)
+
+
+class ActivationTokenBackend:
+    """
+    Accepts username + activation token as credentials. Permissions are
+    left to ModelBackend.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None:
+            return None
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            return None
+        if user.is_active and ActivationToken.verify(user, password):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        try:
+            user = User.objects.get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if user.is_active else None
@@ -0,0 +1,257 @@
+"""
+Gradebook export. Grades of a school class, a subject or the whole school
+are read in keyset chunks (id > last id, LIMIT chunk_size) with the student,
+subject and class columns joined in, and are written as CSV or XLSX while
+they are read, so memory use doesn't depend on the number of grades.
+Chunks are separate queries because MySQL drivers load the whole result of
+a query into memory, even with QuerySet.iterator().
+
+XLSX files are written with zipfile as a minimal workbook with inline
+strings; a new sheet is started when a sheet reaches the Excel row limit.
+"""
+import csv
+import io
+import zipfile
+from datetime import datetime
+from itertools import islice
+from xml.sax.saxutils import escape
+from django.utils import timezone
+from .models import Grades
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Bytes collected before a piece of the file is handed to the response
+STREAM_BUFFER_SIZE = 64 * 1024
+
+FORMATS = ('csv', 'xlsx')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.'
+            'sheet',
+}
+
+COLUMNS = (
+    ('class', 'subject__school_class__name'),
+    ('year', 'subject__school_class__year'),
+    ('subject', 'subject__name'),
+    ('subject_code', 'subject__unique_code'),
+    ('surname', 'student__surname'),
+    ('name', 'student__name'),
+    ('grade', 'grade'),
+    ('weight', 'weight'),
+    ('date', 'date'),
+    ('manager_mode', 'manager_mode'),
+)
+
+HEADER = tuple(title for title, field in COLUMNS)
+
+XLSX_MAX_ROWS = 1048576
+
+
+class ExportError(Exception):
+    """
+    Raised when grades can't be exported in the requested format.
+    """
+
+
+def grades_queryset(school_class=None, subject=None):
+    """
+    Returns queryset of grades of subject, school_class or the whole school.
+    """
+    grades = Grades.objects.all()
+    if school_class is not None:
+        grades = grades.filter(subject__school_class=school_class)
+    if subject is not None:
+        grades = grades.filter(subject=subject)
+    return grades
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, datetime):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def iter_rows(grades, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields tuples of COLUMNS values of grades in id order, reading
+    chunk_size grades per query.
+    """
+    fields = [field for title, field in COLUMNS]
+    last_id = 0
+    while True:
+        chunk = list(
+            grades.filter(id__gt=last_id).order_by('id').values_list(
+                'id',
+                *fields
+            )[:chunk_size]
+        )
+        for row in chunk:
+            yield tuple(format_value(value) for value in row[1:])
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1][0]
+
+
+def csv_chunks(rows):
+    """
+    Yields pieces of a UTF-8 CSV file with HEADER and rows.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM, so spreadsheet programs detect the encoding
+    buffer.write('\ufeff')
+    writer.writerow(HEADER)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= STREAM_BUFFER_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+class StreamSink:
+    """
+    Unseekable file for zipfile, written data is taken out with drain().
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer.extend(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+XLSX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'relationships"><Relationship Id="rId1" Type="http://schemas.'
+    'openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+
+SHEET_START = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+    b'2006/main"><sheetData>'
+)
+
+SHEET_END = b'</sheetData></worksheet>'
+
+
+def xlsx_parts(sheets):
+    """
+    Returns (name, content) of the workbook parts listing sheets sheets.
+    """
+    numbers = range(1, sheets + 1)
+    content_types = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{number}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.'
+        f'spreadsheetml.worksheet+xml"/>'
+        for number in numbers
+    )
+    workbook_sheets = ''.join(
+        f'<sheet name="Grades {number}" sheetId="{number}" '
+        f'r:id="rId{number}"/>'
+        for number in numbers
+    )
+    workbook_rels = ''.join(
+        f'<Relationship Id="rId{number}" Type="http://schemas.'
+        f'openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{number}.xml"/>'
+        for number in numbers
+    )
+    return [
+        ('[Content_Types].xml',
+         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+         '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+         'content-types"><Default Extension="rels" ContentType="application/'
+         'vnd.openxmlformats-package.relationships+xml"/><Default '
+         'Extension="xml" ContentType="application/xml"/><Override '
+         'PartName="/xl/workbook.xml" ContentType="application/vnd.'
+         'openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+         f'{content_types}</Types>'),
+        ('_rels/.rels', XLSX_RELS),
+        ('xl/workbook.xml',
+         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+         '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+         '2006/main" xmlns:r="http://schemas.openxmlformats.org/'
+         f'officeDocument/2006/relationships"><sheets>{workbook_sheets}'
+         '</sheets></workbook>'),
+        ('xl/_rels/workbook.xml.rels',
+         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+         '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+         f'2006/relationships">{workbook_rels}</Relationships>'),
+    ]
+
+
+def xlsx_row(row):
+    cells = []
+    for value in row:
+        if isinstance(value, (int, float)):
+            cells.append(f'<c><v>{value}</v></c>')
+        elif value is None:
+            cells.append('<c/>')
+        else:
+            cells.append(
+                f'<c t="inlineStr"><is><t xml:space="preserve">'
+                f'{escape(str(value))}</t></is></c>'
+            )
+    return f'<row>{"".join(cells)}</row>'.encode()
+
+
+def xlsx_chunks(rows, sheet_rows=XLSX_MAX_ROWS):
+    """
+    Yields pieces of an XLSX file with HEADER and rows, sheet_rows rows
+    (header included) per sheet.
+    """
+    sink = StreamSink()
+    rows = iter(rows)
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        sheets = 0
+        while True:
+            sheets += 1
+            written = 0
+            with archive.open(
+                    f'xl/worksheets/sheet{sheets}.xml',
+                    'w',
+                    force_zip64=True
+            ) as sheet:
+                sheet.write(SHEET_START)
+                sheet.write(xlsx_row(HEADER))
+                for row in islice(rows, sheet_rows - 1):
+                    sheet.write(xlsx_row(row))
+                    written += 1
+                    if len(sink.buffer) >= STREAM_BUFFER_SIZE:
+                        yield sink.drain()
+                sheet.write(SHEET_END)
+            if written < sheet_rows - 1:
+                break
+        for name, content in xlsx_parts(sheets):
+            archive.writestr(name, content)
+    yield sink.drain()
+
+
+def export_chunks(grades, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields pieces (bytes) of grades exported in export_format.
+    """
+    if export_format not in FORMATS:
+        raise ExportError(f'Export format must be one of {FORMATS}.')
+    rows = iter_rows(grades, chunk_size)
+    if export_format == 'csv':
+        return csv_chunks(rows)
+    return xlsx_chunks(rows)
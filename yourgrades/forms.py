@@ -108,6 +108,19 @@ class CreateStudentForm(forms.Form):
     )
 
 
+class RosterImportForm(forms.Form):
+    roster = forms.FileField(
+        label='Plik z listą uczniów (CSV lub JSON):',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control'})
+    )
+
+    def clean_roster(self):
+        roster = self.cleaned_data['roster']
+        if roster.name.rsplit('.', 1)[-1].lower() not in {'csv', 'json'}:
+            raise forms.ValidationError('Dozwolone są pliki .csv i .json')
+        return roster
+
+
 class CreateTeacherForm(forms.Form):
     name = forms.CharField(
         max_length=64,
@@ -186,6 +199,62 @@ class AddGradeForm(forms.ModelForm):
         labels = {'grade': 'ocena: ', 'weight': 'waga: '}
 
 
+class BatchGradeForm(forms.Form):
+    """
+    Grades of many students with one weight. Students left empty get no
+    grade, at least one grade is required.
+    """
+    weight = forms.IntegerField(
+        min_value=1,
+        max_value=10,
+        label='waga: ',
+        widget=forms.NumberInput(
+            attrs={'placeholder': 'waga  1 - 10',
+                   'class': 'form-control input-sm'}
+        )
+    )
+
+    def __init__(self, students, *args, **kwargs):
+        super(BatchGradeForm, self).__init__(*args, **kwargs)
+        self.students = list(students)
+        for student in self.students:
+            self.fields[self.field_name(student)] = forms.IntegerField(
+                min_value=1,
+                max_value=6,
+                required=False,
+                label=str(student),
+                widget=forms.NumberInput(
+                    attrs={'placeholder': 'ocena  1 - 6',
+                           'class': 'form-control input-sm'}
+                )
+            )
+
+    @staticmethod
+    def field_name(student):
+        return f'grade_{student.user_id}'
+
+    def student_fields(self):
+        return [(student, self[self.field_name(student)])
+                for student in self.students]
+
+    def clean(self):
+        cleaned_data = super(BatchGradeForm, self).clean()
+        if not any(cleaned_data.get(self.field_name(student)) is not None
+                   for student in self.students):
+            raise forms.ValidationError('Wprowadź co najmniej jedną ocenę.')
+        return cleaned_data
+
+    def grades(self):
+        """
+        Returns dict {student: grade} of students with a grade.
+        """
+        return {
+            student: self.cleaned_data[self.field_name(student)]
+            for student in self.students
+            if self.cleaned_data.get(self.field_name(student)) is not None
+        }
+
+
 class MessageForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super(MessageForm, self).__init__(*args, **kwargs)
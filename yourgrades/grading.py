@@ -0,0 +1,50 @@
+"""
+Batch grade entry. Grades of a whole class are written with one bulk insert
+and notifications are queued for the deliver_notifications command, which
+sends one message per distinct grade (see notifications.py).
+"""
+from collections import defaultdict
+from django.db import transaction
+from .models import Grades, GradeAverage, GradeEvent, Message, \
+    NotificationEvent
+
+
+def grade_message(subject, grade, weight):
+    return Message(
+        subject='New grade',
+        text=f'You have a new grade for the subject {subject.name}. '
+             f'Your grade is {grade} with weight {weight}.'
+    )
+
+
+def add_grades(subject, weight, grades, user, manager_mode=False):
+    """
+    Creates grades ({student: grade value}) of subject with the same weight
+    in one transaction and queues notifications of the students from user.
+    Values must be validated already, bulk inserts skip
+    Grades.full_clean(). Returns the list of created grades.
+    """
+    created = [
+        Grades(
+            grade=grade,
+            weight=weight,
+            student=student,
+            subject=subject,
+            manager_mode=manager_mode
+        )
+        for student, grade in grades.items()
+    ]
+    recipients = defaultdict(list)
+    for grade in created:
+        recipients[grade.grade].append(grade.student_id)
+    with transaction.atomic():
+        Grades.objects.bulk_create(created)
+        GradeEvent.record_added(created)
+        GradeAverage.add_grades(created)
+        for grade, user_ids in sorted(recipients.items()):
+            NotificationEvent.enqueue(
+                grade_message(subject, grade, weight),
+                user,
+                user_ids
+            )
+    return created
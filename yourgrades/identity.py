@@ -0,0 +1,73 @@
+"""
+Request scoped identity map. Views often load the same Student, Parent,
+Teacher, Subject or SchoolClass in several methods of one request; lookups
+through the request's IdentityMap hit the database once per row and return
+the same instance afterwards, so changes made to it are seen everywhere.
+
+Rows are kept by their natural keys: user_id for persons, unique_code for
+subjects and school classes.
+"""
+from django.http import Http404
+from .models import Student, Parent, Teacher, Subject, SchoolClass
+
+NATURAL_KEYS = {
+    Student: 'user_id',
+    Parent: 'user_id',
+    Teacher: 'user_id',
+    Subject: 'unique_code',
+    SchoolClass: 'unique_code',
+}
+
+
+class IdentityMap:
+
+    def __init__(self):
+        self.rows = {}
+        self.hits = 0
+
+    def get(self, model, key, select_related=()):
+        """
+        Returns instance of model with natural key (see NATURAL_KEYS), raises
+        model.DoesNotExist when there isn't one. Missing rows are cached too.
+        """
+        field = NATURAL_KEYS[model]
+        key = str(key)
+        if (model, key) in self.rows:
+            self.hits += 1
+            instance = self.rows[model, key]
+        else:
+            try:
+                instance = model.objects.select_related(
+                    *select_related
+                ).filter(**{field: key}).first()
+            except ValueError:
+                # Malformed key (e.g. posted user id), no row can match it
+                instance = None
+            self.rows[model, key] = instance
+        if instance is None:
+            raise model.DoesNotExist(f'{model.__name__} {key} does not exist')
+        return instance
+
+    def get_or_404(self, model, key, select_related=()):
+        try:
+            return self.get(model, key, select_related)
+        except model.DoesNotExist:
+            raise Http404(f'No {model.__name__} matches the given query.')
+
+    def add(self, instance):
+        model = type(instance)
+        self.rows[model, str(getattr(instance, NATURAL_KEYS[model]))] = \
+            instance
+        return instance
+
+    def forget(self, model, key):
+        self.rows.pop((model, str(key)), None)
+
+
+def identity_map(request):
+    """
+    Returns the IdentityMap of request, created on first use.
+    """
+    if not hasattr(request, 'identity_map'):
+        request.identity_map = IdentityMap()
+    return request.identity_map
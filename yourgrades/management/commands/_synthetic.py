@@ -0,0 +1,241 @@
+"""
+Synthetic school used by benchmark and diagnostic commands. Everything is
+written with bulk inserts; commands create it inside a transaction that is
+rolled back afterwards.
+"""
+import random
+import string
+import time
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from yourgrades.messaging import send_broadcast
+from yourgrades.models import SchoolClass, Student, Parent, Teacher, Subject, \
+    SubjectDate, SubjectTeachers, Grades, GradeEvent, GradeAverage, \
+    Message, Broadcast
+
+USERNAME_PREFIX = 'synthetic_'
+BATCH_SIZE = 2000
+
+
+def batch_size():
+    # SQLite limits the size of one insert, Django picks the largest batch
+    return None if connection.vendor == 'sqlite' else BATCH_SIZE
+
+
+class Rollback(Exception):
+    """
+    Raised at the end of a transaction.atomic() block to discard the data.
+    """
+
+
+def measure(stdout, label, function, *args, atomic=False):
+    """
+    Runs function(*args) (in a transaction with atomic=True), writes its
+    time and number of queries to stdout and returns its result.
+    """
+    queries = []
+
+    def count_query(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count_query):
+        start = time.perf_counter()
+        if atomic:
+            with transaction.atomic():
+                result = function(*args)
+        else:
+            result = function(*args)
+        elapsed = time.perf_counter() - start
+    stdout.write(
+        f'{label:<18} {elapsed * 1000:10.1f} ms {len(queries):8} queries'
+    )
+    return result
+
+
+def create_users(count, kind):
+    password = make_password(None)
+    first = User.objects.filter(
+        username__startswith=f'{USERNAME_PREFIX}{kind}_'
+    ).count()
+    usernames = [
+        f'{USERNAME_PREFIX}{kind}_{number}'
+        for number in range(first, first + count)
+    ]
+    User.objects.bulk_create(
+        [User(username=username, password=password, first_name=kind,
+              last_name=username) for username in usernames],
+        batch_size=batch_size()
+    )
+    return list(
+        User.objects.filter(username__in=usernames).values_list(
+            'id',
+            flat=True
+        )
+    )
+
+
+def class_code(number):
+    return f'{number % 8 + 1}{string.ascii_lowercase[number // 8 % 26]}' \
+           f'{3000 + number // 208}'
+
+
+def create_school(classes=20, students=30, subjects=10, grades=10,
+                  messages=5, seed=0, log=None):
+    """
+    Creates classes with students, one parent per student, subjects with
+    teachers and lesson dates, grades for every student and subject and
+    broadcast messages to each class. Returns dict with created row counts.
+    """
+    random_generator = random.Random(seed)
+    log = log or (lambda text: None)
+
+    codes = [class_code(number) for number in range(classes)]
+    SchoolClass.objects.bulk_create(
+        [SchoolClass(unique_code=code, name=code[:2], year=int(code[2:]))
+         for code in codes]
+    )
+    school_classes = list(SchoolClass.objects.filter(unique_code__in=codes))
+    log(f'{len(school_classes)} classes')
+
+    teacher_ids = create_users(subjects, 'teacher')
+    Teacher.objects.bulk_create(
+        [Teacher(user_id=user_id, name='Teacher', surname=str(user_id),
+                 first_login=False) for user_id in teacher_ids]
+    )
+
+    student_ids = create_users(classes * students, 'student')
+    parent_ids = create_users(classes * students, 'parent')
+    Student.objects.bulk_create(
+        [Student(user_id=user_id, name='Student', surname=str(user_id),
+                 birthday='2010-01-01', first_login=False,
+                 school_class=school_classes[number // students])
+         for number, user_id in enumerate(student_ids)],
+        batch_size=batch_size()
+    )
+    Parent.objects.bulk_create(
+        [Parent(user_id=user_id, name='Parent', surname=str(user_id),
+                student_id=student_id, first_login=False)
+         for user_id, student_id in zip(parent_ids, student_ids)],
+        batch_size=batch_size()
+    )
+    log(f'{len(student_ids)} students and parents, '
+        f'{len(teacher_ids)} teachers')
+
+    subject_codes = []
+    for school_class in school_classes:
+        for number in range(subjects):
+            subject_codes.append(
+                (f'{number:02d}{school_class.unique_code}', school_class)
+            )
+    Subject.objects.bulk_create(
+        [Subject(name=f'Subject {code[:2]}', unique_code=code,
+                 school_class=school_class)
+         for code, school_class in subject_codes],
+        batch_size=batch_size()
+    )
+    all_subjects = list(
+        Subject.objects.filter(
+            unique_code__in=[code for code, school_class in subject_codes]
+        )
+    )
+    SubjectTeachers.objects.bulk_create(
+        [SubjectTeachers(subject=subject) for subject in all_subjects],
+        batch_size=batch_size()
+    )
+    through = SubjectTeachers.teacher.through
+    through.objects.bulk_create(
+        [through(subjectteachers_id=subject_teachers_id,
+                 teacher_id=teacher_ids[number % len(teacher_ids)])
+         for number, subject_teachers_id in enumerate(
+            SubjectTeachers.objects.filter(
+                subject__in=all_subjects
+            ).values_list('id', flat=True)
+        )],
+        batch_size=batch_size()
+    )
+    days = [day for day, name in SubjectDate.DAYS]
+    SubjectDate.objects.bulk_create(
+        [SubjectDate(subject=subject, day=days[number % len(days)],
+                     lesson_number=number // len(days) % 11 + 1)
+         for number, subject in enumerate(all_subjects)],
+        batch_size=batch_size()
+    )
+    log(f'{len(all_subjects)} subjects')
+
+    subjects_by_class = {}
+    for subject in all_subjects:
+        subjects_by_class.setdefault(subject.school_class_id, []).append(
+            subject
+        )
+    grade_count = 0
+    batch = []
+    for number, student_id in enumerate(student_ids):
+        school_class = school_classes[number // students]
+        for subject in subjects_by_class[school_class.id]:
+            for grade_number in range(grades):
+                batch.append(Grades(
+                    student_id=student_id,
+                    subject=subject,
+                    grade=random_generator.randint(1, 6),
+                    weight=random_generator.randint(1, 10),
+                    manager_mode=grade_number % 10 == 9
+                ))
+        if len(batch) >= BATCH_SIZE:
+            Grades.objects.bulk_create(batch)
+            grade_count += len(batch)
+            batch = []
+    Grades.objects.bulk_create(batch)
+    grade_count += len(batch)
+    # ADDED events are read from the table, bulk inserts don't set ids
+    events = []
+    for grade in Grades.objects.filter(subject__in=all_subjects).iterator():
+        events.append(
+            GradeEvent.from_grade(GradeEvent.ADDED, grade, grade.date)
+        )
+        if len(events) >= BATCH_SIZE:
+            GradeEvent.objects.bulk_create(events)
+            events = []
+    GradeEvent.objects.bulk_create(events)
+    canceled = [
+        Grades(student_id=student_id, grade=1, weight=1,
+               subject=subjects_by_class[
+                   school_classes[number // students].id][0])
+        for number, student_id in enumerate(student_ids)
+        if number % 10 == 0
+    ]
+    Grades.objects.bulk_create(canceled, batch_size=batch_size())
+    GradeEvent.record_added(canceled, batch_size=batch_size())
+    GradeEvent.objects.bulk_create(
+        [GradeEvent.from_grade(GradeEvent.CANCELED, grade)
+         for grade in canceled],
+        batch_size=batch_size()
+    )
+    Grades.objects.filter(id__in=[grade.pk for grade in canceled]).delete()
+    GradeAverage.rebuild()
+    log(f'{grade_count} grades')
+
+    author = User.objects.get(id=teacher_ids[0])
+    for school_class in school_classes:
+        for number in range(messages):
+            message = Message(
+                subject=f'Message {number}',
+                text='Synthetic message.'
+            )
+            send_broadcast(
+                message,
+                author,
+                Broadcast.SCHOOL_CLASS,
+                school_class=school_class,
+                recipient_name=school_class.name
+            )
+    log(f'{classes * messages} messages')
+
+    return {
+        'classes': len(school_classes),
+        'students': len(student_ids),
+        'teachers': len(teacher_ids),
+        'subjects': len(all_subjects),
+        'grades': grade_count,
+    }
@@ -0,0 +1,101 @@
+import statistics
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from yourgrades import analytics
+from yourgrades.models import Grades
+from ._synthetic import Rollback, create_school, measure
+
+
+def orm_summary(queryset, key):
+    # Baseline: Python loops over model instances, as views did before the
+    # analytics module
+    grouped = defaultdict(list)
+    for grade in queryset:
+        grouped[getattr(grade, key)].append(grade)
+    summary = {}
+    for group_id, grades in grouped.items():
+        values = [grade.grade for grade in grades]
+        weight_sum = sum(grade.weight for grade in grades)
+        summary[group_id] = {
+            'count': len(values),
+            'weighted_average': round(
+                sum(grade.grade * grade.weight for grade in grades) /
+                weight_sum,
+                2
+            ),
+            'mean': round(statistics.mean(values), 2),
+            'median': statistics.median(values),
+            'std': round(statistics.pstdev(values), 2),
+            'histogram': [values.count(value) for value in range(1, 7)],
+        }
+    return summary
+
+
+class Command(BaseCommand):
+    help = 'Compares the NumPy grade analytics with Python loops over model ' \
+           'instances on a synthetic school (1M grades by default). All ' \
+           'data is created in a transaction that is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--classes', type=int, default=40)
+        parser.add_argument('--students', type=int, default=25)
+        parser.add_argument('--subjects', type=int, default=10)
+        parser.add_argument(
+            '--grades',
+            type=int,
+            default=100,
+            help='Grades per student and subject.'
+        )
+
+    def compare(self, baseline, summary):
+        for group_id, row in baseline.items():
+            for name, value in row.items():
+                if summary[group_id][name] != value:
+                    raise CommandError(
+                        f'{name} of {group_id} differs: {value} != '
+                        f'{summary[group_id][name]}'
+                    )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                created = create_school(
+                    classes=options['classes'],
+                    students=options['students'],
+                    subjects=options['subjects'],
+                    grades=options['grades'],
+                    messages=0,
+                    log=lambda text: self.stderr.write(f'created {text}')
+                )
+                self.stdout.write(f'Grades: {created["grades"]}')
+                baseline = measure(
+                    self.stdout,
+                    'orm by student',
+                    orm_summary,
+                    Grades.objects.all(),
+                    'student_id'
+                )
+                arrays = measure(
+                    self.stdout,
+                    'numpy load',
+                    analytics.load
+                )
+                summary = measure(
+                    self.stdout,
+                    'numpy by student',
+                    analytics.summarize,
+                    arrays,
+                    'student'
+                )
+                measure(
+                    self.stdout,
+                    'numpy by subject',
+                    analytics.summarize,
+                    arrays,
+                    'subject'
+                )
+                self.compare(baseline, summary)
+                raise Rollback
+        except Rollback:
+            pass
@@ -0,0 +1,98 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from yourgrades.messaging import send_message, send_broadcast, \
+    received_messages
+from yourgrades.models import Student, Message, Delivery, Broadcast
+from ._synthetic import USERNAME_PREFIX, Rollback, create_school, measure
+
+
+def send_one_by_one(message, user, users):
+    # Row by row delivery, as CreateMessageView did before the bulk fan-out
+    message.sender = user
+    message.recipient_name = 'Benchmark'
+    message.save()
+    for recipient_user in users:
+        Delivery(user=recipient_user, message=message).save()
+
+
+def read_mailbox(user):
+    return list(received_messages(user).order_by('-id')[:16])
+
+
+class Command(BaseCommand):
+    help = 'Compares row-by-row delivery, bulk delivery and a broadcast of ' \
+           'a message to a whole class. All data is created in a ' \
+           'transaction that is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=1000,
+            help='Audience size.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                create_school(
+                    classes=1,
+                    students=options['users'],
+                    subjects=1,
+                    grades=0,
+                    messages=0
+                )
+                students = list(
+                    Student.objects.filter(
+                        user__username__startswith=USERNAME_PREFIX
+                    ).select_related('school_class', 'user')
+                )
+                school_class = students[0].school_class
+                users = [student.user for student in students]
+                author = users.pop()
+                self.stdout.write(f'Audience: {len(users)} users')
+                measure(
+                    self.stdout,
+                    'one by one',
+                    send_one_by_one,
+                    Message(subject='One by one', text='-'),
+                    author,
+                    users,
+                    atomic=True
+                )
+                measure(
+                    self.stdout,
+                    'bulk fan-out',
+                    send_message,
+                    Message(subject='Bulk', text='-'),
+                    author,
+                    [user.id for user in users],
+                    'Benchmark',
+                    atomic=True
+                )
+                measure(
+                    self.stdout,
+                    'broadcast',
+                    send_broadcast,
+                    Message(subject='Broadcast', text='-'),
+                    author,
+                    Broadcast.SCHOOL_CLASS,
+                    school_class,
+                    None,
+                    'Benchmark',
+                    atomic=True
+                )
+                measure(
+                    self.stdout,
+                    'mailbox read',
+                    read_mailbox,
+                    users[0],
+                    atomic=True
+                )
+                self.stdout.write(
+                    f'Rows per message: {len(users)} deliveries, '
+                    f'{Broadcast.objects.count()} broadcast'
+                )
+                raise Rollback
+        except Rollback:
+            pass
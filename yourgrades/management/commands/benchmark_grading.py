@@ -0,0 +1,80 @@
+import random
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from yourgrades.grading import add_grades, grade_message
+from yourgrades.messaging import send_message
+from yourgrades.models import Grades, Subject, Student
+from ._synthetic import Rollback, create_school, create_users, \
+    class_code, measure
+
+
+def grade_one_by_one(subject, weight, grades, user):
+    # Writes of one TeacherSubjectView POST per student, as they were before
+    # batch entry and the notification queue
+    for student, value in grades.items():
+        grade = Grades(grade=value, weight=weight, student=student,
+                       subject=subject)
+        grade.save()
+        send_message(
+            grade_message(subject, grade.grade, grade.weight),
+            user,
+            [student.user_id]
+        )
+
+
+class Command(BaseCommand):
+    help = 'Compares grading a class one student per request with the ' \
+           'batch grade entry. All data is created in a transaction that ' \
+           'is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--students',
+            type=int,
+            default=30,
+            help='Class size.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                create_school(
+                    classes=1,
+                    students=options['students'],
+                    subjects=2,
+                    grades=0,
+                    messages=0
+                )
+                author = User.objects.get(id=create_users(1, 'teacher')[0])
+                subjects = list(Subject.objects.filter(
+                    school_class__unique_code=class_code(0)
+                ))
+                students = list(Student.objects.filter(
+                    school_class__unique_code=class_code(0)
+                ))
+                random_generator = random.Random(0)
+                grades = {student: random_generator.randint(1, 6)
+                          for student in students}
+                self.stdout.write(f'Class: {len(students)} students')
+                measure(
+                    self.stdout,
+                    'one by one',
+                    grade_one_by_one,
+                    subjects[0],
+                    3,
+                    grades,
+                    author
+                )
+                measure(
+                    self.stdout,
+                    'batch',
+                    add_grades,
+                    subjects[1],
+                    3,
+                    grades,
+                    author
+                )
+                raise Rollback
+        except Rollback:
+            pass
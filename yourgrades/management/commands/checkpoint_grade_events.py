@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from yourgrades.models import GradeCheckpoint
+
+
+class Command(BaseCommand):
+    help = 'Creates GradeCheckpoint rows of students with many grade ' \
+           'events since their latest checkpoint, so rebuilding grades ' \
+           'replays only the events after it. Run it periodically, e.g. ' \
+           'from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every',
+            type=int,
+            default=GradeCheckpoint.EVERY,
+            help='Minimal number of new events of a student.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of students replayed at once.'
+        )
+
+    def handle(self, *args, **options):
+        created = GradeCheckpoint.create_due(
+            every=options['every'],
+            batch_size=options['batch_size']
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'Created {created} grade checkpoints.')
+        )
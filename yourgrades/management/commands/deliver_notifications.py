@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from yourgrades import notifications
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued grade notifications as mails. Drains the queue ' \
+           'and exits unless --follow is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=notifications.DELIVERY_BATCH_SIZE,
+            help='Number of events delivered per transaction.'
+        )
+        parser.add_argument(
+            '--follow',
+            action='store_true',
+            help='Keep delivering new events until interrupted.'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when the queue is empty (with --follow).'
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Print backlog metrics and exit.'
+        )
+
+    def print_backlog(self):
+        stats = notifications.backlog()
+        self.stdout.write(
+            f'pending: {stats["pending"]}, failed: {stats["failed"]}, '
+            f'oldest pending: {stats["oldest_seconds"]} s'
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_backlog()
+            return
+        if options['follow']:
+            try:
+                notifications.follow(
+                    options['batch_size'],
+                    options['interval'],
+                    log=lambda delivered: self.stdout.write(
+                        f'Delivered {delivered} notifications.'
+                    )
+                )
+            except KeyboardInterrupt:
+                pass
+            return
+        delivered = notifications.drain(options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Delivered {delivered} notifications.')
+        )
+        self.print_backlog()
@@ -0,0 +1,157 @@
+from django.contrib.auth.models import Permission, User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from yourgrades.models import Student, Teacher, Subject, Grades
+from ._synthetic import Rollback, create_school
+
+
+def sample_users():
+    """
+    Returns (subject, {role: user}) with a graded subject and users of the
+    roles that view it, given their role permissions. Teacher is missing
+    when no graded subject has one.
+    """
+    subjects = Subject.objects.filter(grades__isnull=False)
+    subject = subjects.filter(subjectteachers__isnull=False).first() or \
+        subjects.first()
+    users = {
+        'student': Student.objects.filter(
+            school_class_id=subject.school_class_id
+        ).first().user,
+        'manager': User.objects.create_user(username='explain_queries'),
+    }
+    teacher = Teacher.objects.filter(subjectteachers__subject=subject) \
+        .first()
+    if teacher is not None:
+        users['teacher'] = teacher.user
+    for role, user in users.items():
+        user.user_permissions.add(Permission.objects.get(
+            content_type__app_label='yourgrades',
+            codename=role
+        ))
+    return subject, users
+
+
+def hot_requests(subject, users):
+    """
+    Returns (role, URL name, URL kwargs) of the busiest views.
+    """
+    student = users['student']
+    requests = [
+        ('student', 'yourgrades:student_parent', {}),
+        ('student', 'yourgrades:timetable', {'person': 'student'}),
+        ('student', 'yourgrades:mailbox', {}),
+        ('manager', 'yourgrades:manager', {}),
+        ('manager', 'yourgrades:manager_student',
+         {'user_id': student.id}),
+        ('manager', 'yourgrades:subject_view',
+         {'class_unique_code': subject.school_class.unique_code,
+          'subject_unique_code': subject.unique_code}),
+    ]
+    if 'teacher' in users:
+        requests += [
+            ('teacher', 'yourgrades:teacher_subject',
+             {'subject_unique_code': subject.unique_code}),
+            ('teacher', 'yourgrades:timetable', {'person': 'teacher'}),
+            ('teacher', 'yourgrades:mailbox', {}),
+        ]
+    return requests
+
+
+def capture_queries(client, path):
+    """
+    Returns (status code, SELECT queries) of a GET of path, without the
+    session queries and repeated queries.
+    """
+    with CaptureQueriesContext(connection) as captured:
+        response = client.get(path)
+    queries = [
+        query['sql'] for query in captured
+        if query['sql'].startswith('SELECT')
+        and 'django_session' not in query['sql']
+    ]
+    return response.status_code, list(dict.fromkeys(queries))
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}')
+        return '\n'.join(
+            row if isinstance(row, str) else ' '.join(map(str, row))
+            for row in cursor.fetchall()
+        )
+
+
+class Command(BaseCommand):
+    help = 'Prints query plans of the queries run by the busiest views, ' \
+           'captured from requests to them. Write the output to a file ' \
+           'before and after a schema change and diff the files to ' \
+           'compare plans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--synthetic',
+            action='store_true',
+            help='Create a synthetic school first (rolled back at the end).'
+        )
+        parser.add_argument('--classes', type=int, default=20)
+        parser.add_argument('--students', type=int, default=30)
+        parser.add_argument('--grades', type=int, default=10)
+        parser.add_argument(
+            '--output',
+            help='File to write the plans to instead of stdout.'
+        )
+
+    def explain(self, options):
+        if options['synthetic']:
+            create_school(
+                classes=options['classes'],
+                students=options['students'],
+                grades=options['grades'],
+                log=lambda text: self.stderr.write(f'created {text}')
+            )
+        if not Grades.objects.exists():
+            self.stderr.write('No grades in the database, use --synthetic.')
+            return []
+        subject, users = sample_users()
+        clients = {}
+        for role, user in users.items():
+            clients[role] = Client()
+            clients[role].force_login(user)
+        lines = []
+        # Host of the test client, settings may not allow it
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for role, view, kwargs in hot_requests(subject, users):
+                status, queries = capture_queries(
+                    clients[role],
+                    reverse(view, kwargs=kwargs)
+                )
+                if status != 200:
+                    self.stderr.write(f'{view} as {role} returned {status}')
+                for number, sql in enumerate(queries, 1):
+                    lines.append(f'== {view} as {role}: query {number}')
+                    lines.append(sql)
+                    lines.append(explain(sql))
+                    lines.append('')
+        return lines
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                lines = self.explain(options)
+                raise Rollback
+        except Rollback:
+            pass
+        text = '\n'.join(lines)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(text)
+            self.stdout.write(self.style.SUCCESS(
+                f'Plans of {text.count("== ")} queries written to '
+                f'{options["output"]}'
+            ))
+        else:
+            self.stdout.write(text)
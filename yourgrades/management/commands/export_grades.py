@@ -0,0 +1,80 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from yourgrades.export import ExportError, grades_queryset, export_chunks, \
+    EXPORT_CHUNK_SIZE
+from yourgrades.models import SchoolClass, Subject
+
+
+class Command(BaseCommand):
+    help = 'Exports grades of the whole school, a school class or a ' \
+           'subject as CSV or XLSX. Grades are read in chunks, so memory ' \
+           'use does not depend on the number of grades.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--class',
+            dest='class_unique_code',
+            help='Export grades of this school class only.'
+        )
+        parser.add_argument(
+            '--subject',
+            dest='subject_unique_code',
+            help='Export grades of this subject only.'
+        )
+        parser.add_argument(
+            '--output',
+            help='File to write to, CSV is written to stdout by default.'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'xlsx'],
+            help='Export format, taken from the output file extension by '
+                 'default.'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help='Number of grades read per query.'
+        )
+
+    def handle(self, *args, **options):
+        school_class = subject = None
+        try:
+            if options['class_unique_code']:
+                school_class = SchoolClass.objects.get(
+                    unique_code=options['class_unique_code']
+                )
+            if options['subject_unique_code']:
+                subject = Subject.objects.get(
+                    unique_code=options['subject_unique_code']
+                )
+        except (SchoolClass.DoesNotExist, Subject.DoesNotExist) as error:
+            raise CommandError(error)
+        export_format = options['format'] or (
+            os.path.splitext(options['output'])[1][1:].lower()
+            if options['output'] else 'csv'
+        )
+        if export_format == 'xlsx' and not options['output']:
+            raise CommandError('XLSX export needs --output.')
+        try:
+            chunks = export_chunks(
+                grades_queryset(school_class, subject),
+                export_format,
+                chunk_size=options['chunk_size']
+            )
+            if not options['output']:
+                # CSV chunks are encoded whole strings, safe to decode apart
+                for chunk in chunks:
+                    self.stdout.write(chunk.decode(), ending='')
+                return
+            size = 0
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+                    size += len(chunk)
+        except (ExportError, OSError) as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Grades written to {options["output"]} ({size} bytes).'
+        ))
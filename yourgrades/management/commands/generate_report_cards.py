@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from yourgrades import reportcards
+from yourgrades.models import SchoolClass
+from ._synthetic import Rollback, create_school
+
+
+class Command(BaseCommand):
+    help = 'Writes report cards (HTML and PDF) of all students of a ' \
+           'school class or of all active classes to one ZIP archive. ' \
+           'Cards are rendered in a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the ZIP archive.')
+        parser.add_argument(
+            '--class',
+            dest='class_unique_code',
+            help='Generate cards of this school class only.'
+        )
+        parser.add_argument(
+            '--format',
+            dest='formats',
+            action='append',
+            choices=reportcards.FORMATS,
+            help='Card format, can be repeated. Both by default.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Number of worker processes, one per CPU by default. 1 '
+                 'renders in this process.'
+        )
+        parser.add_argument(
+            '--cards-per-task',
+            type=int,
+            default=reportcards.CARDS_PER_TASK,
+            help='Number of students rendered by a worker at once.'
+        )
+        parser.add_argument(
+            '--synthetic',
+            action='store_true',
+            help='Create a synthetic school first (rolled back at the end), '
+                 'for measuring the generation time.'
+        )
+        parser.add_argument('--classes', type=int, default=40)
+        parser.add_argument('--students', type=int, default=30)
+
+    def generate(self, options):
+        if options['synthetic']:
+            create_school(
+                classes=options['classes'],
+                students=options['students'],
+                grades=3,
+                messages=0,
+                log=lambda text: self.stderr.write(f'created {text}')
+            )
+        if options['class_unique_code']:
+            school_classes = SchoolClass.objects.filter(
+                unique_code=options['class_unique_code']
+            )
+            if not school_classes:
+                raise CommandError(
+                    f'School class {options["class_unique_code"]} does not '
+                    f'exist.'
+                )
+        else:
+            school_classes = SchoolClass.objects.filter(active=True)
+        return reportcards.generate(
+            school_classes,
+            options['output'],
+            formats=options['formats'] or reportcards.FORMATS,
+            workers=options['workers'],
+            cards_per_task=options['cards_per_task']
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                stats = self.generate(options)
+                if options['synthetic']:
+                    raise Rollback
+        except Rollback:
+            pass
+        except OSError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'{stats["cards"]} report cards of {stats["classes"]} classes '
+            f'written to {options["output"]} in {stats["seconds"]:.2f} s '
+            f'(data loaded in {stats["load_seconds"]:.2f} s).'
+        ))
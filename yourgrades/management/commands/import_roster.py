@@ -0,0 +1,58 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from yourgrades.models import SchoolClass
+from yourgrades.roster import RosterError, read_roster, validate_roster, \
+    import_roster, IMPORT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Imports students and parents of a school class from a CSV or ' \
+           'JSON roster. Nothing is imported when any row is invalid.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('class_unique_code')
+        parser.add_argument('roster')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'json'],
+            help='Roster format, taken from the file extension by default.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=IMPORT_BATCH_SIZE,
+            help='Number of rows inserted per query.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            school_class = SchoolClass.objects.get(
+                unique_code=options['class_unique_code']
+            )
+        except SchoolClass.DoesNotExist:
+            raise CommandError(
+                f'School class {options["class_unique_code"]} does not exist.'
+            )
+        roster_format = options['format'] or \
+            os.path.splitext(options['roster'])[1][1:].lower()
+        try:
+            with open(options['roster'], 'rb') as roster:
+                data = roster.read()
+            rows = validate_roster(read_roster(data, roster_format))
+        except OSError as error:
+            raise CommandError(error)
+        except RosterError as error:
+            for number, errors in error.errors:
+                self.stderr.write(f'row {number}: {errors.as_text()}')
+            raise CommandError(error)
+        stats = import_roster(
+            school_class,
+            rows,
+            batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {stats["students"]} students and {stats["parents"]} '
+            f'parents in {stats["seconds"]:.2f} s '
+            f'({stats["accounts_per_second"]:.1f} accounts/s, password '
+            f'hashing {stats["hashing_seconds"]:.2f} s).'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from yourgrades.models import GradeAverage
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the GradeAverage table from scratch using Grades.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows inserted per query.'
+        )
+
+    def handle(self, *args, **options):
+        created = GradeAverage.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {created} grade averages.')
+        )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from yourgrades.models import Grades
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the Grades table and GradeAverage from the GradeEvent ' \
+           'log, starting from the latest checkpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of students replayed and rows inserted at once.'
+        )
+
+    def handle(self, *args, **options):
+        created = Grades.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {created} grades.'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from yourgrades.models import UnreadCounter
+
+
+class Command(BaseCommand):
+    help = 'Recomputes unread mail counters of all users from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows inserted per query.'
+        )
+
+    def handle(self, *args, **options):
+        users = UnreadCounter.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Reconciled unread counters of {users} users.')
+        )
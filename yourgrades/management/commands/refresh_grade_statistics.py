@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from yourgrades.models import GradeStatistics
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the GradeStatistics snapshot shown on the manager ' \
+           'statistics dashboard. Run it periodically, e.g. from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows inserted per query.'
+        )
+
+    def handle(self, *args, **options):
+        created = GradeStatistics.refresh(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Refreshed statistics of {created} subjects.')
+        )
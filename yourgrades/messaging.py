@@ -0,0 +1,136 @@
+"""
+Message delivery. A message is stored once, with its sender, and reaches
+each recipient as one Delivery row; all rows are written with bulk inserts,
+so the number of queries doesn't grow with the audience size.
+
+Messages to a whole class, its parents or subject teachers are broadcasts:
+one Broadcast row names the audience and recipients are resolved when they
+read their mailboxes, so nothing is written per recipient until a
+broadcast is read.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery, F, Func, Q, \
+    IntegerField
+from .models import Message, Delivery, Broadcast, BroadcastRead, \
+    UnreadCounter
+
+DELIVERY_BATCH_SIZE = 500
+
+
+def deliver(message, user_ids, batch_size=DELIVERY_BATCH_SIZE):
+    """
+    Creates Delivery rows of saved message for all users.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return
+    with transaction.atomic():
+        Delivery.objects.bulk_create(
+            [Delivery(user_id=user_id, message=message)
+             for user_id in user_ids],
+            batch_size=batch_size
+        )
+        UnreadCounter.increment(user_ids)
+
+
+def send_message(message, user, user_ids, recipient_name=None):
+    """
+    Saves message as sent by user and delivers it to all users from
+    user_ids. When recipient_name is given, the message is also shown in
+    the sender's sent mailbox. Returns the message.
+    """
+    message.sender = user
+    message.recipient_name = recipient_name
+    with transaction.atomic():
+        message.save()
+        deliver(message, user_ids)
+    return message
+
+
+def send_broadcast(message, user, audience, school_class=None, subject=None,
+                   recipient_name=None):
+    """
+    Saves message as sent by user to audience (one of Broadcast.AUDIENCES)
+    of school_class or subject. Returns the message.
+    """
+    message.sender = user
+    message.recipient_name = recipient_name
+    with transaction.atomic():
+        message.save()
+        Broadcast.objects.create(
+            message=message,
+            audience=audience,
+            school_class=school_class,
+            subject=subject
+        )
+    return message
+
+
+def received_messages(user):
+    """
+    Returns queryset of messages delivered to user and broadcasts addressed
+    to user. Every message is annotated with unread_delivery and
+    unread_broadcast, at most one of them is True.
+    """
+    return Message.objects.filter(
+        Q(id__in=Delivery.objects.filter(user=user).values('message')) |
+        Q(id__in=Broadcast.for_user(user).values('message'))
+    ).annotate(
+        unread_delivery=Exists(
+            Delivery.objects.filter(
+                user=user,
+                message=OuterRef('pk'),
+                read=False
+            )
+        ),
+        unread_broadcast=Exists(
+            Broadcast.objects.filter(message=OuterRef('pk')).exclude(
+                reads__user=user
+            )
+        )
+    ).select_related('sender')
+
+
+def get_unread(user):
+    """
+    Returns the number of unread delivered messages and broadcasts of user,
+    read with one query.
+    """
+    counts = User.objects.filter(id=user.id).annotate(
+        delivered=Subquery(
+            UnreadCounter.objects.filter(user=OuterRef('pk')).values('unread')
+        ),
+        broadcasts=Subquery(
+            Broadcast.unread(user).order_by().annotate(
+                count=Func(
+                    F('pk'),
+                    function='COUNT',
+                    output_field=IntegerField()
+                )
+            ).values('count'),
+            output_field=IntegerField()
+        )
+    ).values_list('delivered', 'broadcasts').first()
+    if counts is None:
+        return 0
+    return sum(count or 0 for count in counts)
+
+
+def mark_read(user, message):
+    """
+    Marks message received by user as read.
+    """
+    with transaction.atomic():
+        # Conditional update, so a mail is counted as read only once
+        if Delivery.objects.filter(
+                user=user,
+                message=message,
+                read=False
+        ).update(read=True):
+            UnreadCounter.decrement(user.id)
+        elif Broadcast.objects.filter(message=message).exists():
+            BroadcastRead.objects.bulk_create(
+                [BroadcastRead(user=user, broadcast_id=message.id)],
+                ignore_conflicts=True
+            )
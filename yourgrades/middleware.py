@@ -0,0 +1,119 @@
+"""
+Per-request instrumentation. RequestStatsMiddleware counts SQL queries and
+measures database, template and total time of every request. The numbers
+are sent in the Server-Timing header and kept in a rolling per-view summary
+(last SUMMARY_WINDOW requests of each URL name in this process).
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+from django.db import connections
+
+SUMMARY_WINDOW = 200
+
+_samples = defaultdict(lambda: deque(maxlen=SUMMARY_WINDOW))
+_samples_lock = threading.Lock()
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.view_name = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.total_time = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+    def server_timing(self):
+        return f'db;dur={self.db_time * 1000:.1f};' \
+               f'desc="{self.queries} queries", ' \
+               f'tpl;dur={self.template_time * 1000:.1f}, ' \
+               f'total;dur={self.total_time * 1000:.1f}'
+
+
+def record(stats):
+    with _samples_lock:
+        _samples[stats.view_name].append((
+            stats.queries,
+            stats.db_time,
+            stats.template_time,
+            stats.total_time
+        ))
+
+
+def summary():
+    """
+    Returns dict {view name: {statistic: value}} of the recorded requests.
+    Times are in milliseconds.
+    """
+    with _samples_lock:
+        samples = {name: list(rows) for name, rows in _samples.items()}
+    result = {}
+    for name, rows in sorted(samples.items()):
+        queries, db_times, template_times, total_times = zip(*rows)
+        totals = sorted(total_times)
+        result[name] = {
+            'requests': len(rows),
+            'queries_avg': round(sum(queries) / len(rows), 1),
+            'queries_max': max(queries),
+            'db_ms_avg': round(sum(db_times) / len(rows) * 1000, 1),
+            'template_ms_avg': round(
+                sum(template_times) / len(rows) * 1000,
+                1
+            ),
+            'total_ms_avg': round(sum(totals) / len(rows) * 1000, 1),
+            'total_ms_p95': round(
+                totals[int(len(totals) * 0.95 - 0.5)] * 1000,
+                1
+            ),
+        }
+    return result
+
+
+def reset():
+    with _samples_lock:
+        _samples.clear()
+
+
+class RequestStatsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        request.request_stats = stats
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(stats.record_query)
+                )
+            response = self.get_response(request)
+        stats.total_time = time.perf_counter() - start
+
+        if request.resolver_match is not None:
+            stats.view_name = request.resolver_match.view_name
+            record(stats)
+        response['Server-Timing'] = stats.server_timing()
+        response.request_stats = stats
+        return response
+
+    def process_template_response(self, request, response):
+        start = time.perf_counter()
+
+        def rendered(response):
+            request.request_stats.template_time += \
+                time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
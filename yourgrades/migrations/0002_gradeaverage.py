@@ -0,0 +1,69 @@
+# Generated by Django 2.2.6 on 2026-10-18 18:54
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_grade_averages(apps, schema_editor):
+    Grades = apps.get_model('yourgrades', 'Grades')
+    GradeAverage = apps.get_model('yourgrades', 'GradeAverage')
+    rows = Grades.objects.values('student_id', 'subject_id').annotate(
+        weighted_sum=models.Sum(
+            models.F('grade') * models.F('weight'),
+            output_field=models.IntegerField()
+        ),
+        weight_sum=models.Sum('weight'),
+        count=models.Count('id'),
+        last_grade_date=models.Max('date')
+    ).order_by()
+    GradeAverage.objects.bulk_create(
+        (GradeAverage(**row) for row in rows),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yourgrades', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='schoolclass',
+            name='name',
+            field=models.CharField(help_text='Digit + lowercase letter e.g.: 1a', max_length=2),
+        ),
+        migrations.AlterField(
+            model_name='schoolclass',
+            name='unique_code',
+            field=models.CharField(help_text='Format: class name + year e.g.: 1b2019', max_length=6, unique=True, validators=[django.core.validators.RegexValidator('^[1-8]{1}[a-z]{1}[0-9]{4}$')]),
+        ),
+        migrations.AlterField(
+            model_name='schoolclass',
+            name='year',
+            field=models.IntegerField(help_text='Four-digit graduation year', validators=[django.core.validators.MinValueValidator(1800), django.core.validators.MaxValueValidator(9999)]),
+        ),
+        migrations.AlterField(
+            model_name='subject',
+            name='unique_code',
+            field=models.CharField(help_text='Format: subject shortcut + class shortcut e.g.: Hi2c2019', max_length=8, unique=True),
+        ),
+        migrations.CreateModel(
+            name='GradeAverage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weighted_sum', models.IntegerField(default=0)),
+                ('weight_sum', models.IntegerField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('last_grade_date', models.DateTimeField(blank=True, null=True)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='yourgrades.Student')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='yourgrades.Subject')),
+            ],
+            options={
+                'unique_together': {('student', 'subject')},
+            },
+        ),
+        migrations.RunPython(fill_grade_averages, migrations.RunPython.noop),
+    ]
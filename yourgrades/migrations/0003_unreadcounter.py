@@ -0,0 +1,42 @@
+# Generated by Django 2.2.6 on 2026-10-18 18:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_unread_counters(apps, schema_editor):
+    MailboxReceived = apps.get_model('yourgrades', 'MailboxReceived')
+    UnreadCounter = apps.get_model('yourgrades', 'UnreadCounter')
+    rows = MailboxReceived.objects.filter(read=False).values(
+        'recipient__user_id'
+    ).annotate(unread=models.Count('id')).order_by()
+    UnreadCounter.objects.bulk_create(
+        (
+            UnreadCounter(
+                user_id=row['recipient__user_id'],
+                unread=row['unread']
+            )
+            for row in rows
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('yourgrades', '0002_gradeaverage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_unread_counters, migrations.RunPython.noop),
+    ]
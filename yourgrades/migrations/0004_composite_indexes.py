@@ -0,0 +1,45 @@
+# Generated by Django 2.2.6 on 2026-10-18 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yourgrades', '0003_unreadcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='canceledgrades',
+            index=models.Index(fields=['subject', 'date'], name='canceled_subject_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grades',
+            index=models.Index(fields=['subject', 'manager_mode', 'date'], name='grades_subject_mode_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grades',
+            index=models.Index(fields=['student', 'subject', 'date'], name='grades_student_subject_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailboxreceived',
+            index=models.Index(fields=['recipient', 'read'], name='received_recipient_read_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailboxsent',
+            index=models.Index(fields=['sender', 'id'], name='sent_sender_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='schoolclass',
+            index=models.Index(fields=['active', 'name'], name='class_active_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subjectdate',
+            index=models.Index(fields=['subject', 'day', 'lesson_number'], name='date_subject_day_lesson_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teacher',
+            index=models.Index(fields=['active', 'name'], name='teacher_active_name_idx'),
+        ),
+    ]
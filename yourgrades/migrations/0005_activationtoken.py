@@ -0,0 +1,24 @@
+# Generated by Django 2.2.6 on 2026-10-18 19:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('yourgrades', '0004_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivationToken',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('digest', models.CharField(max_length=64)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
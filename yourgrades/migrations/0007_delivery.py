@@ -0,0 +1,141 @@
+# Generated by Django 2.2.6 on 2026-10-18 19:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BATCH_SIZE = 1000
+
+
+def fill_deliveries(apps, schema_editor):
+    Message = apps.get_model('yourgrades', 'Message')
+    Sender = apps.get_model('yourgrades', 'Sender')
+    MailboxReceived = apps.get_model('yourgrades', 'MailboxReceived')
+    MailboxSent = apps.get_model('yourgrades', 'MailboxSent')
+    Delivery = apps.get_model('yourgrades', 'Delivery')
+    Message.objects.update(
+        sender_id=models.Subquery(
+            Sender.objects.filter(
+                message_id=models.OuterRef('pk')
+            ).values('user_id')[:1]
+        ),
+        recipient_name=models.Subquery(
+            MailboxSent.objects.filter(
+                message_id=models.OuterRef('pk')
+            ).values('recipient')[:1]
+        )
+    )
+    rows = MailboxReceived.objects.values_list(
+        'recipient__user_id',
+        'message_id',
+        'read'
+    ).order_by('id')
+    Delivery.objects.bulk_create(
+        (
+            Delivery(user_id=user_id, message_id=message_id, read=read)
+            for user_id, message_id, read in rows.iterator()
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def fill_mailboxes(apps, schema_editor):
+    # Rows of the old tables are written message by message, like the
+    # delivery code using them did
+    Message = apps.get_model('yourgrades', 'Message')
+    Sender = apps.get_model('yourgrades', 'Sender')
+    Recipient = apps.get_model('yourgrades', 'Recipient')
+    MailboxReceived = apps.get_model('yourgrades', 'MailboxReceived')
+    MailboxSent = apps.get_model('yourgrades', 'MailboxSent')
+    Delivery = apps.get_model('yourgrades', 'Delivery')
+    for message in Message.objects.exclude(sender=None).iterator():
+        sender = Sender.objects.create(
+            user_id=message.sender_id,
+            message_id=message.id
+        )
+        if message.recipient_name is not None:
+            MailboxSent.objects.create(
+                sender=sender,
+                message_id=message.id,
+                recipient=message.recipient_name
+            )
+        reads = dict(
+            Delivery.objects.filter(message_id=message.id).values_list(
+                'user_id',
+                'read'
+            )
+        )
+        Recipient.objects.bulk_create(
+            [Recipient(user_id=user_id, message_id=message.id)
+             for user_id in reads],
+            batch_size=BATCH_SIZE
+        )
+        MailboxReceived.objects.bulk_create(
+            [MailboxReceived(
+                sender=sender,
+                recipient_id=recipient_id,
+                message_id=message.id,
+                read=reads[user_id]
+            ) for recipient_id, user_id in Recipient.objects.filter(
+                message_id=message.id
+            ).values_list('id', 'user_id')],
+            batch_size=BATCH_SIZE
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('yourgrades', '0006_notificationevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Delivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='recipient_name',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sent_messages', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='sender',
+            name='message',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='yourgrades.Message'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'id'], name='message_sender_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='message',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='yourgrades.Message'),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['user', 'id'], name='delivery_user_id_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='delivery',
+            unique_together={('user', 'message')},
+        ),
+        migrations.RunPython(fill_deliveries, fill_mailboxes),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 2.2.6 on 2026-10-18 19:44
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yourgrades', '0007_delivery'),
+    ]
+
+    operations = [
+        # Indexes go first, so the migration can be reversed
+        migrations.RemoveIndex(
+            model_name='mailboxreceived',
+            name='received_recipient_read_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='mailboxsent',
+            name='sent_sender_id_idx',
+        ),
+        migrations.RemoveField(
+            model_name='mailboxsent',
+            name='message',
+        ),
+        migrations.RemoveField(
+            model_name='mailboxsent',
+            name='sender',
+        ),
+        migrations.RemoveField(
+            model_name='recipient',
+            name='message',
+        ),
+        migrations.RemoveField(
+            model_name='recipient',
+            name='user',
+        ),
+        migrations.RemoveField(
+            model_name='sender',
+            name='message',
+        ),
+        migrations.RemoveField(
+            model_name='sender',
+            name='user',
+        ),
+        migrations.DeleteModel(
+            name='MailboxReceived',
+        ),
+        migrations.DeleteModel(
+            name='MailboxSent',
+        ),
+        migrations.DeleteModel(
+            name='Recipient',
+        ),
+        migrations.DeleteModel(
+            name='Sender',
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.6 on 2026-10-18 19:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('yourgrades', '0008_remove_mailbox_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='yourgrades.Message')),
+                ('audience', models.PositiveSmallIntegerField(choices=[(1, 'school class'), (2, 'class parents'), (3, 'subject teachers')])),
+                ('school_class', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='yourgrades.SchoolClass')),
+                ('subject', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='yourgrades.Subject')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BroadcastRead',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reads', to='yourgrades.Broadcast')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'broadcast')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='broadcast',
+            index=models.Index(fields=['audience', 'school_class'], name='broadcast_class_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='broadcast',
+            index=models.Index(fields=['audience', 'subject'], name='broadcast_subject_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.6 on 2026-10-18 20:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yourgrades', '0009_broadcast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradeStatistics',
+            fields=[
+                ('subject', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='yourgrades.Subject')),
+                ('count', models.IntegerField(default=0)),
+                ('grade_sum', models.IntegerField(default=0)),
+                ('weighted_sum', models.IntegerField(default=0)),
+                ('weight_sum', models.IntegerField(default=0)),
+                ('grade_1', models.IntegerField(default=0)),
+                ('grade_2', models.IntegerField(default=0)),
+                ('grade_3', models.IntegerField(default=0)),
+                ('grade_4', models.IntegerField(default=0)),
+                ('grade_5', models.IntegerField(default=0)),
+                ('grade_6', models.IntegerField(default=0)),
+                ('canceled', models.IntegerField(default=0)),
+                ('refreshed', models.DateTimeField()),
+                ('school_class', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='yourgrades.SchoolClass')),
+            ],
+        ),
+    ]
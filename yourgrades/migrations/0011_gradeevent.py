@@ -0,0 +1,124 @@
+# Generated by Django 2.2.6 on 2026-10-18 20:21
+
+import heapq
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+BATCH_SIZE = 1000
+
+ADDED = 1
+CANCELED = 2
+
+
+def fill_events(apps, schema_editor):
+    # Current grades and canceled grades are merged by date, so event ids
+    # follow the dates. Canceled grades get negative keys, their ids in
+    # Grades are gone. CanceledGrades.date was set by auto_now_add, it is
+    # the time of cancellation; the date the grade was given is lost. Such
+    # grades are added and canceled at the time of cancellation, so grades
+    # at an earlier day (?at= of ManagerStudentView) don't include them.
+    Grades = apps.get_model('yourgrades', 'Grades')
+    CanceledGrades = apps.get_model('yourgrades', 'CanceledGrades')
+    GradeEvent = apps.get_model('yourgrades', 'GradeEvent')
+
+    def events(model, sign, manager_mode):
+        rows = model.objects.order_by('date', 'id').values_list(
+            'date', 'id', 'student_id', 'subject_id', 'grade', 'weight',
+            *(['manager_mode'] if manager_mode else [])
+        )
+        for date, grade_id, student_id, subject_id, grade, weight, *mode \
+                in rows.iterator():
+            event = dict(grade_key=sign * grade_id, student_id=student_id,
+                         subject_id=subject_id, grade=grade, weight=weight,
+                         manager_mode=bool(mode and mode[0]), date=date)
+            yield date, ADDED, event
+            if sign < 0:
+                yield date, CANCELED, event
+
+    batch = []
+    for date, kind, event in heapq.merge(
+            events(Grades, 1, True),
+            events(CanceledGrades, -1, False),
+            key=lambda item: item[0]
+    ):
+        batch.append(GradeEvent(kind=kind, **event))
+        if len(batch) >= BATCH_SIZE:
+            GradeEvent.objects.bulk_create(batch)
+            batch = []
+    GradeEvent.objects.bulk_create(batch)
+
+
+def fill_canceled_grades(apps, schema_editor):
+    CanceledGrades = apps.get_model('yourgrades', 'CanceledGrades')
+    GradeEvent = apps.get_model('yourgrades', 'GradeEvent')
+    # The historical model is private to this migration, turning
+    # auto_now_add off keeps the dates of the events
+    CanceledGrades._meta.get_field('date').auto_now_add = False
+    rows = GradeEvent.objects.filter(kind=CANCELED).order_by('id')
+    CanceledGrades.objects.bulk_create(
+        (
+            CanceledGrades(student_id=event.student_id,
+                           subject_id=event.subject_id, grade=event.grade,
+                           weight=event.weight, date=event.date)
+            for event in rows.iterator()
+        ),
+        batch_size=BATCH_SIZE
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yourgrades', '0010_gradestatistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradeCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_event', models.IntegerField()),
+                ('date', models.DateTimeField()),
+                ('grades', models.TextField()),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='yourgrades.Student')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GradeEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'added'), (2, 'canceled'), (3, 'corrected')])),
+                ('grade_key', models.IntegerField()),
+                ('grade', models.PositiveSmallIntegerField()),
+                ('weight', models.PositiveSmallIntegerField()),
+                ('manager_mode', models.BooleanField(default=False)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='yourgrades.Student')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='yourgrades.Subject')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='grades',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='gradeevent',
+            index=models.Index(fields=['student', 'id'], name='event_student_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gradeevent',
+            index=models.Index(fields=['kind', 'subject', 'date'], name='event_kind_subject_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gradeevent',
+            index=models.Index(fields=['kind', 'date'], name='event_kind_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gradecheckpoint',
+            index=models.Index(fields=['student', 'date'], name='checkpoint_student_date_idx'),
+        ),
+        migrations.RunPython(fill_events, fill_canceled_grades),
+    ]
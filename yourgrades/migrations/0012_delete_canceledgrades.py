@@ -0,0 +1,21 @@
+# Generated by Django 2.2.6 on 2026-10-18 20:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yourgrades', '0011_gradeevent'),
+    ]
+
+    operations = [
+        # Index goes first, so the migration can be reversed
+        migrations.RemoveIndex(
+            model_name='canceledgrades',
+            name='canceled_subject_date_idx',
+        ),
+        migrations.DeleteModel(
+            name='CanceledGrades',
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.6 on 2026-10-18 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yourgrades', '0012_delete_canceledgrades'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsernameLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base', models.CharField(max_length=150, unique=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.6 on 2026-10-18 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yourgrades', '0013_usernamelock'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='grades',
+            index=models.Index(fields=['subject', 'date'], name='grades_subject_date_idx'),
+        ),
+    ]
@@ -1,8 +1,16 @@
-from django.db import models
+import json
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q, Max, Value, Sum, Count, OuterRef, \
+    Subquery
+from django.db.models.functions import Coalesce, Greatest
 from django.core.validators import (RegexValidator, MaxValueValidator,
                                     MinValueValidator
                                     )
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.crypto import salted_hmac, constant_time_compare
 from .permissions import RightsSupport
 
 
@@ -23,6 +31,14 @@ class SchoolClass(models.Model):
     )
     active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['active', 'name'],
+                name='class_active_name_idx'
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -65,6 +81,14 @@ class Teacher(PersonalData):
     email = models.EmailField()
     active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['active', 'name'],
+                name='teacher_active_name_idx'
+            ),
+        ]
+
     def __str__(self):
         return f'{self.name} {self.surname}'
 
@@ -112,6 +136,14 @@ class SubjectDate(models.Model):
         choices=LESSONS
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['subject', 'day', 'lesson_number'],
+                name='date_subject_day_lesson_idx'
+            ),
+        ]
+
 
 class SubjectTeachers(models.Model):
     teacher = models.ManyToManyField(Teacher)
@@ -127,7 +159,8 @@ class GradesData(models.Model):
     )
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
-    date = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, rows rebuilt from GradeEvent keep their dates
+    date = models.DateTimeField(default=timezone.now)
 
     def save(self, *args, **kwargs):
         self.full_clean()
@@ -138,54 +171,983 @@ class GradesData(models.Model):
 
 
 class Grades(GradesData):
+    """
+    Current grades, a projection of the GradeEvent log. save() and delete()
+    append the ADDED, CORRECTED or CANCELED event in the same transaction,
+    rebuild() recreates all rows from the log.
+    """
+    manager_mode = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['subject', 'manager_mode', 'date'],
+                name='grades_subject_mode_date_idx'
+            ),
+            models.Index(
+                fields=['subject', 'date'],
+                name='grades_subject_date_idx'
+            ),
+            models.Index(
+                fields=['student', 'subject', 'date'],
+                name='grades_student_subject_idx'
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # GradeAverage and the log are updated in the same transaction as
+        # the grade
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                previous = Grades.objects.filter(pk=self.pk).first()
+            super(Grades, self).save(*args, **kwargs)
+            if previous is not None:
+                GradeAverage.remove_grade(previous)
+            GradeAverage.add_grade(self)
+            if previous is None:
+                GradeEvent.record(GradeEvent.ADDED, self, self.date)
+            elif GradeEvent.values(previous) != GradeEvent.values(self):
+                GradeEvent.record(GradeEvent.CORRECTED, self)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            GradeEvent.record(GradeEvent.CANCELED, self)
+            result = super(Grades, self).delete(*args, **kwargs)
+            GradeAverage.remove_grade(self)
+        return result
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """
+        Recreates all rows from the latest checkpoints and the events after
+        them, keeping grade ids, then rebuilds GradeAverage. Returns the
+        number of created rows.
+        """
+        student_ids = list(
+            Student.objects.order_by('user_id').values_list(
+                'user_id',
+                flat=True
+            )
+        )
+        created = 0
+        with transaction.atomic():
+            cls.objects.all().delete()
+            for start in range(0, len(student_ids), batch_size):
+                replays = GradeCheckpoint.replay(
+                    student_ids[start:start + batch_size]
+                )
+                grades = [
+                    grade
+                    for student_id, replay in replays.items()
+                    for grade in GradeCheckpoint.to_grades(
+                        student_id,
+                        replay['grades']
+                    )
+                ]
+                cls.objects.bulk_create(grades)
+                created += len(grades)
+            GradeAverage.rebuild(batch_size=batch_size)
+        return created
+
+
+class GradeEvent(models.Model):
+    """
+    Append-only log of grade changes, rows are never updated or deleted.
+    grade_key is the id of the grade in Grades, all events of one grade
+    share it. Events carry the grade values after the change (before it
+    for CANCELED), date is the time of the change.
+    """
+    ADDED = 1
+    CANCELED = 2
+    CORRECTED = 3
+    KINDS = (
+        (ADDED, 'added'),
+        (CANCELED, 'canceled'),
+        (CORRECTED, 'corrected'),
+    )
+
+    kind = models.PositiveSmallIntegerField(choices=KINDS)
+    grade_key = models.IntegerField()
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    grade = models.PositiveSmallIntegerField()
+    weight = models.PositiveSmallIntegerField()
     manager_mode = models.BooleanField(default=False)
+    date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['student', 'id'],
+                name='event_student_id_idx'
+            ),
+            models.Index(
+                fields=['kind', 'subject', 'date'],
+                name='event_kind_subject_date_idx'
+            ),
+            models.Index(
+                fields=['kind', 'date'],
+                name='event_kind_date_idx'
+            ),
+        ]
+
+    @staticmethod
+    def values(grade):
+        return grade.grade, grade.weight, grade.manager_mode
+
+    @classmethod
+    def from_grade(cls, kind, grade, date=None):
+        return cls(
+            kind=kind,
+            grade_key=grade.pk,
+            student_id=grade.student_id,
+            subject_id=grade.subject_id,
+            grade=grade.grade,
+            weight=grade.weight,
+            manager_mode=grade.manager_mode,
+            date=date or timezone.now()
+        )
+
+    @classmethod
+    def record(cls, kind, grade, date=None):
+        event = cls.from_grade(kind, grade, date)
+        event.save()
+        return event
+
+    @classmethod
+    def record_added(cls, grades, batch_size=None):
+        """
+        Appends ADDED events of bulk created grades. Bulk inserts don't set
+        ids on MySQL and SQLite, missing ids are read back by student,
+        subject and date with one query; grades with the same ones get the
+        newest ids in insert order. Raises ValueError when grades can't be
+        found.
+        """
+        missing = defaultdict(list)
+        for grade in grades:
+            if grade.pk is None:
+                missing[grade.student_id, grade.subject_id, grade.date].append(
+                    grade
+                )
+        if missing:
+            rows = Grades.objects.filter(
+                student_id__in={key[0] for key in missing},
+                subject_id__in={key[1] for key in missing},
+                date__in={key[2] for key in missing}
+            ).order_by('id').values_list(
+                'id', 'student_id', 'subject_id', 'date'
+            )
+            ids = defaultdict(list)
+            for grade_id, *key in rows:
+                ids[tuple(key)].append(grade_id)
+            for key, key_grades in missing.items():
+                if len(ids[key]) < len(key_grades):
+                    raise ValueError(
+                        f'Grade of student {key[0]} and subject {key[1]} '
+                        f'from {key[2]} not found, grades must be saved '
+                        f'before their events are recorded.'
+                    )
+                for grade, grade_id in zip(
+                        key_grades,
+                        ids[key][-len(key_grades):]):
+                    grade.pk = grade_id
+        cls.objects.bulk_create(
+            [cls.from_grade(cls.ADDED, grade, grade.date) for grade in grades],
+            batch_size=batch_size
+        )
+
+
+class GradeCheckpoint(models.Model):
+    """
+    Grades of a student after the event last_event (with date of that
+    event), so replays of the log start from the latest checkpoint instead
+    of the first event. grades is a compact JSON list of [grade key,
+    subject id, grade, weight, manager mode, microseconds since the epoch
+    of the ADDED event] rows. Created periodically by create_due()
+    (checkpoint_grade_events management command).
+    """
+    EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    # Students get a new checkpoint after this many events
+    EVERY = 50
+
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    last_event = models.IntegerField()
+    date = models.DateTimeField()
+    grades = models.TextField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['student', 'date'],
+                name='checkpoint_student_date_idx'
+            ),
+        ]
+
+    @classmethod
+    def encode(cls, grades):
+        return json.dumps(
+            [
+                [key, subject_id, grade, weight, int(manager_mode),
+                 (added - cls.EPOCH) // timedelta(microseconds=1)]
+                for key, (subject_id, grade, weight, manager_mode, added)
+                in sorted(grades.items())
+            ],
+            separators=(',', ':')
+        )
+
+    @classmethod
+    def decode(cls, text):
+        return {
+            key: [subject_id, grade, weight, bool(manager_mode),
+                  cls.EPOCH + timedelta(microseconds=added)]
+            for key, subject_id, grade, weight, manager_mode, added
+            in json.loads(text)
+        }
+
+    @staticmethod
+    def apply(grades, event):
+        """
+        Applies event to grades, a dict {grade key: [subject id, grade,
+        weight, manager mode, date added]}.
+        """
+        if event.kind == GradeEvent.CANCELED:
+            grades.pop(event.grade_key, None)
+        elif event.kind == GradeEvent.ADDED:
+            grades[event.grade_key] = [event.subject_id, event.grade,
+                                       event.weight, event.manager_mode,
+                                       event.date]
+        elif event.grade_key in grades:
+            # A correction keeps the date the grade was given
+            grades[event.grade_key][1:4] = [event.grade, event.weight,
+                                            event.manager_mode]
+
+    @classmethod
+    def replay(cls, student_ids, date=None):
+        """
+        Returns {student id: {'grades': {grade key: row}, 'last_event',
+        'date', 'events'}} with grades of students after all events up to
+        date (all events when None). Each student starts from the latest
+        checkpoint not after date, events counts the events replayed on top
+        of it. Two queries.
+        """
+        checkpoints = cls.objects.filter(student=OuterRef('student'))
+        events = GradeEvent.objects.filter(student_id__in=student_ids)
+        if date is not None:
+            checkpoints = checkpoints.filter(date__lte=date)
+            events = events.filter(date__lte=date)
+        replays = {
+            student_id: {
+                'grades': {},
+                'last_event': 0,
+                'date': None,
+                'events': 0,
+            }
+            for student_id in student_ids
+        }
+        for checkpoint in cls.objects.filter(
+                student_id__in=student_ids,
+                id=Subquery(
+                    checkpoints.order_by('-last_event').values('id')[:1]
+                )
+        ):
+            replays[checkpoint.student_id].update(
+                grades=cls.decode(checkpoint.grades),
+                last_event=checkpoint.last_event,
+                date=checkpoint.date
+            )
+        latest = checkpoints.order_by('-last_event').values('last_event')[:1]
+        for event in events.filter(
+                id__gt=Coalesce(Subquery(latest), 0)
+        ).order_by('id').iterator():
+            replay = replays[event.student_id]
+            cls.apply(replay['grades'], event)
+            replay.update(
+                last_event=event.id,
+                date=event.date,
+                events=replay['events'] + 1
+            )
+        return replays
+
+    @staticmethod
+    def to_grades(student_id, grades):
+        """
+        Returns unsaved Grades of replayed grades ordered by date.
+        """
+        return sorted(
+            (
+                Grades(id=key, student_id=student_id, subject_id=subject_id,
+                       grade=grade, weight=weight, manager_mode=manager_mode,
+                       date=added)
+                for key, (subject_id, grade, weight, manager_mode, added)
+                in grades.items()
+            ),
+            key=lambda grade: (grade.date, grade.id)
+        )
+
+    @classmethod
+    def grades_at(cls, student, date):
+        """
+        Returns list of the student's grades at date, rebuilt from the log.
+        """
+        replay = cls.replay([student.pk], date)[student.pk]
+        return cls.to_grades(student.pk, replay['grades'])
+
+    @classmethod
+    def create_due(cls, every=EVERY, batch_size=1000):
+        """
+        Creates checkpoints of students with at least every events after
+        their latest checkpoint. Returns the number of created checkpoints.
+        """
+        student_ids = sorted(
+            row['student_id']
+            for row in GradeEvent.objects.filter(
+                id__gt=Coalesce(
+                    Subquery(
+                        cls.objects.filter(
+                            student=OuterRef('student')
+                        ).order_by('-last_event').values('last_event')[:1]
+                    ),
+                    0
+                )
+            ).values('student_id').annotate(
+                events=Count('id')
+            ).filter(events__gte=every).order_by()
+        )
+        created = 0
+        for start in range(0, len(student_ids), batch_size):
+            replays = cls.replay(student_ids[start:start + batch_size])
+            cls.objects.bulk_create(
+                [
+                    cls(
+                        student_id=student_id,
+                        last_event=replay['last_event'],
+                        date=replay['date'],
+                        grades=cls.encode(replay['grades'])
+                    )
+                    for student_id, replay in replays.items()
+                ]
+            )
+            created += len(replays)
+        return created
+
+
+class GradeAverage(models.Model):
+    """
+    Denormalized sums of a student's grades in a subject, maintained by
+    Grades.save()/delete(). Can be rebuilt with the rebuild_grade_averages
+    management command.
+    """
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    weighted_sum = models.IntegerField(default=0)
+    weight_sum = models.IntegerField(default=0)
+    count = models.IntegerField(default=0)
+    last_grade_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('student', 'subject')
+
+    @property
+    def average(self):
+        if not self.weight_sum:
+            return None
+        return round(self.weighted_sum / self.weight_sum, 2)
+
+    @classmethod
+    def add_grade(cls, grade):
+        changes = {
+            'weighted_sum': F('weighted_sum') + grade.grade * grade.weight,
+            'weight_sum': F('weight_sum') + grade.weight,
+            'count': F('count') + 1,
+            'last_grade_date': Coalesce(
+                Greatest(
+                    'last_grade_date',
+                    Value(grade.date, output_field=models.DateTimeField())
+                ),
+                Value(grade.date, output_field=models.DateTimeField())
+            ),
+        }
+        rows = cls.objects.filter(
+            student_id=grade.student_id,
+            subject_id=grade.subject_id
+        )
+        if rows.update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    student_id=grade.student_id,
+                    subject_id=grade.subject_id,
+                    weighted_sum=grade.grade * grade.weight,
+                    weight_sum=grade.weight,
+                    count=1,
+                    last_grade_date=grade.date
+                )
+        except IntegrityError:
+            # Row was created by a concurrent transaction
+            rows.update(**changes)
+
+    @classmethod
+    def add_grades(cls, grades):
+        """
+        add_grade() for many grades saved with bulk_create: existing rows
+        are locked, updated with bulk_update and missing rows bulk inserted.
+        """
+        totals = {}
+        for grade in grades:
+            key = (grade.student_id, grade.subject_id)
+            row = totals.setdefault(
+                key,
+                cls(student_id=key[0], subject_id=key[1])
+            )
+            row.weighted_sum += grade.grade * grade.weight
+            row.weight_sum += grade.weight
+            row.count += 1
+            row.last_grade_date = max(
+                row.last_grade_date or grade.date,
+                grade.date
+            )
+        if not totals:
+            return
+        with transaction.atomic():
+            existing = cls.objects.select_for_update().filter(
+                student_id__in={student_id for student_id, _ in totals},
+                subject_id__in={subject_id for _, subject_id in totals}
+            )
+            updated = []
+            for row in existing:
+                total = totals.pop((row.student_id, row.subject_id), None)
+                if total is None:
+                    continue
+                row.weighted_sum += total.weighted_sum
+                row.weight_sum += total.weight_sum
+                row.count += total.count
+                row.last_grade_date = max(
+                    row.last_grade_date or total.last_grade_date,
+                    total.last_grade_date
+                )
+                updated.append(row)
+            cls.objects.bulk_update(
+                updated,
+                ['weighted_sum', 'weight_sum', 'count', 'last_grade_date']
+            )
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create(totals.values())
+            except IntegrityError:
+                # Some rows were created by a concurrent transaction
+                for grade in grades:
+                    if (grade.student_id, grade.subject_id) in totals:
+                        cls.add_grade(grade)
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """
+        Recomputes all rows from Grades with a single GROUP BY query and
+        bulk inserts. Returns the number of created rows.
+        """
+        rows = Grades.objects.values('student_id', 'subject_id').annotate(
+            weighted_sum=Sum(
+                F('grade') * F('weight'),
+                output_field=models.IntegerField()
+            ),
+            weight_sum=Sum('weight'),
+            count=Count('id'),
+            last_grade_date=Max('date')
+        ).order_by()
+        created = 0
+        with transaction.atomic():
+            cls.objects.all().delete()
+            batch = []
+            for row in rows.iterator():
+                batch.append(cls(**row))
+                if len(batch) >= batch_size:
+                    cls.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            cls.objects.bulk_create(batch)
+            created += len(batch)
+        return created
+
+    @classmethod
+    def remove_grade(cls, grade):
+        last_grade_date = Grades.objects.filter(
+            student_id=grade.student_id,
+            subject_id=grade.subject_id
+        ).aggregate(last=Max('date'))['last']
+        cls.objects.filter(
+            student_id=grade.student_id,
+            subject_id=grade.subject_id
+        ).update(
+            weighted_sum=F('weighted_sum') - grade.grade * grade.weight,
+            weight_sum=F('weight_sum') - grade.weight,
+            count=F('count') - 1,
+            last_grade_date=last_grade_date
+        )
+
+
+class GradeStatistics(models.Model):
+    """
+    Snapshot of aggregated grades of one subject, read by the statistics
+    dashboard instead of aggregating Grades on each request. All rows are
+    recomputed by refresh() (refresh_grade_statistics management command),
+    figures of a class are sums of its subject rows.
+    """
+    GRADES = range(1, 7)
+
+    subject = models.OneToOneField(
+        Subject,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    school_class = models.ForeignKey(SchoolClass, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+    grade_sum = models.IntegerField(default=0)
+    weighted_sum = models.IntegerField(default=0)
+    weight_sum = models.IntegerField(default=0)
+    grade_1 = models.IntegerField(default=0)
+    grade_2 = models.IntegerField(default=0)
+    grade_3 = models.IntegerField(default=0)
+    grade_4 = models.IntegerField(default=0)
+    grade_5 = models.IntegerField(default=0)
+    grade_6 = models.IntegerField(default=0)
+    canceled = models.IntegerField(default=0)
+    refreshed = models.DateTimeField()
+
+    SUMMED_FIELDS = (
+        'count', 'grade_sum', 'weighted_sum', 'weight_sum', 'grade_1',
+        'grade_2', 'grade_3', 'grade_4', 'grade_5', 'grade_6', 'canceled',
+    )
+
+    @classmethod
+    def summarize(cls, row):
+        """
+        Adds mean, weighted_mean and distribution (counts of grades 1-6) to
+        a dict with SUMMED_FIELDS and returns it.
+        """
+        row['mean'] = round(row['grade_sum'] / row['count'], 2) \
+            if row['count'] else None
+        row['weighted_mean'] = round(
+            row['weighted_sum'] / row['weight_sum'],
+            2
+        ) if row['weight_sum'] else None
+        row['distribution'] = [row[f'grade_{grade}'] for grade in cls.GRADES]
+        return row
+
+    @classmethod
+    def per_subject(cls):
+        """
+        Returns summarized rows of all subjects ordered by class and name.
+        """
+        rows = cls.objects.values(
+            'subject__name',
+            'subject__unique_code',
+            'school_class__name',
+            'school_class__year',
+            'refreshed',
+            *cls.SUMMED_FIELDS
+        ).order_by('school_class__name', 'school_class__year', 'subject__name')
+        return [cls.summarize(row) for row in rows]
+
+    @classmethod
+    def per_class(cls):
+        """
+        Returns summarized rows of SUMMED_FIELDS summed per school class,
+        with one GROUP BY query on the snapshot.
+        """
+        # Annotations can't reuse the names of model fields
+        rows = list(cls.objects.values(
+            'school_class__name',
+            'school_class__year'
+        ).annotate(
+            **{f'{field}_total': Sum(field) for field in cls.SUMMED_FIELDS}
+        ).order_by('school_class__name', 'school_class__year'))
+        for row in rows:
+            for field in cls.SUMMED_FIELDS:
+                row[field] = row.pop(f'{field}_total')
+            cls.summarize(row)
+        return rows
 
+    @classmethod
+    def total(cls, class_rows):
+        """
+        Returns summarized sums of per_class() rows for the whole school.
+        """
+        return cls.summarize({
+            field: sum(row[field] for row in class_rows)
+            for field in cls.SUMMED_FIELDS
+        })
 
-class CanceledGrades(GradesData):
-    pass
+    @classmethod
+    def refresh(cls, batch_size=1000):
+        """
+        Recomputes all rows with one GROUP BY query on Grades and one on
+        CANCELED events of GradeEvent. Returns the number of created rows.
+        """
+        now = timezone.now()
+        rows = {}
+        for row in Grades.objects.values(
+                'subject_id',
+                'subject__school_class_id'
+        ).annotate(
+            count=Count('id'),
+            grade_sum=Sum('grade'),
+            weighted_sum=Sum(
+                F('grade') * F('weight'),
+                output_field=models.IntegerField()
+            ),
+            weight_sum=Sum('weight'),
+            **{
+                f'grade_{grade}': Count('id', filter=Q(grade=grade))
+                for grade in cls.GRADES
+            }
+        ).order_by().iterator():
+            row['school_class_id'] = row.pop('subject__school_class_id')
+            rows[row['subject_id']] = cls(refreshed=now, **row)
+        for row in GradeEvent.objects.filter(
+                kind=GradeEvent.CANCELED
+        ).values(
+                'subject_id',
+                'subject__school_class_id'
+        ).annotate(canceled=Count('id')).order_by().iterator():
+            if row['subject_id'] not in rows:
+                rows[row['subject_id']] = cls(
+                    subject_id=row['subject_id'],
+                    school_class_id=row['subject__school_class_id'],
+                    refreshed=now
+                )
+            rows[row['subject_id']].canceled = row['canceled']
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows.values(), batch_size=batch_size)
+        return len(rows)
 
 
 class Message(models.Model):
     text = models.TextField(max_length=1024)
     subject = models.CharField(max_length=128)
     date = models.DateTimeField(auto_now_add=True)
+    sender = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='sent_messages'
+    )
+    # Shown in the sender's sent mailbox, None keeps the message out of it
+    recipient_name = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['sender', 'id'],
+                name='message_sender_id_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return self.subject
 
 
-class Correspondent(models.Model):
-    id = models.AutoField(primary_key=True)
+class Delivery(models.Model):
+    """
+    Message in the received mailbox of one user.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    message = models.ForeignKey(Message, on_delete=models.CASCADE)
+    read = models.BooleanField(default=False)
 
     class Meta:
-        abstract = True
+        unique_together = ('user', 'message')
+        indexes = [
+            models.Index(fields=['user', 'id'], name='delivery_user_id_idx'),
+        ]
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super(Delivery, self).save(*args, **kwargs)
+            if adding and not self.read:
+                UnreadCounter.increment([self.user_id])
 
-class Sender(Correspondent):
-    message = models.OneToOneField(Message, on_delete=models.CASCADE)
 
-    def __str__(self):
-        return f'{self.user.first_name} {self.user.last_name}'
+class Broadcast(models.Model):
+    """
+    Message sent to a whole audience, stored as one row. Members of the
+    audience are resolved when the mailbox is read; users who joined after
+    the message was sent don't receive it. Read state is kept sparsely in
+    BroadcastRead, unread broadcasts are not counted by UnreadCounter.
+    """
+    SCHOOL_CLASS = 1
+    CLASS_PARENTS = 2
+    SUBJECT_TEACHERS = 3
+    AUDIENCES = (
+        (SCHOOL_CLASS, 'school class'),
+        (CLASS_PARENTS, 'class parents'),
+        (SUBJECT_TEACHERS, 'subject teachers'),
+    )
+
+    message = models.OneToOneField(
+        Message,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    audience = models.PositiveSmallIntegerField(choices=AUDIENCES)
+    school_class = models.ForeignKey(
+        SchoolClass,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True
+    )
+    subject = models.ForeignKey(
+        Subject,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True
+    )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['audience', 'school_class'],
+                name='broadcast_class_idx'
+            ),
+            models.Index(
+                fields=['audience', 'subject'],
+                name='broadcast_subject_idx'
+            ),
+        ]
 
-class Recipient(Correspondent):
-    message = models.ForeignKey(Message, on_delete=models.CASCADE)
+    @classmethod
+    def for_user(cls, user):
+        """
+        Returns queryset of broadcasts addressed to user.
+        """
+        return cls.objects.filter(
+            Q(
+                audience=cls.SCHOOL_CLASS,
+                school_class__in=Student.objects.filter(
+                    user=user
+                ).values('school_class')
+            ) | Q(
+                audience=cls.CLASS_PARENTS,
+                school_class__in=Student.objects.filter(
+                    parent__user=user
+                ).values('school_class')
+            ) | Q(
+                audience=cls.SUBJECT_TEACHERS,
+                subject__in=SubjectTeachers.objects.filter(
+                    teacher__user=user
+                ).values('subject')
+            ),
+            message__date__gte=user.date_joined
+        )
 
-    def __str__(self):
-        return f'{self.user.first_name} {self.user.last_name}'
+    @classmethod
+    def unread(cls, user):
+        """
+        Returns queryset of broadcasts addressed to user and not read yet.
+        """
+        return cls.for_user(user).exclude(reads__user=user)
 
 
-class Mailbox(models.Model):
-    id = models.AutoField(primary_key=True)
-    sender = models.ForeignKey(Sender, on_delete=models.CASCADE)
-    message = models.ForeignKey(Message, on_delete=models.CASCADE)
+class BroadcastRead(models.Model):
+    """
+    Broadcast read by user. Rows exist only for read broadcasts.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    broadcast = models.ForeignKey(
+        Broadcast,
+        on_delete=models.CASCADE,
+        related_name='reads'
+    )
 
     class Meta:
-        abstract = True
+        unique_together = ('user', 'broadcast')
 
 
-class MailboxReceived(Mailbox):
-    recipient = models.ForeignKey(Recipient, on_delete=models.CASCADE)
-    read = models.BooleanField(default=False)
+class UnreadCounter(models.Model):
+    """
+    Number of unread Delivery rows per user. Updated when mails are
+    delivered or read, can be recomputed with the reconcile_unread_counters
+    management command.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    unread = models.IntegerField(default=0)
+
+    @classmethod
+    def get_unread(cls, user):
+        unread = cls.objects.filter(user=user).values_list(
+            'unread',
+            flat=True
+        ).first()
+        return unread or 0
+
+    @classmethod
+    def increment(cls, user_ids):
+        """
+        Adds one unread mail for each occurrence of user id in user_ids.
+        """
+        amounts = Counter(user_ids)
+        if not amounts:
+            return
+        existing = set(
+            cls.objects.filter(user_id__in=list(amounts)).values_list(
+                'user_id',
+                flat=True
+            )
+        )
+        missing = [user_id for user_id in amounts if user_id not in existing]
+        if missing:
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create(
+                        [cls(user_id=user_id) for user_id in missing]
+                    )
+            except IntegrityError:
+                # Some rows were created by a concurrent transaction
+                for user_id in missing:
+                    cls.objects.get_or_create(user_id=user_id)
+        users_by_amount = defaultdict(list)
+        for user_id, amount in amounts.items():
+            users_by_amount[amount].append(user_id)
+        for amount, users in users_by_amount.items():
+            cls.objects.filter(user_id__in=users).update(
+                unread=F('unread') + amount
+            )
+
+    @classmethod
+    def decrement(cls, user_id):
+        cls.objects.filter(user_id=user_id, unread__gt=0).update(
+            unread=F('unread') - 1
+        )
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """
+        Recomputes all counters from Delivery. Returns the number of users
+        with unread mails.
+        """
+        rows = Delivery.objects.filter(read=False).values(
+            'user_id'
+        ).annotate(unread=Count('id')).order_by()
+        counters = [
+            cls(user_id=row['user_id'], unread=row['unread'])
+            for row in rows.iterator()
+        ]
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(counters, batch_size=batch_size)
+        return len(counters)
+
+
+class ActivationToken(models.Model):
+    """
+    One-time credential of an account created with an unusable password
+    (GRADEBOOK_DEFERRED_CREDENTIALS). The token is the initial password shown
+    to managers; only its keyed SHA-256 digest is stored, so issuing tokens
+    costs no PBKDF2 work. Accepted by ActivationTokenBackend until the user
+    sets a password in FirstLoginView.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    digest = models.CharField(max_length=64)
+    created = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def make_digest(user_id, token):
+        return salted_hmac(
+            'yourgrades.ActivationToken',
+            f'{user_id}:{token}'
+        ).hexdigest()
+
+    @classmethod
+    def issue(cls, tokens, batch_size=1000):
+        """
+        Replaces activation tokens of users, tokens is a dict
+        {user id: token}.
+        """
+        with transaction.atomic():
+            cls.objects.filter(user_id__in=list(tokens)).delete()
+            cls.objects.bulk_create(
+                [cls(user_id=user_id, digest=cls.make_digest(user_id, token))
+                 for user_id, token in tokens.items()],
+                batch_size=batch_size
+            )
 
+    @classmethod
+    def verify(cls, user, token):
+        digest = cls.objects.filter(user=user).values_list(
+            'digest',
+            flat=True
+        ).first()
+        return digest is not None and constant_time_compare(
+            digest,
+            cls.make_digest(user.id, token)
+        )
+
+    @classmethod
+    def consume(cls, user):
+        cls.objects.filter(user=user).delete()
+
+
+class UsernameLock(models.Model):
+    """
+    One row per username base (name + surname), locked with
+    select_for_update() while usernames of the base are allocated and
+    written, so concurrent allocations of the same name wait for each
+    other (see usernames.py).
+    """
+    base = models.CharField(max_length=150, unique=True)
+
+
+class NotificationEvent(models.Model):
+    """
+    Message to one user waiting for delivery. Grade changes only insert
+    events; the deliver_notifications command turns them into mails in
+    batches (see notifications.py).
+    """
+    sender = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    recipient = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    subject = models.CharField(max_length=128)
+    text = models.TextField(max_length=1024)
+    created = models.DateTimeField(auto_now_add=True)
+    delivered = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['delivered', 'id'],
+                name='notification_pending_idx'
+            ),
+        ]
 
-class MailboxSent(Mailbox):
-    recipient = models.CharField(max_length=64)
+    @classmethod
+    def enqueue(cls, message, user, user_ids, batch_size=1000):
+        """
+        Queues unsaved message from user to all users from user_ids.
+        """
+        cls.objects.bulk_create(
+            [cls(sender=user, recipient_id=user_id, subject=message.subject,
+                 text=message.text)
+             for user_id in dict.fromkeys(user_ids)],
+            batch_size=batch_size
+        )
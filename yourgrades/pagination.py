@@ -0,0 +1,154 @@
+"""
+Keyset (cursor) pagination. Pages are read with a WHERE condition on the
+ordering columns instead of OFFSET, so every page costs one indexed query no
+matter how deep it is. The total is a cached COUNT, shown as approximate.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import math
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+COUNT_CACHE_TIMEOUT = 60 * 5
+
+FIRST = 'first'
+NEXT = 'next'
+PREVIOUS = 'previous'
+LAST = 'last'
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    def previous_cursor(self):
+        return self.paginator.encode(PREVIOUS, self.object_list[0])
+
+    def next_cursor(self):
+        return self.paginator.encode(NEXT, self.object_list[-1])
+
+
+class KeysetPaginator:
+    """
+    Paginates queryset by the ordering fields, e.g. ('date', 'id') or
+    ('-id',). The last field has to be unique. Cursors passed to get_page()
+    are opaque strings from KeysetPage.next_cursor()/previous_cursor() or
+    'last'; an empty or broken cursor gives the first page.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('date', 'id')):
+        self.ordering = tuple(ordering)
+        self.fields = [
+            queryset.model._meta.get_field(name.lstrip('-'))
+            for name in self.ordering
+        ]
+        self.queryset = queryset.order_by(*self.ordering)
+        self.per_page = per_page
+
+    def encode(self, direction, obj):
+        values = [field.value_to_string(obj) for field in self.fields]
+        return base64.urlsafe_b64encode(
+            json.dumps([direction] + values).encode()
+        ).decode().rstrip('=')
+
+    def decode(self, cursor):
+        """
+        Returns (direction, key values) of cursor, (FIRST, None) when it
+        can't be read.
+        """
+        if cursor == LAST:
+            return LAST, None
+        try:
+            direction, *values = json.loads(
+                base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            )
+            if direction not in (NEXT, PREVIOUS) or \
+                    len(values) != len(self.fields):
+                raise ValueError
+            return direction, [
+                field.to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (TypeError, ValueError, binascii.Error, ValidationError):
+            return FIRST, None
+
+    def seek(self, values, backwards):
+        """
+        Returns Q matching rows after the key values in the paginator's
+        ordering (or before them, when backwards).
+        """
+        condition = Q()
+        for position, name in enumerate(self.ordering):
+            descending = name.startswith('-') != backwards
+            lookup = 'lt' if descending else 'gt'
+            step = Q(**{f'{name.lstrip("-")}__{lookup}': values[position]})
+            for previous_name, value in zip(
+                    self.ordering[:position],
+                    values[:position]):
+                step &= Q(**{previous_name.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def reversed_ordering(self):
+        return [
+            name[1:] if name.startswith('-') else f'-{name}'
+            for name in self.ordering
+        ]
+
+    def get_page(self, cursor=None):
+        direction, values = self.decode(cursor or '')
+        queryset = self.queryset
+        backwards = direction in (PREVIOUS, LAST)
+        if backwards:
+            queryset = queryset.order_by(*self.reversed_ordering())
+        if values is not None:
+            queryset = queryset.filter(self.seek(values, backwards))
+
+        object_list = list(queryset[:self.per_page + 1])
+        more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if backwards:
+            object_list.reverse()
+            if not object_list and direction == PREVIOUS:
+                return self.get_page()
+            return KeysetPage(object_list, self, more, direction == PREVIOUS)
+        if not object_list and direction == NEXT:
+            return self.get_page(LAST)
+        return KeysetPage(object_list, self, direction == NEXT, more)
+
+    @cached_property
+    def approx_count(self):
+        """
+        Number of rows, counted at most once per COUNT_CACHE_TIMEOUT.
+        """
+        key = 'yourgrades:count:' + hashlib.md5(
+            str(self.queryset.query).encode()
+        ).hexdigest()
+        return cache.get_or_set(key, self.queryset.count, COUNT_CACHE_TIMEOUT)
+
+    @property
+    def approx_num_pages(self):
+        return max(1, math.ceil(self.approx_count / self.per_page))
@@ -0,0 +1,114 @@
+"""
+Minimal PDF writer for text documents: pages of positioned text and lines
+in the standard Helvetica fonts, with Polish letters mapped through a
+cp1250 encoding. Pure Python, no fonts are embedded.
+"""
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+
+FONTS = {'regular': 'Helvetica', 'bold': 'Helvetica-Bold'}
+
+# cp1250 codes of Polish letters missing from WinAnsiEncoding
+POLISH_GLYPHS = {
+    0x8C: 'Sacute', 0x8F: 'Zacute', 0x9C: 'sacute', 0x9F: 'zacute',
+    0xA3: 'Lslash', 0xA5: 'Aogonek', 0xAF: 'Zdotaccent', 0xB3: 'lslash',
+    0xB9: 'aogonek', 0xBF: 'zdotaccent', 0xC6: 'Cacute', 0xCA: 'Eogonek',
+    0xD1: 'Nacute', 0xE6: 'cacute', 0xEA: 'eogonek', 0xF1: 'nacute',
+}
+
+
+def encode_text(text):
+    """
+    Returns text as an escaped PDF string literal.
+    """
+    data = str(text).encode('cp1250', errors='replace')
+    data = data.replace(b'\\', b'\\\\').replace(b'(', b'\\(') \
+        .replace(b')', b'\\)')
+    return b'(' + data + b')'
+
+
+class PDFDocument:
+    """
+    Collects pages drawn with text() and line() and returns the file from
+    render(). Coordinates are points from the top left corner of a page.
+    """
+
+    def __init__(self):
+        self.pages = []
+        self.add_page()
+
+    def add_page(self):
+        self.pages.append([])
+
+    def text(self, x, y, text, size=11, font='regular'):
+        self.pages[-1].append(
+            b'BT /%s %d Tf %.2f %.2f Td %s Tj ET' % (
+                font.encode(),
+                size,
+                x,
+                PAGE_HEIGHT - y,
+                encode_text(text)
+            )
+        )
+
+    def line(self, x1, y1, x2, y2, width=0.5):
+        self.pages[-1].append(
+            b'%.2f w %.2f %.2f m %.2f %.2f l S' % (
+                width,
+                x1,
+                PAGE_HEIGHT - y1,
+                x2,
+                PAGE_HEIGHT - y2
+            )
+        )
+
+    def render(self):
+        differences = b' '.join(
+            b'%d /%s' % (code, name.encode())
+            for code, name in sorted(POLISH_GLYPHS.items())
+        )
+        # Objects 1-2: catalog and page tree, 3: encoding, then fonts and
+        # (page, content) pairs
+        objects = [None, None, b'<< /Type /Encoding /BaseEncoding '
+                               b'/WinAnsiEncoding /Differences [%s] >>'
+                   % differences]
+        font_refs = []
+        for name, base_font in FONTS.items():
+            objects.append(
+                b'<< /Type /Font /Subtype /Type1 /BaseFont /%s '
+                b'/Encoding 3 0 R >>' % base_font.encode()
+            )
+            font_refs.append(b'/%s %d 0 R' % (name.encode(), len(objects)))
+        resources = b'<< /Font << %s >> >>' % b' '.join(font_refs)
+        page_refs = []
+        for page in self.pages:
+            content = b'\n'.join(page)
+            objects.append(
+                b'<< /Length %d >>\nstream\n%s\nendstream'
+                % (len(content), content)
+            )
+            objects.append(
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                b'/Resources %s /Contents %d 0 R >>'
+                % (PAGE_WIDTH, PAGE_HEIGHT, resources, len(objects))
+            )
+            page_refs.append(b'%d 0 R' % len(objects))
+        objects[0] = b'<< /Type /Catalog /Pages 2 0 R >>'
+        objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(page_refs),
+            len(page_refs)
+        )
+
+        output = bytearray(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(len(output))
+            output += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+        xref = len(output)
+        output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        for offset in offsets:
+            output += b'%010d 00000 n \n' % offset
+        output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n' \
+                  b'%%%%EOF\n' % (len(objects) + 1, xref)
+        return bytes(output)
@@ -0,0 +1,75 @@
+"""
+Loaders that fetch all the data a view needs in a constant number of queries
+and group it in Python.
+"""
+from .models import Student, Subject, Grades, GradeAverage
+
+
+def load_grade_sheet(student):
+    """
+    Returns a dict {subject: [grades]} for all subjects of the student's
+    class. Two queries are used regardless of the number of subjects/grades.
+    """
+    subjects = Subject.objects.filter(school_class_id=student.school_class_id)
+    sheet = {subject: [] for subject in subjects}
+    subjects_by_id = {subject.id: subject for subject in sheet}
+
+    grades = Grades.objects.filter(
+        student=student,
+        subject_id__in=list(subjects_by_id)
+    ).order_by('date', 'id')
+    for grade in grades:
+        subject = subjects_by_id[grade.subject_id]
+        # Reuse already loaded objects, so templates don't trigger lazy
+        # queries for grade.subject / grade.student
+        grade.subject = subject
+        grade.student = student
+        sheet[subject].append(grade)
+    return sheet
+
+
+def load_grade_matrix(subject):
+    """
+    Returns a list of (student, [grades]) tuples for all students of the
+    subject's class ordered by surname. Two queries regardless of class size.
+    """
+    students = Student.objects.filter(
+        school_class_id=subject.school_class_id
+    ).select_related('user', 'school_class').order_by('surname')
+    matrix = [(student, []) for student in students]
+    grades_by_student = {student.user_id: grades for student, grades in matrix}
+
+    grades = Grades.objects.filter(subject=subject).order_by('date', 'id')
+    for grade in grades:
+        if grade.student_id in grades_by_student:
+            grade.subject = subject
+            grades_by_student[grade.student_id].append(grade)
+    return matrix
+
+
+def load_class_rosters(school_classes):
+    """
+    Returns a dict {school_class: [students]} for the given classes, fetching
+    students of all classes with one query.
+    """
+    rosters = {school_class: [] for school_class in school_classes}
+    classes_by_id = {school_class.id: school_class for school_class in rosters}
+    students = Student.objects.filter(
+        school_class_id__in=list(classes_by_id)
+    ).order_by('school_class__name', 'surname')
+    for student in students:
+        school_class = classes_by_id[student.school_class_id]
+        student.school_class = school_class
+        rosters[school_class].append(student)
+    return rosters
+
+
+def load_averages(key, **filters):
+    """
+    Returns weighted averages from GradeAverage as a dict keyed by the given
+    field, e.g. load_averages('subject_id', student=student). One query.
+    """
+    return {
+        getattr(row, key): row.average
+        for row in GradeAverage.objects.filter(count__gt=0, **filters)
+    }
@@ -0,0 +1,240 @@
+"""
+Report cards. Everything a card shows is loaded for all requested classes
+with a constant number of queries into plain dicts, one dataset per class.
+Datasets are split into tasks of CARDS_PER_TASK students, rendered as HTML
+and PDF in a process pool (workers don't use the database) and written to
+one ZIP archive.
+"""
+import os
+import time
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.apps import apps
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.formats import number_format
+from .models import Student, Subject, SubjectTeachers, GradeAverage
+from .pdf import PDFDocument, PAGE_HEIGHT
+
+CARDS_PER_TASK = 50
+
+FORMATS = ('html', 'pdf')
+
+
+def load_datasets(school_classes):
+    """
+    Returns list of class datasets: {'school_class': {...}, 'subjects':
+    [{'id', 'name', 'teachers'}], 'students': [{'id', 'name', 'surname',
+    'averages': {subject id: average}}]}. Four queries regardless of the
+    number of classes and students.
+    """
+    school_classes = list(school_classes)
+    subjects = defaultdict(list)
+    subjects_by_id = {}
+    for subject in Subject.objects.filter(
+            school_class__in=school_classes
+    ).order_by('name').values('id', 'name', 'school_class_id'):
+        subject['teachers'] = []
+        subjects[subject.pop('school_class_id')].append(subject)
+        subjects_by_id[subject['id']] = subject
+    for subject_id, name, surname in SubjectTeachers.teacher.through.objects \
+            .filter(subjectteachers__subject_id__in=list(subjects_by_id)) \
+            .order_by('teacher__surname') \
+            .values_list('subjectteachers__subject_id', 'teacher__name',
+                         'teacher__surname'):
+        subjects_by_id[subject_id]['teachers'].append(f'{name} {surname}')
+
+    students = defaultdict(list)
+    students_by_id = {}
+    for student in Student.objects.filter(
+            school_class__in=school_classes
+    ).order_by('surname', 'name').values(
+        'user_id',
+        'name',
+        'surname',
+        'school_class_id'
+    ):
+        card = {
+            'id': student['user_id'],
+            'name': student['name'],
+            'surname': student['surname'],
+            'averages': {},
+        }
+        students[student['school_class_id']].append(card)
+        students_by_id[card['id']] = card
+    for student_id, subject_id, weighted_sum, weight_sum in \
+            GradeAverage.objects.filter(
+                student_id__in=list(students_by_id),
+                subject_id__in=list(subjects_by_id),
+                weight_sum__gt=0
+            ).values_list('student_id', 'subject_id', 'weighted_sum',
+                          'weight_sum'):
+        # Same rounding as GradeAverage.average
+        students_by_id[student_id]['averages'][subject_id] = round(
+            weighted_sum / weight_sum,
+            2
+        )
+
+    return [
+        {
+            'school_class': {
+                'id': school_class.id,
+                'name': school_class.name,
+                'year': school_class.year,
+                'unique_code': school_class.unique_code,
+            },
+            'subjects': subjects[school_class.id],
+            'students': students[school_class.id],
+        }
+        for school_class in school_classes
+    ]
+
+
+def card_rows(dataset, student):
+    """
+    Returns (subject name, teachers, average) rows of student's card.
+    """
+    return [
+        (subject['name'], ', '.join(subject['teachers']),
+         student['averages'].get(subject['id']))
+        for subject in dataset['subjects']
+    ]
+
+
+def render_html(dataset, student, issued):
+    return render_to_string('yourgrades/reportcard.html', {
+        'school_class': dataset['school_class'],
+        'student': student,
+        'rows': card_rows(dataset, student),
+        'issued': issued,
+    })
+
+
+def render_pdf(dataset, student, issued):
+    document = PDFDocument()
+    school_class = dataset['school_class']
+    document.text(50, 60, 'KARTA OCEN', size=18, font='bold')
+    document.text(
+        50,
+        90,
+        f'{student["name"]} {student["surname"]}',
+        size=14,
+        font='bold'
+    )
+    document.text(
+        50,
+        110,
+        f'Klasa: {school_class["name"]} ({school_class["year"]})'
+    )
+    document.text(50, 126, f'Data wydania: {issued}')
+
+    def header(y):
+        document.text(50, y, 'Przedmiot', font='bold')
+        document.text(220, y, 'Nauczyciele', font='bold')
+        document.text(470, y, 'Średnia', font='bold')
+        document.line(50, y + 6, 545, y + 6)
+        return y + 22
+
+    y = header(160)
+    for subject, teachers, average in card_rows(dataset, student):
+        if y > PAGE_HEIGHT - 60:
+            document.add_page()
+            y = header(60)
+        document.text(50, y, subject[:30])
+        document.text(220, y, teachers[:42], size=9)
+        document.text(
+            470,
+            y,
+            '-' if average is None else number_format(average, 2)
+        )
+        y += 18
+    return document.render()
+
+
+def card_name(dataset, student, card_format):
+    file_name = f'{student["surname"]}_{student["name"]}_{student["id"]}'
+    for character in ' /\\':
+        file_name = file_name.replace(character, '_')
+    return f'{dataset["school_class"]["unique_code"]}/{file_name}.' \
+           f'{card_format}'
+
+
+def render_cards(task):
+    """
+    Returns list of (archive name, bytes) of the cards of a task:
+    (dataset, formats, issued).
+    """
+    dataset, formats, issued = task
+    renderers = {'html': render_html, 'pdf': render_pdf}
+    files = []
+    for student in dataset['students']:
+        for card_format in formats:
+            content = renderers[card_format](dataset, student, issued)
+            if isinstance(content, str):
+                content = content.encode()
+            files.append((card_name(dataset, student, card_format), content))
+    return files
+
+
+def split_tasks(datasets, formats, issued, cards_per_task=CARDS_PER_TASK):
+    """
+    Yields tasks with up to cards_per_task students of one class each.
+    """
+    for dataset in datasets:
+        students = dataset['students']
+        for start in range(0, len(students), cards_per_task):
+            yield (
+                dict(dataset, students=students[start:start + cards_per_task]),
+                formats,
+                issued
+            )
+
+
+def setup_worker():
+    # Needed with the spawn start method, workers forked from a configured
+    # process have the apps ready already
+    if not apps.ready:
+        django.setup()
+
+
+def generate(school_classes, output, formats=FORMATS, workers=None,
+             cards_per_task=CARDS_PER_TASK):
+    """
+    Writes report cards of all students of school_classes to a ZIP archive
+    at output (path or file object). workers=1 renders in this process,
+    None uses one worker per CPU. Returns dict with the number of cards
+    and timings.
+    """
+    start = time.perf_counter()
+    datasets = load_datasets(school_classes)
+    loaded = time.perf_counter()
+    issued = timezone.localdate().isoformat()
+    tasks = split_tasks(datasets, tuple(formats), issued, cards_per_task)
+    workers = workers or os.cpu_count() or 1
+    cards = 0
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        if workers == 1:
+            results = map(render_cards, tasks)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=setup_worker
+            )
+            results = executor.map(render_cards, tasks)
+        try:
+            for files in results:
+                for name, content in files:
+                    archive.writestr(name, content)
+                cards += len(files) // len(formats)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    return {
+        'classes': len(datasets),
+        'cards': cards,
+        'load_seconds': loaded - start,
+        'seconds': time.perf_counter() - start,
+    }
@@ -0,0 +1,106 @@
+"""
+User roles (manager, teacher, student, parent). A role is resolved from the
+yourgrades permissions once, at login, and kept in the session with the
+primary key of the user's Student/Parent/Teacher row, so views don't build
+the permission set on every request.
+
+Each user has a role version in the cache. bump_role_version() (called when
+an account or its permissions change, see signals.py) makes sessions resolve
+the role again on their next request.
+"""
+import uuid
+from django.contrib.auth.mixins import LoginRequiredMixin, \
+    UserPassesTestMixin
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.db.models import Q
+from .models import Student, Parent, Teacher
+
+# Order decides the role of users with more than one role permission
+ROLES = ('manager', 'teacher', 'student', 'parent')
+PERSON_MODELS = {'teacher': Teacher, 'student': Student, 'parent': Parent}
+
+SESSION_KEY = 'yourgrades_role'
+VERSION_KEY = 'yourgrades:role:version:{}'
+
+
+def get_role_version(user_id):
+    # A version evicted from the cache is replaced with a new one, so
+    # eviction can only make sessions resolve roles again
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_role_version(user_id):
+    cache.set(VERSION_KEY.format(user_id), uuid.uuid4().hex, None)
+
+
+def resolve_role(user):
+    """
+    Returns (role, person primary key) of user, role is None for users
+    without a yourgrades role and the key is None for managers or users
+    without a Student/Parent/Teacher row.
+    """
+    codenames = set(
+        Permission.objects.filter(
+            Q(user=user) | Q(group__user=user),
+            content_type__app_label='yourgrades',
+            codename__in=ROLES
+        ).values_list('codename', flat=True)
+    )
+    role = next((role for role in ROLES if role in codenames), None)
+    person_pk = None
+    if role in PERSON_MODELS:
+        person_pk = PERSON_MODELS[role].objects.filter(user=user).values_list(
+            'pk',
+            flat=True
+        ).first()
+    return role, person_pk
+
+
+def remember_role(request, user):
+    role, person_pk = resolve_role(user)
+    request.session[SESSION_KEY] = {
+        'user': user.id,
+        'role': role,
+        'person': person_pk,
+        'version': get_role_version(user.id),
+    }
+    return request.session[SESSION_KEY]
+
+
+def session_role(request):
+    """
+    Returns session dict with 'role' and 'person' of the logged in user,
+    resolving it again when it's missing or outdated.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return {'role': None, 'person': None}
+    cached = request.session.get(SESSION_KEY)
+    if cached is None or cached['user'] != user.id or \
+            cached['version'] != get_role_version(user.id):
+        cached = remember_role(request, user)
+    return cached
+
+
+def get_role(request):
+    return session_role(request)['role']
+
+
+def get_person_pk(request):
+    return session_role(request)['person']
+
+
+class RoleRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """
+    Lets in logged in users whose role is one of roles.
+    """
+    roles = set()
+
+    def test_func(self):
+        return get_role(self.request) in self.roles
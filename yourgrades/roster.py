@@ -0,0 +1,220 @@
+"""
+Bulk roster import. A roster is a CSV or JSON list of students with their
+parents (fields of CreateStudentForm). All rows are validated first; then
+users, permissions, students and parents are created with a few bulk
+inserts in one transaction. Accounts get the same usernames and initial
+passwords as those created one by one in EditSchoolClassView.
+"""
+import csv
+import io
+import json
+import time
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction, IntegrityError
+from .backends import deferred_credentials
+from .forms import CreateStudentForm
+from .hashing import hash_passwords
+from .models import Student, Parent, ActivationToken
+from .permissions import RightsSupport
+from .usernames import allocate_usernames, MAX_ATTEMPTS
+
+IMPORT_BATCH_SIZE = 500
+
+# Initial password is username + prefix, see EditSchoolClassView
+PASSWORD_PREFIXES = {'student': '123', 'parent': '345'}
+
+FORMATS = ('csv', 'json')
+
+
+class RosterError(Exception):
+    """
+    Raised when a roster can't be read or has invalid rows. errors is a list
+    of (row number, {field: [messages]}) tuples.
+    """
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def read_roster(data, roster_format):
+    """
+    Returns list of row dicts read from data (str or bytes).
+    """
+    if roster_format not in FORMATS:
+        raise RosterError(f'Roster format must be one of {FORMATS}.')
+    if isinstance(data, bytes):
+        try:
+            data = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise RosterError('Roster must be UTF-8 encoded.')
+    if roster_format == 'csv':
+        return list(csv.DictReader(io.StringIO(data)))
+    try:
+        rows = json.loads(data)
+    except ValueError:
+        raise RosterError('Roster is not valid JSON.')
+    if not isinstance(rows, list) or \
+            not all(isinstance(row, dict) for row in rows):
+        raise RosterError('JSON roster must be a list of objects.')
+    return rows
+
+
+def validate_roster(rows):
+    """
+    Returns cleaned data of all rows, raises RosterError with errors of all
+    invalid rows.
+    """
+    cleaned = []
+    errors = []
+    for number, row in enumerate(rows, start=1):
+        form = CreateStudentForm(data=row)
+        if form.is_valid():
+            cleaned.append(form.cleaned_data)
+        else:
+            errors.append((number, form.errors))
+    if errors:
+        raise RosterError(f'{len(errors)} invalid rows.', errors)
+    if not cleaned:
+        raise RosterError('Roster is empty.')
+    return cleaned
+
+
+def import_roster(school_class, rows, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Creates students of school_class and their parents from cleaned rows.
+    Returns dict with numbers of created accounts and timings in seconds.
+    """
+    start = time.perf_counter()
+    accounts = []
+    for row in rows:
+        accounts.append(('student', row['name'], row['surname']))
+        accounts.append(
+            ('parent', row['first_parent_name'], row['first_parent_surname'])
+        )
+        if row.get('second_parent_name') and \
+                row.get('second_parent_surname'):
+            accounts.append((
+                'parent',
+                row['second_parent_name'],
+                row['second_parent_surname']
+            ))
+
+    # Passwords are hashed outside of the transaction, so it isn't kept open
+    # while the CPU works. Hashes are reused when allocation is repeated.
+    hashes = {}
+    hashing_time = 0
+    deferred = deferred_credentials()
+    for attempt in range(MAX_ATTEMPTS):
+        usernames = allocate_usernames(
+            [name + surname for kind, name, surname in accounts]
+        )
+        passwords = [
+            username + PASSWORD_PREFIXES[kind]
+            for username, (kind, name, surname) in zip(usernames, accounts)
+        ]
+        if deferred:
+            password_hashes = [make_password(None)] * len(passwords)
+        else:
+            missing = [password for password in passwords
+                       if password not in hashes]
+            hashing_start = time.perf_counter()
+            hashes.update(zip(missing, hash_passwords(missing)))
+            hashing_time += time.perf_counter() - hashing_start
+            password_hashes = [hashes[password] for password in passwords]
+        try:
+            students, parents = create_accounts(
+                school_class,
+                rows,
+                accounts,
+                usernames,
+                password_hashes,
+                passwords if deferred else None,
+                batch_size
+            )
+            break
+        except IntegrityError:
+            # Username taken by a concurrent import, allocate again
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+
+    total_time = time.perf_counter() - start
+    return {
+        'students': len(students),
+        'parents': len(parents),
+        'seconds': total_time,
+        'hashing_seconds': hashing_time,
+        'accounts_per_second': len(accounts) / total_time,
+    }
+
+
+def create_accounts(school_class, rows, accounts, usernames, passwords,
+                    tokens, batch_size):
+    """
+    Creates users of accounts ((kind, name, surname) tuples, student first,
+    then parents) with their students and parents in one transaction.
+    passwords are already hashed; tokens are activation tokens of users
+    (None when credentials aren't deferred). Returns (students, parents).
+    """
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [User(username=username, password=password, first_name=name,
+                  last_name=surname)
+             for username, password, (kind, name, surname)
+             in zip(usernames, passwords, accounts)],
+            batch_size=batch_size
+        )
+        # Not every database returns primary keys from bulk inserts
+        user_ids = {}
+        for batch in range(0, len(usernames), batch_size):
+            user_ids.update(
+                User.objects.filter(
+                    username__in=usernames[batch:batch + batch_size]
+                ).values_list('username', 'id')
+            )
+
+        content_type = ContentType.objects.get_for_model(RightsSupport)
+        permissions = dict(
+            Permission.objects.filter(
+                content_type=content_type,
+                codename__in=PASSWORD_PREFIXES
+            ).values_list('codename', 'id')
+        )
+        through = User.user_permissions.through
+        through.objects.bulk_create(
+            [through(user_id=user_ids[username],
+                     permission_id=permissions[kind])
+             for username, (kind, name, surname) in zip(usernames, accounts)],
+            batch_size=batch_size
+        )
+        if tokens is not None:
+            ActivationToken.issue(
+                {user_ids[username]: token
+                 for username, token in zip(usernames, tokens)},
+                batch_size=batch_size
+            )
+
+        students = []
+        parents = []
+        student = None
+        for username, (kind, name, surname) in zip(usernames, accounts):
+            if kind == 'student':
+                student = Student(
+                    user_id=user_ids[username],
+                    name=name,
+                    surname=surname,
+                    birthday=rows[len(students)]['birthday'],
+                    school_class=school_class
+                )
+                students.append(student)
+            else:
+                parents.append(Parent(
+                    user_id=user_ids[username],
+                    name=name,
+                    surname=surname,
+                    student_id=student.user_id
+                ))
+        Student.objects.bulk_create(students, batch_size=batch_size)
+        Parent.objects.bulk_create(parents, batch_size=batch_size)
+    return students, parents
@@ -0,0 +1,62 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import SchoolClass, Subject, SubjectDate, SubjectTeachers, \
+    Student, Parent, Teacher
+from .roles import remember_role, bump_role_version
+from .timetables import bump_generation
+
+
+@receiver(post_save, sender=SubjectDate)
+@receiver(post_delete, sender=SubjectDate)
+@receiver(post_save, sender=SubjectTeachers)
+@receiver(post_delete, sender=SubjectTeachers)
+@receiver(post_save, sender=Subject)
+@receiver(post_save, sender=SchoolClass)
+def invalidate_timetables(sender, **kwargs):
+    # Subject/class changes alter names shown in timetables and which
+    # classes are active for teachers
+    bump_generation()
+
+
+@receiver(m2m_changed, sender=SubjectTeachers.teacher.through)
+def invalidate_teacher_timetables(sender, action, **kwargs):
+    if action in {'post_add', 'post_remove', 'post_clear'}:
+        bump_generation()
+
+
+@receiver(user_logged_in)
+def remember_user_role(sender, request, user, **kwargs):
+    remember_role(request, user)
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_roles(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    if not reverse:
+        if action in {'post_add', 'post_remove', 'post_clear'}:
+            bump_role_version(instance.pk)
+    elif action in {'post_add', 'post_remove'}:
+        for user_id in pk_set:
+            bump_role_version(user_id)
+    elif action == 'pre_clear':
+        # pk_set isn't given on clear, users are read before removal
+        for user_id in instance.user_set.values_list('id', flat=True):
+            bump_role_version(user_id)
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=Parent)
+@receiver(post_save, sender=Teacher)
+def invalidate_created_person_role(sender, instance, created, **kwargs):
+    if created:
+        bump_role_version(instance.user_id)
+
+
+@receiver(post_delete, sender=Student)
+@receiver(post_delete, sender=Parent)
+@receiver(post_delete, sender=Teacher)
+def invalidate_deleted_person_role(sender, instance, **kwargs):
+    bump_role_version(instance.user_id)
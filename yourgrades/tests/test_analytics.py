@@ -0,0 +1,114 @@
+""" Grade analytics tests """
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from yourgrades import analytics
+from yourgrades.models import SchoolClass, Student, Subject, Grades
+
+
+class AnalyticsTestCase(TestCase):
+    def setUp(self):
+        school_class = SchoolClass.objects.create(
+            unique_code='1m2020',
+            name='1m',
+            year=2020
+        )
+        self.subjects = [
+            Subject.objects.create(
+                name=name,
+                unique_code=f'{name[:2]}1m2020',
+                school_class=school_class
+            )
+            for name in ('Biology', 'Music')
+        ]
+        self.students = [
+            Student.objects.create(
+                user=User.objects.create_user(username=f'Student{number}'),
+                school_class=school_class,
+                name='Ola',
+                surname=f'Nowak{number}',
+                birthday='2011-05-11'
+            )
+            for number in range(2)
+        ]
+        start = timezone.now() - timedelta(days=90)
+        # First student improves by one grade a month in biology
+        for month, (grade, weight) in enumerate([(2, 1), (3, 2), (4, 1),
+                                                 (5, 2)]):
+            self.create_grade(0, 0, grade, weight, start, month * 30)
+        self.create_grade(1, 0, 6, 1, start, 0)
+        self.create_grade(0, 1, 1, 3, start, 0)
+
+    def create_grade(self, student, subject, grade, weight, start, days):
+        grade = Grades.objects.create(
+            student=self.students[student],
+            subject=self.subjects[subject],
+            grade=grade,
+            weight=weight
+        )
+        Grades.objects.filter(id=grade.id).update(
+            date=start + timedelta(days=days)
+        )
+
+    def test_load(self):
+        with self.assertNumQueries(1):
+            arrays = analytics.load(subject=self.subjects[0])
+        self.assertEqual(len(arrays), 5)
+        self.assertEqual(
+            arrays.student_ids.tolist(),
+            sorted(student.pk for student in self.students)
+        )
+        self.assertEqual(arrays.subject_ids.tolist(), [self.subjects[0].pk])
+        self.assertEqual(len(analytics.load(subject__name='Chemistry')), 0)
+
+    def test_from_grades(self):
+        # Same arrays from loaded grades, without a query
+        grades = list(Grades.objects.filter(subject=self.subjects[0]))
+        with self.assertNumQueries(0):
+            arrays = analytics.from_grades(grades)
+        self.assertEqual(
+            analytics.summarize(arrays, 'student'),
+            analytics.summarize(
+                analytics.load(subject=self.subjects[0]),
+                'student'
+            )
+        )
+
+    def test_summarize_students(self):
+        statistics = analytics.summarize(
+            analytics.load(subject=self.subjects[0]),
+            'student'
+        )
+        first = statistics[self.students[0].pk]
+        self.assertEqual(first['count'], 4)
+        # (2 + 6 + 4 + 10) / 6
+        self.assertEqual(first['weighted_average'], 3.67)
+        self.assertEqual(first['mean'], 3.5)
+        self.assertEqual(first['median'], 3.5)
+        self.assertEqual(first['std'], 1.12)
+        self.assertEqual(first['trend'], 1)
+        self.assertEqual(first['histogram'], [0, 1, 1, 1, 1, 0])
+        second = statistics[self.students[1].pk]
+        self.assertEqual(second['median'], 6)
+        self.assertEqual(second['std'], 0)
+        # A single grade has no trend
+        self.assertEqual(second['trend'], None)
+
+    def test_summarize_subjects(self):
+        statistics = analytics.summarize(
+            analytics.load(student=self.students[0]),
+            'subject'
+        )
+        self.assertEqual(set(statistics), {s.pk for s in self.subjects})
+        self.assertEqual(statistics[self.subjects[1].pk]['median'], 1)
+        self.assertEqual(
+            statistics[self.subjects[0].pk]['weighted_average'],
+            3.67
+        )
+
+    def test_distribution(self):
+        arrays = analytics.load()
+        self.assertEqual(analytics.distribution(arrays), [1, 1, 1, 1, 1, 1])
+        self.assertEqual(analytics.summarize(analytics.load(pk=0), 'student'),
+                         {})
@@ -0,0 +1,80 @@
+""" Activation token tests """
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from yourgrades import usernames
+from yourgrades.models import SchoolClass, ActivationToken
+from yourgrades.roster import validate_roster, import_roster
+
+
+@override_settings(GRADEBOOK_DEFERRED_CREDENTIALS=True)
+class ActivationTokenTestCase(TestCase):
+    def test_create_user(self):
+        user = usernames.create_user('Jan', 'Kowalski', '123')
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual(
+            authenticate(username='JanKowalski', password='JanKowalski123'),
+            user
+        )
+        self.assertIsNone(
+            authenticate(username='JanKowalski', password='JanKowalski345')
+        )
+        # Digest only, the token itself isn't stored
+        self.assertNotIn(
+            'JanKowalski123',
+            ActivationToken.objects.get(user=user).digest
+        )
+
+    def test_reset(self):
+        user = usernames.create_user('Jan', 'Kowalski', '123')
+        user.set_password('personal')
+        user.save()
+        ActivationToken.consume(user)
+        usernames.reset_username(user, 123)
+        self.assertIsNone(
+            authenticate(username='JanKowalski', password='personal')
+        )
+        self.assertEqual(
+            authenticate(username='JanKowalski', password='JanKowalski123'),
+            user
+        )
+        usernames.reset_usernames([user], [345])
+        self.assertEqual(
+            authenticate(username='JanKowalski', password='JanKowalski345'),
+            user
+        )
+
+    def test_import_roster(self):
+        school_class = SchoolClass.objects.create(
+            name='1a',
+            year=2025,
+            unique_code='1a2025'
+        )
+        rows = validate_roster([{
+            'name': 'Jan',
+            'surname': 'Kowalski',
+            'birthday': '2012-05-01',
+            'first_parent_name': 'Adam',
+            'first_parent_surname': 'Kowalski',
+        }])
+        stats = import_roster(school_class, rows)
+        self.assertEqual(stats['hashing_seconds'], 0)
+        self.assertEqual(ActivationToken.objects.count(), 2)
+        self.assertFalse(
+            User.objects.get(username='AdamKowalski').has_usable_password()
+        )
+        self.assertIsNotNone(
+            authenticate(username='AdamKowalski', password='AdamKowalski345')
+        )
+
+    @override_settings(GRADEBOOK_DEFERRED_CREDENTIALS=False)
+    def test_reset_without_deferred_credentials(self):
+        user = User.objects.create_user(
+            username='JanKowalski',
+            first_name='Jan',
+            last_name='Kowalski'
+        )
+        ActivationToken.issue({user.id: 'JanKowalski123'})
+        usernames.reset_username(user, 123)
+        self.assertFalse(ActivationToken.objects.exists())
+        self.assertTrue(user.check_password('JanKowalski123'))
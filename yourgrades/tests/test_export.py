@@ -0,0 +1,154 @@
+""" Grade export tests """
+import csv
+import io
+import os
+import tempfile
+import zipfile
+from xml.etree import ElementTree
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from yourgrades import export
+from yourgrades.models import SchoolClass, Student, Subject, Grades
+
+SHEET_NAMESPACE = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def read_csv(data):
+    return list(csv.reader(io.StringIO(data.decode('utf-8-sig'))))
+
+
+def read_xlsx(data):
+    """
+    Returns list of sheets, each a list of rows with cell values as text.
+    """
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        names = sorted(
+            name for name in archive.namelist()
+            if name.startswith('xl/worksheets/')
+        )
+        sheets = []
+        for name in names:
+            root = ElementTree.fromstring(archive.read(name))
+            sheets.append([
+                [''.join(cell.itertext()) for cell in row]
+                for row in root.iter(f'{SHEET_NAMESPACE}row')
+            ])
+        workbook = archive.read('xl/workbook.xml').decode()
+        assert workbook.count('<sheet ') == len(sheets)
+    return sheets
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.school_classes = [
+            SchoolClass.objects.create(
+                unique_code=f'{number}a2020',
+                name=f'{number}a',
+                year=2020
+            )
+            for number in (1, 2)
+        ]
+        self.subjects = [
+            Subject.objects.create(
+                name=f'Matematyka {school_class.name}',
+                unique_code=f'ma{school_class.unique_code[:2]}',
+                school_class=school_class
+            )
+            for school_class in self.school_classes
+        ]
+        students = [
+            Student.objects.create(
+                user=User.objects.create_user(username=f'Student{number}'),
+                school_class=self.school_classes[number % 2],
+                name='Łukasz',
+                surname=f'Nowak, "{number}"',
+                birthday='2010-03-29'
+            )
+            for number in range(6)
+        ]
+        Grades.objects.bulk_create(
+            [Grades(student=student, subject=self.subjects[number % 2],
+                    grade=number % 6 + 1, weight=2)
+             for number, student in enumerate(students * 4)]
+        )
+
+    def export(self, export_format, **kwargs):
+        return b''.join(
+            export.export_chunks(
+                export.grades_queryset(**kwargs),
+                export_format,
+                chunk_size=5
+            )
+        )
+
+    def test_iter_rows(self):
+        # One query per chunk of grades, and one to find the end
+        with self.assertNumQueries(5):
+            rows = list(export.iter_rows(Grades.objects.all(), chunk_size=6))
+        self.assertEqual(len(rows), 24)
+        self.assertEqual(
+            rows[0][:7],
+            ('1a', 2020, 'Matematyka 1a', 'ma1a', 'Nowak, "0"', 'Łukasz', 1)
+        )
+        self.assertEqual(rows[0][-1], 0)
+
+    def test_csv(self):
+        rows = read_csv(self.export('csv'))
+        self.assertEqual(tuple(rows[0]), export.HEADER)
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[1][4], 'Nowak, "0"')
+
+        rows = read_csv(self.export('csv', subject=self.subjects[1]))
+        self.assertEqual(len(rows), 13)
+        self.assertEqual({row[0] for row in rows[1:]}, {'2a'})
+
+    def test_xlsx(self):
+        sheets = read_xlsx(
+            self.export('xlsx', school_class=self.school_classes[0])
+        )
+        self.assertEqual(len(sheets), 1)
+        self.assertEqual(tuple(sheets[0][0]), export.HEADER)
+        self.assertEqual(len(sheets[0]), 13)
+        self.assertEqual(sheets[0][1][4], 'Nowak, "0"')
+        self.assertEqual(sheets[0][1][6], '1')
+
+    def test_xlsx_sheets(self):
+        # Rows over the sheet limit go to the next sheets
+        data = b''.join(export.xlsx_chunks(
+            export.iter_rows(Grades.objects.all()),
+            sheet_rows=10
+        ))
+        sheets = read_xlsx(data)
+        self.assertEqual([len(sheet) for sheet in sheets], [10, 10, 7])
+        self.assertEqual(
+            sum(len(sheet) - 1 for sheet in sheets),
+            Grades.objects.count()
+        )
+
+    def test_unknown_format(self):
+        with self.assertRaises(export.ExportError):
+            self.export('pdf')
+
+    def test_command(self):
+        output = io.StringIO()
+        call_command(
+            'export_grades',
+            '--class', self.school_classes[1].unique_code,
+            stdout=output
+        )
+        self.assertEqual(len(read_csv(output.getvalue().encode())), 13)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'grades.xlsx')
+            output = io.StringIO()
+            call_command('export_grades', '--output', path, stdout=output)
+            self.assertIn('Grades written to', output.getvalue())
+            with open(path, 'rb') as exported:
+                self.assertEqual(len(read_xlsx(exported.read())[0]), 25)
+
+        with self.assertRaises(CommandError):
+            call_command('export_grades', '--format', 'xlsx')
+        with self.assertRaises(CommandError):
+            call_command('export_grades', '--subject', 'nope')
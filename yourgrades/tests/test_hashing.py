@@ -0,0 +1,19 @@
+""" Password hashing tests """
+from django.contrib.auth.hashers import check_password, get_hasher
+from django.test import TestCase
+from yourgrades.hashing import hash_passwords
+
+
+class HashPasswordsTestCase(TestCase):
+    def test_hash_passwords(self):
+        passwords = [f'JanKowalski{number}123' for number in range(10)]
+        for workers in [1, 2]:
+            hashes = hash_passwords(passwords, workers=workers, threshold=2)
+            self.assertEqual(len(hashes), 10)
+            for password, password_hash in zip(passwords, hashes):
+                # Compatible with the configured hasher
+                self.assertTrue(
+                    password_hash.startswith(get_hasher().algorithm)
+                )
+                self.assertTrue(check_password(password, password_hash))
+        self.assertEqual(hash_passwords([], workers=2, threshold=0), [])
@@ -0,0 +1,48 @@
+""" Identity map tests """
+from django.http import Http404
+from django.test import TestCase
+from yourgrades.identity import IdentityMap
+from yourgrades.models import SchoolClass, Subject
+
+
+class IdentityMapTestCase(TestCase):
+    def setUp(self):
+        self.school_class = SchoolClass.objects.create(
+            name='1a',
+            year=2025,
+            unique_code='1a2025'
+        )
+        self.subject = Subject.objects.create(
+            name='Math',
+            school_class=self.school_class,
+            unique_code='Ma1a2025'
+        )
+        self.lookup = IdentityMap()
+
+    def test_repeated_lookup(self):
+        with self.assertNumQueries(1):
+            subject = self.lookup.get(Subject, 'Ma1a2025')
+            self.assertIs(self.lookup.get(Subject, 'Ma1a2025'), subject)
+        self.assertEqual(subject, self.subject)
+        self.assertEqual(self.lookup.hits, 1)
+
+    def test_missing(self):
+        with self.assertNumQueries(1):
+            for attempt in range(2):
+                with self.assertRaises(Subject.DoesNotExist):
+                    self.lookup.get(Subject, 'nomath')
+        with self.assertRaises(Http404):
+            self.lookup.get_or_404(Subject, 'nomath')
+        with self.assertRaises(Http404):
+            self.lookup.get_or_404(SchoolClass, None)
+
+    def test_add_and_forget(self):
+        self.lookup.add(self.school_class)
+        with self.assertNumQueries(0):
+            self.assertIs(
+                self.lookup.get(SchoolClass, '1a2025'),
+                self.school_class
+            )
+        self.lookup.forget(SchoolClass, '1a2025')
+        with self.assertNumQueries(1):
+            self.lookup.get(SchoolClass, '1a2025')
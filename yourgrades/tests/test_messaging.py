@@ -0,0 +1,188 @@
+""" Message delivery tests """
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from yourgrades.messaging import send_message, send_broadcast, \
+    received_messages, get_unread, mark_read
+from yourgrades.models import Message, Delivery, Broadcast, BroadcastRead, \
+    UnreadCounter, SchoolClass, Student, Parent, Teacher, Subject, \
+    SubjectTeachers
+
+
+class SendMessageTestCase(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='JanKowalski',
+            password='janspass'
+        )
+        User.objects.bulk_create(
+            [User(username=f'Recipient{number}') for number in range(40)]
+        )
+        self.users = list(
+            User.objects.filter(username__startswith='Recipient')
+        )
+
+    def send(self, users, recipient_name='Recipients'):
+        return send_message(
+            Message(subject='Subject', text='Text.'),
+            self.author,
+            [user.id for user in users],
+            recipient_name
+        )
+
+    def test_send_message(self):
+        message = self.send(self.users)
+        self.assertEqual(message.sender, self.author)
+        self.assertEqual(
+            Delivery.objects.filter(message=message, read=False).count(),
+            40
+        )
+        self.assertEqual(
+            Message.objects.get(sender=self.author).recipient_name,
+            'Recipients'
+        )
+        for user in self.users:
+            self.assertEqual(UnreadCounter.get_unread(user), 1)
+
+    def test_send_without_sent_box(self):
+        message = self.send(self.users[:1], recipient_name=None)
+        self.assertIsNone(Message.objects.get(id=message.id).recipient_name)
+        self.assertEqual(Delivery.objects.filter(message=message).count(), 1)
+
+    def test_send_message_queries(self):
+        # The number of queries doesn't depend on the audience size
+        with self.assertNumQueries(11):
+            self.send(self.users[:2])
+        with self.assertNumQueries(11):
+            self.send(self.users)
+
+
+class BroadcastTestCase(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='JanKowalski',
+            password='janspass'
+        )
+        self.school_class = SchoolClass.objects.create(
+            unique_code='2a2020',
+            name='2a',
+            year=2020
+        )
+        self.students = [
+            Student.objects.create(
+                user=User.objects.create_user(username=f'Student{number}'),
+                school_class=self.school_class,
+                name='Student',
+                surname=str(number),
+                birthday='2010-03-29'
+            )
+            for number in range(3)
+        ]
+        self.parent = Parent.objects.create(
+            user=User.objects.create_user(username='Parent'),
+            student=self.students[0],
+            name='Parent',
+            surname='Parent'
+        )
+        self.teacher = Teacher.objects.create(
+            user=User.objects.create_user(username='Teacher'),
+            name='Teacher',
+            surname='Teacher'
+        )
+        self.subject = Subject.objects.create(
+            name='Math',
+            unique_code='ma2a20',
+            school_class=self.school_class
+        )
+        SubjectTeachers.objects.create(subject=self.subject).teacher.add(
+            self.teacher
+        )
+
+    def broadcast(self, audience, title='Subject', **kwargs):
+        return send_broadcast(
+            Message(subject=title, text='Text.'),
+            self.author,
+            audience,
+            recipient_name='Recipients',
+            **kwargs
+        )
+
+    def received(self, user):
+        return set(received_messages(user).values_list('subject', flat=True))
+
+    def test_audiences(self):
+        self.broadcast(
+            Broadcast.SCHOOL_CLASS,
+            'Class',
+            school_class=self.school_class
+        )
+        self.broadcast(
+            Broadcast.CLASS_PARENTS,
+            'Parents',
+            school_class=self.school_class
+        )
+        self.broadcast(
+            Broadcast.SUBJECT_TEACHERS,
+            'Teachers',
+            subject=self.subject
+        )
+        for student in self.students:
+            self.assertEqual(self.received(student.user), {'Class'})
+        self.assertEqual(self.received(self.parent.user), {'Parents'})
+        self.assertEqual(self.received(self.teacher.user), {'Teachers'})
+        self.assertEqual(self.received(self.author), set())
+        # Nothing is stored per recipient
+        self.assertFalse(Delivery.objects.exists())
+        self.assertEqual(
+            Message.objects.filter(sender=self.author).count(),
+            3
+        )
+
+    def test_read_state(self):
+        message = self.broadcast(
+            Broadcast.SCHOOL_CLASS,
+            school_class=self.school_class
+        )
+        send_message(
+            Message(subject='Direct', text='Text.'),
+            self.author,
+            [self.students[0].user_id]
+        )
+        user = self.students[0].user
+        self.assertEqual(get_unread(user), 2)
+        self.assertTrue(
+            received_messages(user).get(id=message.id).unread_broadcast
+        )
+
+        mark_read(user, message)
+        mark_read(user, message)
+        self.assertEqual(get_unread(user), 1)
+        self.assertEqual(BroadcastRead.objects.count(), 1)
+        received = received_messages(user).get(id=message.id)
+        self.assertFalse(received.unread_broadcast)
+        self.assertFalse(received.unread_delivery)
+        # Other members of the audience still see the broadcast as unread
+        self.assertEqual(get_unread(self.students[1].user), 1)
+        self.assertEqual(get_unread(self.author), 0)
+
+    def test_joined_later(self):
+        self.broadcast(
+            Broadcast.SCHOOL_CLASS,
+            school_class=self.school_class
+        )
+        user = self.students[1].user
+        user.date_joined = timezone.now() + timedelta(minutes=1)
+        user.save()
+        self.assertEqual(self.received(user), set())
+        self.assertEqual(get_unread(user), 0)
+
+    def test_broadcast_queries(self):
+        # The number of queries doesn't depend on the class size
+        with self.assertNumQueries(4):
+            self.broadcast(
+                Broadcast.SCHOOL_CLASS,
+                school_class=self.school_class
+            )
+        with self.assertNumQueries(1):
+            get_unread(self.students[0].user)
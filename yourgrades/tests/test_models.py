@@ -1,11 +1,15 @@
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
+from django.db import IntegrityError
 from django.test import TestCase
+from django.core.management import call_command
+from django.utils import timezone
 import pytz
 from django.contrib.auth.models import User
 
 from yourgrades.models import SchoolClass, Student, Parent, Teacher, Subject, \
-    SubjectTeachers, SubjectDate, Grades, CanceledGrades, Message, Sender, \
-    Recipient, MailboxReceived, MailboxSent
+    SubjectTeachers, SubjectDate, Grades, GradeEvent, GradeCheckpoint, \
+    Message, Delivery, GradeAverage, GradeStatistics, UnreadCounter
 
 
 class SchoolClassTestCase(TestCase):
@@ -281,54 +285,407 @@ class GradesTestCase(TestCase):
         self.assertEqual(grade.subject, self.subject)
 
 
-class CanceledGradesTestCase(TestCase):
+class GradeAverageTestCase(TestCase):
     def setUp(self):
-        user_data = {'username': 'KamilNowak', 'password': 'kamilspass'}
-        user = User.objects.create_user(**user_data)
-        school_class_data = {
-            'unique_code': '1g2020',
-            'name': '1g',
-            'year': 2020
+        user = User.objects.create_user(username='OlaNowak', password='pass')
+        school_class = SchoolClass.objects.create(
+            unique_code='1h2020',
+            name='1h',
+            year=2020
+        )
+        self.student = Student.objects.create(
+            user=user,
+            school_class=school_class,
+            name='Ola',
+            surname='Nowak',
+            birthday='2011-05-11'
+        )
+        self.subject = Subject.objects.create(
+            name='Physics',
+            unique_code='Ph1h2020',
+            school_class=school_class
+        )
+        self.grade_1 = Grades.objects.create(
+            weight=2,
+            grade=5,
+            student=self.student,
+            subject=self.subject
+        )
+        self.grade_2 = Grades.objects.create(
+            weight=1,
+            grade=2,
+            student=self.student,
+            subject=self.subject
+        )
+
+    def test_grade_average(self):
+        average = GradeAverage.objects.get(
+            student=self.student,
+            subject=self.subject
+        )
+        self.assertEqual(average.weighted_sum, 12)
+        self.assertEqual(average.weight_sum, 3)
+        self.assertEqual(average.count, 2)
+        self.assertEqual(average.average, 4)
+        self.assertEqual(average.last_grade_date, self.grade_2.date)
+
+        # Grade correction replaces its old values
+        self.grade_2.grade = 5
+        self.grade_2.save()
+        average.refresh_from_db()
+        self.assertEqual(average.weighted_sum, 15)
+        self.assertEqual(average.count, 2)
+
+        # Deleting a grade removes it from the aggregate
+        self.grade_2.delete()
+        average.refresh_from_db()
+        self.assertEqual(average.weighted_sum, 10)
+        self.assertEqual(average.weight_sum, 2)
+        self.assertEqual(average.count, 1)
+        self.assertEqual(average.last_grade_date, self.grade_1.date)
+
+        self.grade_1.delete()
+        average.refresh_from_db()
+        self.assertEqual(average.count, 0)
+        self.assertEqual(average.average, None)
+        self.assertEqual(average.last_grade_date, None)
+
+    def test_rebuild_grade_averages(self):
+        GradeAverage.objects.all().delete()
+        call_command('rebuild_grade_averages', stdout=open(os.devnull, 'w'))
+        average = GradeAverage.objects.get(
+            student=self.student,
+            subject=self.subject
+        )
+        self.assertEqual(average.weighted_sum, 12)
+        self.assertEqual(average.weight_sum, 3)
+        self.assertEqual(average.count, 2)
+        self.assertEqual(average.last_grade_date, self.grade_2.date)
+
+    def test_add_grades(self):
+        # Bulk update of an existing row and insert of a new one
+        user = User.objects.create_user(username='JanNowak', password='pass')
+        student = Student.objects.create(
+            user=user,
+            school_class=self.student.school_class,
+            name='Jan',
+            surname='Nowak',
+            birthday='2011-06-11'
+        )
+        grades = [
+            Grades(weight=3, grade=4, student=self.student,
+                   subject=self.subject),
+            Grades(weight=2, grade=6, student=student, subject=self.subject),
+        ]
+        Grades.objects.bulk_create(grades)
+        GradeAverage.add_grades(grades)
+        averages = {
+            average.student_id: average
+            for average in GradeAverage.objects.filter(subject=self.subject)
         }
-        school_class = SchoolClass.objects.create(**school_class_data)
+        self.assertEqual(averages[self.student.pk].weighted_sum, 24)
+        self.assertEqual(averages[self.student.pk].count, 3)
+        self.assertEqual(
+            averages[self.student.pk].last_grade_date,
+            grades[0].date
+        )
+        self.assertEqual(averages[student.pk].average, 6)
+        self.assertEqual(averages[student.pk].count, 1)
+
+
+class GradeEventTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='KamilNowak')
+        school_class = SchoolClass.objects.create(
+            unique_code='1g2020',
+            name='1g',
+            year=2020
+        )
         self.student = Student.objects.create(
             user=user,
             school_class=school_class,
             name='Kamil',
             surname='Nowak',
-            birthday='2010-04-11',
-            email='kamilnowak@example.pl'
+            birthday='2010-04-11'
         )
         self.subject = Subject.objects.create(
             name='Gym',
             unique_code='Gy1d2020',
             school_class=school_class
         )
-        self.canceled_grade_data = {
-            'weight': 9,
-            'grade': 4,
-            'student': self.student,
-            'subject': self.subject,
-        }
-        CanceledGrades.objects.create(**self.canceled_grade_data)
+        self.start = timezone.now() - timedelta(days=30)
+
+    def create_grade(self, grade, weight, days):
+        return Grades.objects.create(
+            student=self.student,
+            subject=self.subject,
+            grade=grade,
+            weight=weight,
+            date=self.start + timedelta(days=days)
+        )
 
-    def test_grades(self):
-        canceled_grade = CanceledGrades.objects.last()
-        self.assertTrue(isinstance(canceled_grade, CanceledGrades))
-        now = pytz.utc.localize(datetime.now())
-        self.assertTrue(canceled_grade.date <= now)
-        self.assertTrue(1 <= canceled_grade.weight <= 10)
-        self.assertTrue(1 <= canceled_grade.grade <= 6)
+    def events(self):
+        return list(
+            GradeEvent.objects.order_by('id').values_list(
+                'kind',
+                'grade_key',
+                'grade',
+                'weight'
+            )
+        )
+
+    def test_events(self):
+        grade = self.create_grade(4, 9, 0)
+        event = GradeEvent.objects.get()
+        self.assertEqual(event.date, grade.date)
+        self.assertEqual(event.student, self.student)
+        self.assertEqual(event.subject, self.subject)
+
+        # Saving without changes appends nothing
+        grade.save()
+        grade.grade = 5
+        grade.save()
+        key = grade.pk
+        grade.delete()
+        self.assertEqual(
+            self.events(),
+            [(GradeEvent.ADDED, key, 4, 9),
+             (GradeEvent.CORRECTED, key, 5, 9),
+             (GradeEvent.CANCELED, key, 5, 9)]
+        )
+        self.assertFalse(Grades.objects.exists())
+
+    def test_record_added(self):
+        # Ids of bulk created grades are read back
+        grades = [
+            Grades(student=self.student, subject=self.subject, grade=grade,
+                   weight=1)
+            for grade in (2, 3)
+        ]
+        Grades.objects.bulk_create(grades)
+        with self.assertNumQueries(2):
+            GradeEvent.record_added(grades)
+        self.assertEqual(
+            self.events(),
+            [(GradeEvent.ADDED, grade.pk, grade.grade, 1)
+             for grade in Grades.objects.order_by('id')]
+        )
+
+    def test_record_added_same_date(self):
+        # Grades with the same student, subject and date get ids in order
+        date = timezone.now()
+        grades = [
+            Grades(student=self.student, subject=self.subject, grade=grade,
+                   weight=1, date=date)
+            for grade in (4, 5)
+        ]
+        Grades.objects.bulk_create(grades)
+        GradeEvent.record_added(grades)
+        self.assertEqual(
+            [(key, grade) for _, key, grade, _ in self.events()],
+            list(Grades.objects.order_by('id').values_list('id', 'grade'))
+        )
+
+        # Grades that weren't saved can't get events
+        with self.assertRaises(ValueError):
+            GradeEvent.record_added(
+                [Grades(student=self.student, subject=self.subject, grade=1,
+                        weight=1)]
+            )
+
+    def test_grades_at(self):
+        first = self.create_grade(2, 1, 0)
+        second = self.create_grade(3, 1, 10)
+        GradeEvent.objects.filter(grade_key=second.pk).update(
+            date=self.start + timedelta(days=10)
+        )
+        first.grade = 6
+        first.save()
+        GradeEvent.objects.filter(kind=GradeEvent.CORRECTED).update(
+            date=self.start + timedelta(days=20)
+        )
+
+        def grades_at(days):
+            return [
+                (grade.pk, grade.grade)
+                for grade in GradeCheckpoint.grades_at(
+                    self.student,
+                    self.start + timedelta(days=days)
+                )
+            ]
+
+        self.assertEqual(grades_at(-1), [])
+        self.assertEqual(grades_at(5), [(first.pk, 2)])
+        self.assertEqual(grades_at(15), [(first.pk, 2), (second.pk, 3)])
+        self.assertEqual(grades_at(25), [(first.pk, 6), (second.pk, 3)])
+
+        # Same states when replayed from a checkpoint
+        self.assertEqual(GradeCheckpoint.create_due(every=3), 1)
+        key = second.pk
+        second.delete()
+        with self.assertNumQueries(2):
+            self.assertEqual(grades_at(25), [(first.pk, 6), (key, 3)])
+        self.assertEqual(grades_at(15), [(first.pk, 2), (key, 3)])
+        self.assertEqual(grades_at(31), [(first.pk, 6)])
         self.assertEqual(
-            canceled_grade.weight,
-            self.canceled_grade_data['weight']
+            GradeCheckpoint.grades_at(self.student, timezone.now())[0].date,
+            first.date
         )
+
+    def test_create_due(self):
+        for number in range(3):
+            self.create_grade(number + 1, 1, number)
+        self.assertEqual(GradeCheckpoint.create_due(every=4), 0)
+        self.assertEqual(GradeCheckpoint.create_due(every=3), 1)
+        checkpoint = GradeCheckpoint.objects.get()
+        self.assertEqual(
+            checkpoint.last_event,
+            GradeEvent.objects.latest('id').id
+        )
+        self.assertEqual(len(GradeCheckpoint.decode(checkpoint.grades)), 3)
+        # Nothing new since the checkpoint
+        self.assertEqual(GradeCheckpoint.create_due(every=1), 0)
+        Grades.objects.first().delete()
+        self.assertEqual(GradeCheckpoint.create_due(every=1), 1)
+        self.assertEqual(
+            len(GradeCheckpoint.decode(
+                GradeCheckpoint.objects.latest('id').grades
+            )),
+            2
+        )
+
+    def test_rebuild(self):
+        kept = self.create_grade(5, 2, 0)
+        canceled = self.create_grade(1, 1, 1)
+        call_command('checkpoint_grade_events', '--every', '1',
+                     stdout=open(os.devnull, 'w'))
+        corrected = self.create_grade(3, 3, 2)
+        corrected.weight = 1
+        corrected.save()
+        canceled.delete()
+        expected = list(
+            Grades.objects.order_by('id').values_list(
+                'id', 'grade', 'weight', 'manager_mode', 'date'
+            )
+        )
+
+        Grades.objects.all().delete()
+        GradeAverage.objects.all().delete()
+        call_command('rebuild_grades', stdout=open(os.devnull, 'w'))
         self.assertEqual(
-            canceled_grade.grade,
-            self.canceled_grade_data['grade']
+            list(
+                Grades.objects.order_by('id').values_list(
+                    'id', 'grade', 'weight', 'manager_mode', 'date'
+                )
+            ),
+            expected
         )
-        self.assertEqual(canceled_grade.student, self.student)
-        self.assertEqual(canceled_grade.subject, self.subject)
+        self.assertEqual(expected[0][0], kept.pk)
+        average = GradeAverage.objects.get(student=self.student)
+        self.assertEqual(average.weighted_sum, 13)
+        self.assertEqual(average.count, 2)
+
+
+class GradeStatisticsTestCase(TestCase):
+    def setUp(self):
+        self.school_classes = [
+            SchoolClass.objects.create(
+                unique_code=f'{number}k2020',
+                name=f'{number}k',
+                year=2020
+            )
+            for number in (1, 2)
+        ]
+        self.subjects = [
+            Subject.objects.create(
+                name=name,
+                unique_code=f'{name[:2]}{school_class.unique_code}',
+                school_class=school_class
+            )
+            for school_class in self.school_classes
+            for name in ('Biology', 'Chemistry')
+        ]
+        student = Student.objects.create(
+            user=User.objects.create_user(username='EwaNowak'),
+            school_class=self.school_classes[0],
+            name='Ewa',
+            surname='Nowak',
+            birthday='2011-05-11'
+        )
+        for grade, weight in [(5, 2), (2, 1), (5, 1)]:
+            Grades.objects.create(
+                student=student,
+                subject=self.subjects[0],
+                grade=grade,
+                weight=weight
+            )
+        Grades.objects.create(
+            student=student,
+            subject=self.subjects[1],
+            grade=6,
+            weight=3
+        )
+        # Subject with canceled grades only
+        Grades.objects.create(
+            student=student,
+            subject=self.subjects[2],
+            grade=1,
+            weight=1
+        ).delete()
+
+    def test_refresh(self):
+        # Two GROUP BY queries, delete and insert in a savepoint
+        with self.assertNumQueries(6):
+            self.assertEqual(GradeStatistics.refresh(), 3)
+        statistics = GradeStatistics.objects.get(subject=self.subjects[0])
+        self.assertEqual(statistics.school_class, self.school_classes[0])
+        self.assertEqual(statistics.count, 3)
+        self.assertEqual(statistics.grade_sum, 12)
+        self.assertEqual(statistics.weighted_sum, 17)
+        self.assertEqual(statistics.weight_sum, 4)
+        self.assertEqual(statistics.grade_2, 1)
+        self.assertEqual(statistics.grade_5, 2)
+        self.assertEqual(statistics.canceled, 0)
+        statistics = GradeStatistics.objects.get(subject=self.subjects[2])
+        self.assertEqual(statistics.count, 0)
+        self.assertEqual(statistics.canceled, 1)
+
+        # Refresh replaces the snapshot
+        Grades.objects.filter(subject=self.subjects[1]).delete()
+        self.assertEqual(GradeStatistics.refresh(), 2)
+
+    def test_summaries(self):
+        GradeStatistics.refresh()
+        subjects = GradeStatistics.per_subject()
+        self.assertEqual(
+            [row['subject__name'] for row in subjects],
+            ['Biology', 'Chemistry', 'Biology']
+        )
+        self.assertEqual(subjects[0]['mean'], 4)
+        self.assertEqual(subjects[0]['weighted_mean'], 4.25)
+        self.assertEqual(subjects[0]['distribution'], [0, 1, 0, 0, 2, 0])
+        self.assertEqual(subjects[2]['mean'], None)
+
+        with self.assertNumQueries(1):
+            classes = GradeStatistics.per_class()
+        self.assertEqual(
+            [row['school_class__name'] for row in classes],
+            ['1k', '2k']
+        )
+        self.assertEqual(classes[0]['count'], 4)
+        self.assertEqual(classes[0]['weighted_sum'], 35)
+        self.assertEqual(classes[0]['distribution'], [0, 1, 0, 0, 2, 1])
+        self.assertEqual(classes[1]['canceled'], 1)
+
+        total = GradeStatistics.total(classes)
+        self.assertEqual(total['count'], 4)
+        self.assertEqual(total['canceled'], 1)
+        self.assertEqual(total['mean'], 4.5)
+        self.assertEqual(total['weighted_mean'], 5)
+
+    def test_refresh_grade_statistics(self):
+        call_command('refresh_grade_statistics', stdout=open(os.devnull, 'w'))
+        self.assertEqual(GradeStatistics.objects.count(), 3)
 
 
 class MessageTestCase(TestCase):
@@ -357,12 +714,6 @@ class MessageTestCase(TestCase):
 
 class MailTestCase(TestCase):
     def setUp(self):
-        self.message = Message.objects.create(
-            id=1,
-            subject='Test subject',
-            text='Test text.'
-        )
-
         sender_user_data = {
             'username': 'JanMalinowski',
             'first_name': 'Jan',
@@ -370,10 +721,6 @@ class MailTestCase(TestCase):
             'password': 'janspass'
         }
         self.sender_user = User.objects.create_user(**sender_user_data)
-        self.sender = Sender.objects.create(
-            user=self.sender_user,
-            message=self.message
-        )
 
         recipient_user_data = {
             'username': 'AdamKowalski',
@@ -382,77 +729,80 @@ class MailTestCase(TestCase):
             'password': 'adamspass'
         }
         self.recipient_user = User.objects.create_user(**recipient_user_data)
-        self.recipient = Recipient.objects.create(
-            user=self.recipient_user,
-            message=self.message
+
+        self.message = Message.objects.create(
+            id=1,
+            subject='Test subject',
+            text='Test text.',
+            sender=self.sender_user,
+            recipient_name='Some recipient'
         )
 
 
-class SenderTestCse(MailTestCase):
+class SentMessageTestCase(MailTestCase):
     def setUp(self):
-        super(SenderTestCse, self).setUp()
+        super(SentMessageTestCase, self).setUp()
 
-    def test_sender(self):
-        sender = Sender.objects.last()
-        self.assertTrue(isinstance(sender, Sender))
-        self.assertEqual(
-            sender.__str__(),
-            f'{sender.user.first_name} {sender.user.last_name}'
-        )
-        self.assertEqual(sender.user, self.sender_user)
-        self.assertEqual(sender.message, self.message)
+    def test_sent_message(self):
+        message = Message.objects.get(sender=self.sender_user)
+        self.assertEqual(message.__str__(), message.subject)
 
+        max_length = message._meta.get_field('recipient_name').max_length
+        self.assertEqual(max_length, 64)
+        self.assertLessEqual(len(message.recipient_name), max_length)
 
-class RecipientTestCase(MailTestCase):
-    def setUp(self):
-        super(RecipientTestCase, self).setUp()
-
-    def test_recipient(self):
-        recipient = Recipient.objects.last()
-        self.assertTrue(isinstance(recipient, Recipient))
         self.assertEqual(
-            recipient.__str__(),
-            f'{recipient.user.first_name} {recipient.user.last_name}'
+            list(self.sender_user.sent_messages.all()),
+            [self.message]
         )
-        self.assertEqual(recipient.user, self.recipient_user)
-        self.assertEqual(recipient.message, self.message)
 
 
-class MailboxReceivedTestCase(MailTestCase):
+class DeliveryTestCase(MailTestCase):
     def setUp(self):
-        super(MailboxReceivedTestCase, self).setUp()
-        self.mailbox_data = {
-            'sender': self.sender,
-            'recipient': self.recipient,
-            'message': self.message,
-        }
-        MailboxReceived.objects.create(**self.mailbox_data)
-
-    def test_mailbox_received(self):
-        mailbox_received = MailboxReceived.objects.last()
-        self.assertTrue(isinstance(mailbox_received, MailboxReceived))
-        self.assertEqual(mailbox_received.read, False)
-        self.assertEqual(mailbox_received.recipient, self.recipient)
-
-
-class MailboxSentTestCase(MailTestCase):
-    def setUp(self):
-        super(MailboxSentTestCase, self).setUp()
-        self.mailbox_sent_data = {
-            'sender': self.sender,
-            'recipient': 'Some recipient',
-            'message': self.message,
-        }
-        MailboxSent.objects.create(**self.mailbox_sent_data)
+        super(DeliveryTestCase, self).setUp()
+        Delivery.objects.create(
+            user=self.recipient_user,
+            message=self.message
+        )
 
-    def test_mailbox_received(self):
-        mailbox_sent = MailboxSent.objects.last()
-        self.assertTrue(isinstance(mailbox_sent, MailboxSent))
+    def test_delivery(self):
+        delivery = Delivery.objects.last()
+        self.assertTrue(isinstance(delivery, Delivery))
+        self.assertEqual(delivery.read, False)
+        self.assertEqual(delivery.user, self.recipient_user)
+        self.assertEqual(delivery.message.sender, self.sender_user)
+
+    def test_delivered_once(self):
+        with self.assertRaises(IntegrityError):
+            Delivery.objects.create(
+                user=self.recipient_user,
+                message=self.message
+            )
+
+
+class UnreadCounterTestCase(MailTestCase):
+    def test_unread_counter(self):
+        # Delivered mail increments recipient's counter
+        Delivery.objects.create(
+            user=self.recipient_user,
+            message=self.message
+        )
+        Delivery.objects.create(
+            user=self.recipient_user,
+            message=Message.objects.create(subject='Second', text='-')
+        )
+        self.assertEqual(UnreadCounter.get_unread(self.recipient_user), 2)
+        self.assertEqual(UnreadCounter.get_unread(self.sender_user), 0)
 
-        max_length = mailbox_sent._meta.get_field('recipient').max_length
-        self.assertEqual(max_length, 64)
-        self.assertLessEqual(len(mailbox_sent.recipient), max_length)
+        UnreadCounter.increment([self.recipient_user.id, self.sender_user.id])
+        self.assertEqual(UnreadCounter.get_unread(self.recipient_user), 3)
+        self.assertEqual(UnreadCounter.get_unread(self.sender_user), 1)
 
-        self.assertEqual(mailbox_sent.sender, self.sender)
-        self.assertEqual(mailbox_sent.message, self.message)
+        UnreadCounter.decrement(self.sender_user.id)
+        UnreadCounter.decrement(self.sender_user.id)
+        self.assertEqual(UnreadCounter.get_unread(self.sender_user), 0)
 
+        # Reconciliation recomputes counters from mails
+        call_command('reconcile_unread_counters', stdout=open(os.devnull, 'w'))
+        self.assertEqual(UnreadCounter.get_unread(self.recipient_user), 2)
+        self.assertEqual(UnreadCounter.get_unread(self.sender_user), 0)
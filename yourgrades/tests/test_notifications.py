@@ -0,0 +1,103 @@
+""" Notification queue tests """
+import io
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase
+from yourgrades import notifications
+from yourgrades.models import Message, Delivery, NotificationEvent, \
+    UnreadCounter
+
+
+class NotificationQueueTestCase(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='JanKowalski',
+            password='janspass'
+        )
+        User.objects.bulk_create(
+            [User(username=f'Recipient{number}') for number in range(10)]
+        )
+        self.users = list(
+            User.objects.filter(username__startswith='Recipient')
+        )
+
+    def enqueue(self, text, users):
+        NotificationEvent.enqueue(
+            Message(subject='New grade', text=text),
+            self.author,
+            [user.id for user in users]
+        )
+
+    def test_drain(self):
+        self.enqueue('Grade 5', self.users[:6])
+        self.enqueue('Grade 3', self.users[6:])
+        self.enqueue('Grade 5', self.users[6:7])
+        self.assertEqual(notifications.backlog()['pending'], 11)
+        self.assertFalse(Delivery.objects.exists())
+
+        # Events with the same text become one message
+        self.assertEqual(notifications.deliver_pending(), 11)
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(
+            Delivery.objects.filter(message__text='Grade 5').count(),
+            7
+        )
+        self.assertEqual(UnreadCounter.get_unread(self.users[6]), 2)
+        self.assertEqual(
+            notifications.backlog(),
+            {'pending': 0, 'failed': 0, 'oldest_seconds': 0}
+        )
+        self.assertEqual(notifications.drain(), 0)
+
+    def test_batches(self):
+        self.enqueue('Grade 5', self.users)
+        self.assertEqual(notifications.deliver_pending(batch_size=4), 4)
+        self.assertEqual(notifications.drain(batch_size=4), 6)
+        self.assertEqual(Delivery.objects.count(), 10)
+
+    def test_failed_delivery(self):
+        self.enqueue('Grade 5', self.users[:2])
+        with mock.patch(
+                'yourgrades.notifications.send_message',
+                side_effect=DatabaseError
+        ):
+            # Retried until MAX_ATTEMPTS
+            self.assertEqual(notifications.drain(), 0)
+        self.assertEqual(
+            notifications.backlog(),
+            {'pending': 0, 'failed': 2, 'oldest_seconds': 0}
+        )
+        self.assertFalse(Message.objects.exists())
+
+    def test_drain_after_failed_batch(self):
+        self.enqueue('Grade 5', self.users[:2])
+        self.enqueue('Grade 3', self.users[2:4])
+        send_message = notifications.send_message
+
+        def fail_grade_5(message, *args):
+            if message.text == 'Grade 5':
+                raise DatabaseError
+            return send_message(message, *args)
+
+        with mock.patch(
+                'yourgrades.notifications.send_message',
+                side_effect=fail_grade_5
+        ):
+            # Batches with nothing delivered don't stop the drain
+            self.assertEqual(notifications.drain(batch_size=2), 2)
+        self.assertEqual(
+            notifications.backlog(),
+            {'pending': 0, 'failed': 2, 'oldest_seconds': 0}
+        )
+
+    def test_command(self):
+        self.enqueue('Grade 5', self.users)
+        output = io.StringIO()
+        call_command('deliver_notifications', '--stats', stdout=output)
+        self.assertIn('pending: 10', output.getvalue())
+        output = io.StringIO()
+        call_command('deliver_notifications', stdout=output)
+        self.assertIn('Delivered 10 notifications.', output.getvalue())
+        self.assertIn('pending: 0', output.getvalue())
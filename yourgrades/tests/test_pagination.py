@@ -0,0 +1,85 @@
+""" Keyset pagination tests """
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from yourgrades.models import Message
+from yourgrades.pagination import KeysetPaginator
+
+
+class KeysetPaginatorTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        Message.objects.bulk_create(
+            [Message(subject=f'Subject {number}', text='Text.')
+             for number in range(25)]
+        )
+        # Equal dates, so pages have to be split by id
+        Message.objects.update(date=timezone.now())
+        self.ids = list(
+            Message.objects.order_by('date', 'id').values_list('id', flat=True)
+        )
+
+    def page_ids(self, page):
+        return [message.id for message in page]
+
+    def test_walk_forward_and_back(self):
+        paginator = KeysetPaginator(Message.objects.all(), 10)
+        page = paginator.get_page()
+        self.assertEqual(self.page_ids(page), self.ids[:10])
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+        page = paginator.get_page(page.next_cursor())
+        self.assertEqual(self.page_ids(page), self.ids[10:20])
+        self.assertTrue(page.has_previous())
+        self.assertTrue(page.has_next())
+
+        page = paginator.get_page(page.next_cursor())
+        self.assertEqual(self.page_ids(page), self.ids[20:])
+        self.assertFalse(page.has_next())
+
+        page = paginator.get_page(page.previous_cursor())
+        self.assertEqual(self.page_ids(page), self.ids[10:20])
+        page = paginator.get_page(page.previous_cursor())
+        self.assertEqual(self.page_ids(page), self.ids[:10])
+        self.assertFalse(page.has_previous())
+
+    def test_last_page(self):
+        paginator = KeysetPaginator(Message.objects.all(), 10)
+        page = paginator.get_page('last')
+        self.assertEqual(self.page_ids(page), self.ids[15:])
+        self.assertTrue(page.has_previous())
+        self.assertFalse(page.has_next())
+
+    def test_descending_ordering(self):
+        paginator = KeysetPaginator(Message.objects.all(), 10, ('-id',))
+        page = paginator.get_page()
+        self.assertEqual(self.page_ids(page), self.ids[::-1][:10])
+        page = paginator.get_page(page.next_cursor())
+        self.assertEqual(self.page_ids(page), self.ids[::-1][10:20])
+
+    def test_broken_cursor(self):
+        paginator = KeysetPaginator(Message.objects.all(), 10)
+        for cursor in ['abc', '1', 'W10', 'WyJuZXh0IiwgInh5eiIsICIxIl0']:
+            self.assertEqual(
+                self.page_ids(paginator.get_page(cursor)),
+                self.ids[:10]
+            )
+
+    def test_page_queries(self):
+        # Deep pages cost one query, the total is counted once and cached
+        paginator = KeysetPaginator(Message.objects.all(), 10)
+        cursor = paginator.get_page(paginator.get_page().next_cursor()) \
+            .next_cursor()
+        with self.assertNumQueries(1):
+            page = paginator.get_page(cursor)
+            self.assertEqual(self.page_ids(page), self.ids[20:])
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.approx_count, 25)
+            self.assertEqual(paginator.approx_num_pages, 3)
+        Message.objects.create(subject='Subject', text='Text.')
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                KeysetPaginator(Message.objects.all(), 10).approx_count,
+                25
+            )
@@ -0,0 +1,159 @@
+""" Report card tests """
+import io
+import os
+import re
+import tempfile
+import zipfile
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from yourgrades import reportcards
+from yourgrades.models import SchoolClass, Student, Teacher, Subject, \
+    SubjectTeachers, Grades
+from yourgrades.pdf import PDFDocument, encode_text
+
+
+def check_pdf(data):
+    """
+    Checks that every xref entry points to its object, returns page count.
+    """
+    xref = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', data).group(1))
+    entries = re.findall(rb'(\d{10}) 00000 n ', data[xref:])
+    for number, offset in enumerate(entries, 1):
+        assert data[int(offset):].startswith(b'%d 0 obj' % number)
+    return int(re.search(rb'/Count (\d+)', data).group(1))
+
+
+class PDFTestCase(TestCase):
+    def test_encode_text(self):
+        self.assertEqual(encode_text('a(b)\\'), b'(a\\(b\\)\\\\)')
+        self.assertEqual(encode_text('Łódź'), b'(\xa3\xf3d\x9f)')
+
+    def test_pages(self):
+        document = PDFDocument()
+        document.text(50, 50, 'Strona 1')
+        document.add_page()
+        document.text(50, 50, 'Strona 2', font='bold')
+        document.line(50, 60, 100, 60)
+        data = document.render()
+        self.assertTrue(data.startswith(b'%PDF-1.4'))
+        self.assertEqual(check_pdf(data), 2)
+
+
+class ReportCardTestCase(TestCase):
+    def setUp(self):
+        self.school_classes = [
+            SchoolClass.objects.create(
+                unique_code=f'{number}a2020',
+                name=f'{number}a',
+                year=2020
+            )
+            for number in (1, 2)
+        ]
+        teacher = Teacher.objects.create(
+            user=User.objects.create_user(username='Teacher'),
+            name='Anna',
+            surname='Żak'
+        )
+        self.subjects = []
+        for school_class in self.school_classes:
+            for name in ('Historia', 'Matematyka'):
+                subject = Subject.objects.create(
+                    name=name,
+                    unique_code=f'{name[:2]}{school_class.unique_code[:2]}',
+                    school_class=school_class
+                )
+                SubjectTeachers.objects.create(subject=subject).teacher.add(
+                    teacher
+                )
+                self.subjects.append(subject)
+        self.students = [
+            Student.objects.create(
+                user=User.objects.create_user(username=f'Student{number}'),
+                school_class=self.school_classes[number % 2],
+                name='Łukasz',
+                surname=f'Nowak{number}',
+                birthday='2010-03-29'
+            )
+            for number in range(6)
+        ]
+        # Weighted average of the first student in history: 11 / 3
+        for grade, weight in [(5, 1), (3, 2)]:
+            Grades.objects.create(
+                student=self.students[0],
+                subject=self.subjects[0],
+                grade=grade,
+                weight=weight
+            )
+
+    def test_load_datasets(self):
+        with self.assertNumQueries(4):
+            datasets = reportcards.load_datasets(self.school_classes)
+        self.assertEqual(len(datasets), 2)
+        self.assertEqual(
+            [subject['name'] for subject in datasets[0]['subjects']],
+            ['Historia', 'Matematyka']
+        )
+        self.assertEqual(datasets[0]['subjects'][0]['teachers'], ['Anna Żak'])
+        self.assertEqual(len(datasets[1]['students']), 3)
+        student = datasets[0]['students'][0]
+        self.assertEqual(student['id'], self.students[0].user_id)
+        self.assertEqual(
+            student['averages'],
+            {self.subjects[0].id: 3.67}
+        )
+
+    def generate(self, **kwargs):
+        output = io.BytesIO()
+        stats = reportcards.generate(
+            self.school_classes,
+            output,
+            cards_per_task=2,
+            **kwargs
+        )
+        return stats, zipfile.ZipFile(output)
+
+    def test_generate(self):
+        stats, archive = self.generate(workers=1)
+        self.assertEqual(stats['cards'], 6)
+        self.assertEqual(len(archive.namelist()), 12)
+        html = archive.read('1a2020/Nowak0_Łukasz_' +
+                            f'{self.students[0].user_id}.html').decode()
+        self.assertIn('Historia', html)
+        self.assertIn('Anna Żak', html)
+        self.assertIn('3,67', html)
+        pdf = archive.read('1a2020/Nowak0_Łukasz_' +
+                           f'{self.students[0].user_id}.pdf')
+        self.assertEqual(check_pdf(pdf), 1)
+        self.assertIn(b'(3,67)', pdf)
+
+    def test_process_pool(self):
+        stats, archive = self.generate(workers=2, formats=('pdf',))
+        self.assertEqual(stats['cards'], 6)
+        self.assertEqual(
+            sorted(archive.namelist()),
+            sorted(
+                f'{student.school_class.unique_code}/{student.surname}_'
+                f'Łukasz_{student.user_id}.pdf'
+                for student in self.students
+            )
+        )
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cards.zip')
+            output = io.StringIO()
+            call_command(
+                'generate_report_cards',
+                path,
+                '--class', '2a2020',
+                '--format', 'html',
+                '--workers', '1',
+                stdout=output
+            )
+            self.assertIn('3 report cards of 1 classes', output.getvalue())
+            with zipfile.ZipFile(path) as archive:
+                self.assertEqual(len(archive.namelist()), 3)
+        with self.assertRaises(CommandError):
+            call_command('generate_report_cards', path, '--class', '9z2020')
@@ -0,0 +1,74 @@
+""" Role resolution tests """
+from django.contrib.auth.models import User, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from yourgrades.models import Teacher
+from yourgrades.permissions import RightsSupport
+from yourgrades.roles import resolve_role, SESSION_KEY
+
+
+class RoleTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        content_type = ContentType.objects.get_for_model(RightsSupport)
+        self.permissions = {
+            permission.codename: permission
+            for permission in Permission.objects.filter(
+                content_type=content_type
+            )
+        }
+        self.user = User.objects.create_user(
+            username='JanKowalski',
+            password='test_pass',
+            first_name='Jan',
+            last_name='Kowalski'
+        )
+        self.client = Client()
+
+    def test_resolve_role(self):
+        self.assertEqual(resolve_role(self.user), (None, None))
+        self.user.user_permissions.add(self.permissions['manager'])
+        self.assertEqual(resolve_role(self.user), ('manager', None))
+        self.user.user_permissions.set([self.permissions['teacher']])
+        teacher = Teacher.objects.create(
+            user=self.user,
+            name='Jan',
+            surname='Kowalski'
+        )
+        self.assertEqual(resolve_role(self.user), ('teacher', teacher.pk))
+
+    def test_role_kept_in_session(self):
+        self.user.user_permissions.add(self.permissions['manager'])
+        self.client.login(username='JanKowalski', password='test_pass')
+        self.assertEqual(self.client.session[SESSION_KEY]['role'], 'manager')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('yourgrades:manager'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            [query for query in queries if 'auth_permission' in query['sql']]
+        )
+
+    def test_permission_change(self):
+        # GET, manager -> 200, then permission removed -> 403
+        self.user.user_permissions.add(self.permissions['manager'])
+        self.client.login(username='JanKowalski', password='test_pass')
+        url = reverse('yourgrades:manager')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.user.user_permissions.remove(self.permissions['manager'])
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.permissions['manager'].user_set.add(self.user)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.permissions['manager'].user_set.clear()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_evicted_version(self):
+        self.user.user_permissions.add(self.permissions['manager'])
+        self.client.login(username='JanKowalski', password='test_pass')
+        self.user.user_permissions.remove(self.permissions['manager'])
+        cache.clear()
+        response = self.client.get(reverse('yourgrades:manager'))
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,94 @@
+""" Roster import tests """
+import json
+import os
+import tempfile
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from yourgrades.models import SchoolClass, Student, Parent
+from yourgrades.roster import RosterError, read_roster, validate_roster, \
+    import_roster
+
+
+class RosterTestCase(TestCase):
+    def setUp(self):
+        self.school_class = SchoolClass.objects.create(
+            name='1a',
+            year=2025,
+            unique_code='1a2025'
+        )
+        self.rows = [
+            {
+                'name': 'Jan',
+                'surname': 'Kowalski',
+                'birthday': '2012-05-01',
+                'first_parent_name': 'Adam',
+                'first_parent_surname': 'Kowalski',
+                'second_parent_name': 'Ewa',
+                'second_parent_surname': 'Kowalska',
+            }
+            for number in range(30)
+        ]
+
+    def test_read_roster(self):
+        self.assertEqual(
+            read_roster(json.dumps(self.rows[:2]).encode(), 'json'),
+            self.rows[:2]
+        )
+        for data, roster_format in [('{}', 'json'), ('[1]', 'json'),
+                                    ('[', 'json'), ('a', 'xml'),
+                                    (b'\xff', 'csv')]:
+            with self.assertRaises(RosterError):
+                read_roster(data, roster_format)
+
+    def test_import_roster(self):
+        stats = import_roster(self.school_class, validate_roster(self.rows))
+        self.assertEqual(stats['students'], 30)
+        self.assertEqual(stats['parents'], 60)
+        self.assertEqual(
+            Student.objects.filter(school_class=self.school_class).count(),
+            30
+        )
+        self.assertEqual(
+            Parent.objects.filter(
+                student__school_class=self.school_class
+            ).count(),
+            60
+        )
+        student = Student.objects.get(user__username='JanKowalski30')
+        self.assertEqual(
+            sorted(parent.user.username for parent in
+                   student.parent_set.all()),
+            ['AdamKowalski30', 'EwaKowalska30']
+        )
+
+    def test_import_roster_queries(self):
+        # Queries don't depend on the roster size (password hashing does)
+        rows = validate_roster(self.rows)
+        with self.assertNumQueries(9):
+            import_roster(self.school_class, rows[:3], batch_size=100)
+        with self.assertNumQueries(9):
+            import_roster(self.school_class, rows, batch_size=100)
+
+    def test_import_roster_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'roster.json')
+            with open(path, 'w') as roster:
+                json.dump(self.rows[:5], roster)
+            call_command('import_roster', '1a2025', path, stdout=open(
+                os.devnull, 'w'
+            ))
+            self.assertEqual(Student.objects.count(), 5)
+
+            # Invalid row -> nothing imported
+            with open(path, 'w') as roster:
+                json.dump([{'name': 'Jan'}], roster)
+            with self.assertRaises(CommandError):
+                call_command('import_roster', '1a2025', path, stderr=open(
+                    os.devnull, 'w'
+                ))
+            self.assertEqual(Student.objects.count(), 5)
+
+            with self.assertRaises(CommandError):
+                call_command('import_roster', '8z2025', path)
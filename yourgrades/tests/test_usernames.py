@@ -0,0 +1,123 @@
+""" Username allocation tests """
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from yourgrades import usernames
+
+
+class UsernamesTestCase(TestCase):
+    def setUp(self):
+        for username in ['JanKowalski', 'JanKowalski3', 'JanKowalskiego']:
+            User.objects.create_user(username=username)
+
+    def test_allocate_usernames(self):
+        self.assertEqual(
+            usernames.allocate_usernames(
+                ['JanKowalski', 'JanKowalski', 'EwaNowak']
+            ),
+            ['JanKowalski2', 'JanKowalski4', 'EwaNowak']
+        )
+
+    def test_allocate_usernames_case(self):
+        # Usernames differing only in case are taken (unique on MySQL)
+        User.objects.create_user(username='ewanowak')
+        User.objects.create_user(username='EWANOWAK2')
+        self.assertEqual(
+            usernames.allocate_usernames(['EwaNowak', 'JANKOWALSKI']),
+            ['EwaNowak3', 'JANKOWALSKI2']
+        )
+
+    def test_create_user(self):
+        # One query for taken names, no matter how many are taken, two to
+        # lock the name
+        with self.assertNumQueries(6):
+            user = usernames.create_user('Jan', 'Kowalski', '123')
+        self.assertEqual(user.username, 'JanKowalski2')
+        self.assertEqual(user.first_name, 'Jan')
+        self.assertEqual(user.last_name, 'Kowalski')
+        self.assertTrue(user.check_password('JanKowalski2123'))
+        user = usernames.create_user('Jan', 'Kowalski', '123')
+        self.assertEqual(user.username, 'JanKowalski4')
+
+    def test_reset_username(self):
+        user = User.objects.create_user(
+            username='JanKowalski5',
+            first_name='Jan',
+            last_name='Kowalski'
+        )
+        # Lower free number exists -> username changes
+        usernames.reset_username(user, 345)
+        self.assertEqual(user.username, 'JanKowalski2')
+        self.assertTrue(user.check_password('JanKowalski2345'))
+        # Own username is the lowest free one -> username is kept
+        usernames.reset_username(user, 345)
+        self.assertEqual(
+            User.objects.get(id=user.id).username,
+            'JanKowalski2'
+        )
+
+    def test_reset_usernames(self):
+        users = [
+            User.objects.create_user(
+                username=username,
+                first_name='Jan',
+                last_name='Kowalski'
+            )
+            for username in ['JanKowalski7', 'Jan', 'JanKowalskiego2']
+        ]
+        usernames.reset_usernames(users, [123, 345, 123])
+        # Everyone gets the lowest free number, like from reset_username()
+        self.assertEqual(
+            [User.objects.get(id=user.id).username for user in users],
+            ['JanKowalski2', 'JanKowalski4', 'JanKowalski5']
+        )
+        self.assertTrue(
+            User.objects.get(id=users[1].id).check_password(
+                'JanKowalski4345'
+            )
+        )
+
+    def test_reset_usernames_hashes(self):
+        user = User.objects.create_user(
+            username='Jan',
+            first_name='Jan',
+            last_name='Kowalski'
+        )
+        hashes = usernames.hash_reset_passwords([user], [123])
+        self.assertEqual(list(hashes), ['JanKowalski2123'])
+        # Precomputed hashes -> nothing is hashed in the transaction
+        with mock.patch.object(usernames, 'hash_passwords') as hash_passwords:
+            hash_passwords.return_value = []
+            usernames.reset_usernames([user], [123], hashes)
+        hash_passwords.assert_called_once_with([])
+        self.assertTrue(
+            User.objects.get(id=user.id).check_password('JanKowalski2123')
+        )
+
+
+class UsernameCollisionTestCase(TransactionTestCase):
+    def test_create_user_collision(self):
+        # Name committed by another connection while a transaction of this
+        # one is open -> the next free name is allocated
+        other = connection.copy()
+        try:
+            with transaction.atomic():
+                if connection.vendor != 'sqlite':
+                    # Starts the snapshot of the transaction (SQLite locks
+                    # the table for other writers instead)
+                    User.objects.exists()
+                with other.cursor() as cursor:
+                    cursor.execute(
+                        f'INSERT INTO {other.ops.quote_name("auth_user")} '
+                        '(username, password, first_name, last_name, email, '
+                        'is_superuser, is_staff, is_active, date_joined) '
+                        "VALUES ('JanKowalski', '', '', '', '', %s, %s, %s, "
+                        '%s)',
+                        [False, False, True, '2020-01-01 00:00:00']
+                    )
+                user = usernames.create_user('Jan', 'Kowalski', '234')
+        finally:
+            other.close()
+        self.assertEqual(user.username, 'JanKowalski2')
+        self.assertTrue(user.check_password('JanKowalski2234'))
@@ -1,10 +1,34 @@
 """ Views and forms tests """
+import io
+from datetime import timedelta
 from django.shortcuts import get_object_or_404
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
+from django.core.files.uploadedfile import SimpleUploadedFile
 from yourgrades.forms import *
+from yourgrades import middleware
+from yourgrades.messaging import send_message, received_messages
+from yourgrades import usernames
+from yourgrades import notifications
+from yourgrades.management.commands import explain_queries
+from yourgrades.management.commands._synthetic import create_school
+
+# Maximum number of SQL queries of one request (including session and user
+# queries), counted by RequestStatsMiddleware
+QUERY_BUDGETS = {
+    'yourgrades:manager': 6,
+    'yourgrades:manager_statistics': 5,
+    'yourgrades:mailbox': 7,
+    'yourgrades:student_parent': 7,
+    'yourgrades:teacher_subject': 10,
+}
 
 
 class TestWithPermission(TestCase):
@@ -13,6 +37,19 @@ class TestWithPermission(TestCase):
     """
     def setUp(self):
         self.password = 'test_pass'
+        cache.clear()
+
+    def assertQueryBudget(self, response):
+        """
+        Fails when the view that returned response ran more SQL queries than
+        its QUERY_BUDGETS entry.
+        """
+        stats = response.request_stats
+        self.assertLessEqual(
+            stats.queries,
+            QUERY_BUDGETS[stats.view_name],
+            f'{stats.view_name} ran {stats.queries} queries'
+        )
 
     def create_user(self):
         username = 'tester'
@@ -311,6 +348,35 @@ class FirstLoginViewTestCase(TestWithPermission):
         )
         self.assertTemplateUsed(response, 'yourgrades/studentparent.html')
 
+    @override_settings(GRADEBOOK_DEFERRED_CREDENTIALS=True)
+    def test_first_login_with_activation_token(self):
+        user = usernames.create_user('Adam', 'Nowak', '234')
+        user.user_permissions.add(
+            Permission.objects.get(codename='teacher')
+        )
+        Teacher.objects.create(user=user, name='Adam', surname='Nowak')
+        client = Client()
+        # Activation token works like the initial password
+        self.assertTrue(
+            client.login(username='AdamNowak', password='AdamNowak234')
+        )
+        response = client.post(
+            reverse('yourgrades:first_login'),
+            {
+                'username': 'AdamNowak',
+                'password': 'newpass',
+                'password_confirm': 'newpass'
+            }
+        )
+        self.assertRedirects(response, reverse('yourgrades:teacher'))
+        # Token is used up, password is set
+        self.assertFalse(
+            Client().login(username='AdamNowak', password='AdamNowak234')
+        )
+        self.assertTrue(
+            Client().login(username='AdamNowak', password='newpass')
+        )
+
 
 class ManagerPanelViewTestCase(TestWithPermission):
 
@@ -339,6 +405,52 @@ class ManagerPanelViewTestCase(TestWithPermission):
         response = self.client_2.get(reverse('yourgrades:manager'))
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'yourgrades/manager.html')
+        self.assertEqual(response.context['ia_classes'], None)
+
+        # Inactive classes are listed after toggling them on
+        SchoolClass.objects.create(
+            unique_code='3a2019',
+            name='3a',
+            year=2019,
+            active=False
+        )
+        response = self.client_2.post(
+            reverse('yourgrades:manager'),
+            {'inactive_class': 'on'}
+        )
+        self.assertEqual(len(response.context['ia_classes']), 1)
+        self.assertEqual(response.context['ia_teachers'], None)
+
+    def test_manager_panel_queries(self):
+        # Manager panel has a fixed query budget regardless of school size
+        def create_class(number):
+            school_class = SchoolClass.objects.create(
+                unique_code=f'{number}b2020',
+                name=f'{number}b',
+                year=2020
+            )
+            for student_number in range(3):
+                student = self.create_person('student')
+                student.school_class = school_class
+                student.save()
+            self.create_person('teacher')
+
+        create_class(1)
+        with CaptureQueriesContext(connection) as small_school:
+            self.client_2.get(reverse('yourgrades:manager'))
+        for number in range(2, 9):
+            create_class(number)
+        with CaptureQueriesContext(connection) as big_school:
+            response = self.client_2.get(reverse('yourgrades:manager'))
+        # 8 created classes + class created by create_person()
+        self.assertEqual(len(response.context['classes']), 9)
+        self.assertEqual(
+            sum(len(students) for students in
+                response.context['students'].values()),
+            24
+        )
+        self.assertEqual(len(big_school), len(small_school))
+        self.assertQueryBudget(response)
 
 
 class CreateSchoolClassViewTestCase(TestWithPermission):
@@ -515,6 +627,131 @@ class EditSchoolClassViewTestCase(TestWithPermission):
         )
 
 
+class ImportRosterViewTestCase(TestWithPermission):
+
+    def setUp(self):
+        super(ImportRosterViewTestCase, self).setUp()
+        user = self.create_user()
+        self.client_1 = Client()
+        self.client_1.login(username=user.username, password=self.password)
+        user_manager = self.create_manager()
+        self.client_2 = Client()
+        self.client_2.login(
+            username=user_manager.username,
+            password=self.password
+        )
+        self.school_class = SchoolClass.objects.create(
+            name='2c',
+            year=2020,
+            unique_code='2c2020'
+        )
+        self.url = reverse(
+            'yourgrades:import_roster',
+            kwargs={'class_unique_code': '2c2020'}
+        )
+
+    def roster(self, text, name='roster.csv'):
+        return SimpleUploadedFile(name, text.encode())
+
+    def test_import_roster(self):
+        # GET, user without manager permission -> 403
+        response = self.client_1.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+        # GET, user with manager permission -> 200
+        response = self.client_2.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(
+            response,
+            'yourgrades/managerimportroster.html'
+        )
+
+        # POST, file with wrong extension -> nothing imported
+        response = self.client_2.post(
+            self.url,
+            {'roster': self.roster('name', 'roster.txt')}
+        )
+        self.assertTrue(response.context['form'].errors)
+
+        # POST, roster with invalid row -> nothing imported
+        response = self.client_2.post(self.url, {'roster': self.roster(
+            'name,surname,birthday,first_parent_name,first_parent_surname\n'
+            'Jan,Nowak,2011-10-14,Adam,Nowak\n'
+            'Anna,Nowak,wrong date,Adam,Nowak\n'
+        )})
+        self.assertEqual(response.context['row_errors'][0][0], 2)
+        self.assertFalse(Student.objects.exists())
+
+        # POST, correct roster -> students and parents created
+        response = self.client_2.post(self.url, {'roster': self.roster(
+            'name,surname,birthday,first_parent_name,first_parent_surname,'
+            'second_parent_name,second_parent_surname\n'
+            'Jan,Nowak,2011-10-14,Adam,Nowak,Ewa,Nowak\n'
+            'Anna,Nowak,2011-02-01,Adam,Nowak,,\n'
+        )})
+        self.assertEqual(response.context['stats']['students'], 2)
+        self.assertEqual(response.context['stats']['parents'], 3)
+        self.assertEqual(
+            Student.objects.filter(school_class=self.school_class).count(),
+            2
+        )
+        # Same usernames, passwords and permissions as accounts created in
+        # EditSchoolClassView
+        parent = User.objects.get(username='AdamNowak2')
+        self.assertTrue(parent.check_password('AdamNowak2345'))
+        self.assertTrue(parent.has_perm('yourgrades.parent'))
+        self.assertEqual(parent.parent.student.name, 'Anna')
+        student = User.objects.get(username='JanNowak')
+        self.assertTrue(student.check_password('JanNowak123'))
+        self.assertTrue(student.has_perm('yourgrades.student'))
+
+
+class ResetSchoolClassViewTestCase(TestWithPermission):
+
+    def setUp(self):
+        super(ResetSchoolClassViewTestCase, self).setUp()
+        user = self.create_user()
+        self.client_1 = Client()
+        self.client_1.login(username=user.username, password=self.password)
+        user_manager = self.create_manager()
+        self.client_2 = Client()
+        self.client_2.login(
+            username=user_manager.username,
+            password=self.password
+        )
+        self.parent = self.create_person('parent')
+        self.student = self.parent.student
+        Student.objects.update(first_login=False)
+        Parent.objects.update(first_login=False)
+        self.url = reverse(
+            'yourgrades:reset_school_class',
+            kwargs={'class_unique_code': '2a2020'}
+        )
+
+    def test_reset_school_class(self):
+        # POST, user without manager permission -> 403
+        response = self.client_1.post(self.url)
+        self.assertEqual(response.status_code, 403)
+
+        # POST, user with manager permission -> redirect to class
+        response = self.client_2.post(self.url)
+        self.assertRedirects(
+            response,
+            reverse(
+                'yourgrades:edit_school_class',
+                kwargs={'class_unique_code': '2a2020'}
+            )
+        )
+        student = Student.objects.get(user=self.student.user)
+        self.assertTrue(student.first_login)
+        self.assertEqual(student.user.username, 'NameSurname')
+        self.assertTrue(student.user.check_password('NameSurname123'))
+        parent = Parent.objects.get(user=self.parent.user)
+        self.assertTrue(parent.first_login)
+        self.assertEqual(parent.user.username, 'NameSurname2')
+        self.assertTrue(parent.user.check_password('NameSurname2345'))
+
+
 class DeactivationSchoolClassViewTestCase(TestWithPermission):
 
     def setUp(self):
@@ -1068,6 +1305,44 @@ class TimetableViewTestCase(TestWithPermission):
         # Checking returned context
         self.assertEqual(response.context['person'], 'student')
 
+    def test_timetable_cache(self):
+        subject = Subject.objects.create(
+            name='Biology',
+            unique_code=f'Bi{self.student.school_class.unique_code}',
+            school_class=self.student.school_class
+        )
+        subject_teachers = SubjectTeachers.objects.create(subject=subject)
+        SubjectDate.objects.create(subject=subject, day='Tu', lesson_number=3)
+        url = reverse('yourgrades:timetable', kwargs={'person': 'student'})
+        response = self.client_3.get(url)
+        self.assertEqual(response.context['dates'][2][1], subject)
+
+        # Grid is served from cache, without SubjectDate queries
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_3.get(url)
+        self.assertFalse(
+            [query for query in queries if 'subjectdate' in query['sql']]
+        )
+        self.assertEqual(response.context['dates'][2][1], subject)
+
+        # New lesson date invalidates the cached grid
+        SubjectDate.objects.create(subject=subject, day='St', lesson_number=1)
+        response = self.client_3.get(url)
+        self.assertEqual(response.context['dates'][0][5], subject)
+
+        # Teacher's grid changes when the teacher is assigned to a subject
+        url = reverse('yourgrades:timetable', kwargs={'person': 'teacher'})
+        response = self.client_2.get(url)
+        self.assertEqual(response.context['dates'][2][1], False)
+        subject_teachers.teacher.add(self.teacher)
+        response = self.client_2.get(url)
+        self.assertEqual(response.context['dates'][2][1], subject)
+
+        # Deleted lesson date disappears from the grid
+        SubjectDate.objects.get(day='Tu', lesson_number=3).delete()
+        response = self.client_2.get(url)
+        self.assertEqual(response.context['dates'][2][1], False)
+
 
 class ManagerStudentViewTestCase(TestWithPermission):
 
@@ -1148,6 +1423,42 @@ class ManagerStudentViewTestCase(TestWithPermission):
             1
         )
 
+    def test_cancel_grade(self):
+        url = reverse(
+            'yourgrades:manager_student',
+            kwargs={'user_id': self.parent.student.user.id}
+        )
+        grade = Grades.objects.create(
+            student=self.parent.student,
+            subject=self.subject,
+            grade=2,
+            weight=4
+        )
+        yesterday = timezone.localdate() - timedelta(days=1)
+        GradeEvent.objects.update(date=timezone.now() - timedelta(days=1))
+
+        # Cancellation removes the grade and appends an event
+        response = self.client_2.post(url, {'del_grade': grade.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Grades.objects.exists())
+        self.assertEqual(
+            list(GradeEvent.objects.order_by('id').values_list(
+                'kind',
+                'grade_key'
+            )),
+            [(GradeEvent.ADDED, grade.id), (GradeEvent.CANCELED, grade.id)]
+        )
+        response = self.client_2.get(reverse('yourgrades:manager_history'))
+        self.assertEqual(len(response.context['canceled_grades']), 1)
+
+        # Grades at the end of yesterday still have the canceled one
+        response = self.client_2.get(url, {'at': yesterday.isoformat()})
+        self.assertEqual(response.context['at'], yesterday)
+        grades_at = response.context['grades_at'][self.subject]
+        self.assertEqual([row.id for row in grades_at], [grade.id])
+        response = self.client_2.get(url, {'at': '2020-02-30'})
+        self.assertEqual(response.context['grades_at'], None)
+
 
 class ManagerGradesHistoryViewTestCase(TestWithPermission):
 
@@ -1178,6 +1489,137 @@ class ManagerGradesHistoryViewTestCase(TestWithPermission):
         self.assertTemplateUsed(response, 'yourgrades/managerhistory.html')
 
 
+class ExportGradesViewTestCase(TestWithPermission):
+
+    def setUp(self):
+        super(ExportGradesViewTestCase, self).setUp()
+        user = self.create_user()
+        self.client_1 = Client()
+        self.client_1.login(
+            username=user.username,
+            password=self.password
+        )
+
+        user_manager = self.create_manager()
+        self.client_2 = Client()
+        self.client_2.login(
+            username=user_manager.username,
+            password=self.password
+        )
+        self.student = self.create_person('student')
+        self.subject = Subject.objects.create(
+            name='Historia',
+            unique_code='hi2a20',
+            school_class=self.student.school_class
+        )
+        for number in range(3):
+            Grades.objects.create(
+                student=self.student,
+                subject=self.subject,
+                grade=number + 1,
+                weight=1
+            )
+
+    def test_export(self):
+        # GET, user without manager permission -> 403
+        response = self.client_1.get(
+            reverse('yourgrades:export_school', args=['csv'])
+        )
+        self.assertEqual(response.status_code, 403)
+
+        # GET, user with manager permission -> streamed file
+        for url in [
+            reverse('yourgrades:export_school', args=['csv']),
+            reverse(
+                'yourgrades:export_class',
+                args=['csv', self.student.school_class.unique_code]
+            ),
+            reverse(
+                'yourgrades:export_subject',
+                args=['csv', self.subject.unique_code]
+            ),
+        ]:
+            response = self.client_2.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content).decode('utf-8-sig')
+            self.assertEqual(len(content.splitlines()), 4)
+
+        response = self.client_2.get(
+            reverse(
+                'yourgrades:export_subject',
+                args=['xlsx', self.subject.unique_code]
+            )
+        )
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="grades_hi2a20.xlsx"'
+        )
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'PK'))
+
+        # Unknown format or class -> 404
+        response = self.client_2.get(
+            reverse('yourgrades:export_school', args=['pdf'])
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client_2.get(
+            reverse('yourgrades:export_class', args=['csv', '9z2020'])
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ManagerStatisticsViewTestCase(TestWithPermission):
+
+    def setUp(self):
+        super(ManagerStatisticsViewTestCase, self).setUp()
+        user = self.create_user()
+        self.client_1 = Client()
+        self.client_1.login(
+            username=user.username,
+            password=self.password
+        )
+
+        user_manager = self.create_manager()
+        self.client_2 = Client()
+        self.client_2.login(
+            username=user_manager.username,
+            password=self.password
+        )
+        student = self.create_person('student')
+        subject = Subject.objects.create(
+            name='Historia',
+            unique_code='hi2a20',
+            school_class=student.school_class
+        )
+        for number in range(3):
+            Grades.objects.create(
+                student=student,
+                subject=subject,
+                grade=number + 4,
+                weight=1
+            )
+
+    def test_manager_statistics(self):
+        url = reverse('yourgrades:manager_statistics')
+        # GET, user without manager permission -> 403
+        response = self.client_1.get(url)
+        self.assertEqual(response.status_code, 403)
+
+        # GET, user with manager permission before the first refresh
+        response = self.client_2.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'yourgrades/managerstatistics.html')
+        self.assertEqual(response.context['subjects'], [])
+        self.assertEqual(response.context['refreshed'], None)
+
+        GradeStatistics.refresh()
+        response = self.client_2.get(url)
+        self.assertEqual(len(response.context['subjects']), 1)
+        self.assertEqual(response.context['total']['mean'], 5)
+        self.assertContains(response, 'Historia')
+        self.assertQueryBudget(response)
+
+
 class DeleteSubjectViewTestCase(TestWithPermission):
 
     def setUp(self):
@@ -1721,6 +2163,19 @@ class TeacherPanelViewTestCase(TestWithPermission):
         self.assertEqual(response.status_code, 302)
         self.assertRedirects(response, '/yourgrades/firstlogin')
 
+    def test_teacher_loaded_once(self):
+        # get() and get_context_data() share the teacher of the request
+        table = connection.ops.quote_name(Teacher._meta.db_table)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_2.get(reverse('yourgrades:teacher'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len([query for query in queries
+                 if query['sql'].startswith('SELECT')
+                 and f'FROM {table}' in query['sql']]),
+            1
+        )
+
 
 class TeacherSubjectViewTestCase(TestWithPermission):
 
@@ -1783,10 +2238,168 @@ class TeacherSubjectViewTestCase(TestWithPermission):
             f'/yourgrades/teachersubject/{self.subject.unique_code}'
         )
 
-        # Checking creation mail with info about new grade
+        # Checking creation mail with info about new grade, delivered from
+        # the notification queue
+        self.assertFalse(
+            Delivery.objects.filter(message__sender=self.teacher.user)
+        )
+        notifications.drain()
         self.assertTrue(
-            MailboxReceived.objects.filter(sender__user=self.teacher.user)
+            Delivery.objects.filter(message__sender=self.teacher.user)
+        )
+
+        # POST with wrong grade -> form with errors rendered for the student
+        response = self.client_2.post(
+            reverse(
+                'yourgrades:teacher_subject',
+                kwargs={'subject_unique_code': self.subject.unique_code}
+            ),
+            {'grade': 9, 'weight': 7, 'student': self.student.user.id}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['invalid_student'], self.student)
+        self.assertTrue(response.context['form2'].errors)
+
+    def test_grade_matrix_queries(self):
+        # Class grade matrix is rendered in a fixed number of queries,
+        # regardless of class size
+        url = reverse(
+            'yourgrades:teacher_subject',
+            kwargs={'subject_unique_code': self.subject.unique_code}
+        )
+        Grades.objects.create(
+            grade=5,
+            weight=3,
+            student=self.student,
+            subject=self.subject
+        )
+        # Page totals and role versions are cached, both captures start
+        # from a cold cache
+        cache.clear()
+        with CaptureQueriesContext(connection) as one_student:
+            self.client_2.get(url)
+        for number in range(34):
+            student = self.create_person('student')
+            Grades.objects.create(
+                grade=number % 6 + 1,
+                weight=3,
+                student=student,
+                subject=self.subject
+            )
+        cache.clear()
+        with CaptureQueriesContext(connection) as whole_class:
+            response = self.client_2.get(url)
+        self.assertEqual(len(response.context['students']), 35)
+        self.assertEqual(len(whole_class), len(one_student))
+        self.assertEqual(response.context['averages'][self.student.pk], 5)
+        self.assertEqual(
+            response.context['statistics'][self.student.pk]['median'],
+            5
+        )
+        self.assertEqual(response.context['distribution'], [6, 6, 6, 6, 6, 5])
+        # Budget is for warm caches
+        self.assertQueryBudget(self.client_2.get(url))
+
+
+class TeacherBatchGradeViewTestCase(TestWithPermission):
+
+    def setUp(self):
+        super(TeacherBatchGradeViewTestCase, self).setUp()
+        user = self.create_user()
+        self.client_1 = Client()
+        self.client_1.login(
+            username=user.username,
+            password=self.password
+        )
+
+        self.teacher = self.create_person('teacher')
+        self.client_2 = Client()
+        self.client_2.login(
+            username=self.teacher.user.username,
+            password=self.password
+        )
+        self.students = [self.create_person('student') for number in range(3)]
+        self.subject = Subject.objects.create(
+            name='English',
+            unique_code='En4d2020',
+            school_class=self.students[0].school_class
+        )
+        self.url = reverse(
+            'yourgrades:teacher_batch_grades',
+            kwargs={'subject_unique_code': self.subject.unique_code}
+        )
+
+    def grades_data(self, grades, weight=3):
+        data = {'weight': weight}
+        for student, grade in zip(self.students, grades):
+            data[f'grade_{student.user_id}'] = grade
+        return data
+
+    def test_batch_grades(self):
+        # GET, user without teacher permission -> 403
+        response = self.client_1.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+        # GET, user with teacher permission -> 200, field for every student
+        response = self.client_2.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'yourgrades/teacherbatchgrades.html')
+        self.assertEqual(len(response.context['form'].student_fields()), 3)
+
+        # POST, no grades or one grade out of range -> nothing saved
+        response = self.client_2.post(self.url, self.grades_data(['', '']))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].non_field_errors())
+        response = self.client_2.post(self.url, self.grades_data([5, 7, 1]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Grades.objects.exists())
+
+        # POST, valid grades -> saved with averages, one message per grade
+        # after delivery
+        response = self.client_2.post(self.url, self.grades_data([5, '', 5]))
+        self.assertRedirects(
+            response,
+            reverse(
+                'yourgrades:teacher_subject',
+                kwargs={'subject_unique_code': self.subject.unique_code}
+            )
+        )
+        self.assertEqual(
+            set(Grades.objects.values_list('student_id', 'grade', 'weight')),
+            {(self.students[0].pk, 5, 3), (self.students[2].pk, 5, 3)}
         )
+        self.assertEqual(
+            GradeAverage.objects.get(student=self.students[2]).average,
+            5
+        )
+        self.assertEqual(
+            set(GradeEvent.objects.values_list('kind', 'grade_key')),
+            {(GradeEvent.ADDED, grade_id)
+             for grade_id in Grades.objects.values_list('id', flat=True)}
+        )
+        notifications.drain()
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(
+            set(Delivery.objects.values_list(
+                'user_id',
+                flat=True
+            )),
+            {self.students[0].user_id, self.students[2].user_id}
+        )
+
+    def test_batch_grades_queries(self):
+        # Number of queries doesn't grow with the class size
+        with CaptureQueriesContext(connection) as small_class:
+            self.client_2.post(self.url, self.grades_data([5, 4, 3]))
+        self.students += [self.create_person('student') for number in range(7)]
+        with CaptureQueriesContext(connection) as large_class:
+            self.client_2.post(
+                self.url,
+                self.grades_data([5, 4, 3, 5, 4, 3, 3, 4, 5, 5])
+            )
+        self.assertEqual(Grades.objects.count(), 13)
+        # Existing averages add one bulk update
+        self.assertEqual(len(large_class), len(small_class) + 1)
 
 
 class CreateMessageViewTestCase(TestWithPermission):
@@ -1850,18 +2463,46 @@ class CreateMessageViewTestCase(TestWithPermission):
 
         # Checking mail creation
         self.assertTrue(
-            MailboxReceived.objects.filter(
-                sender__user=self.teacher.user,
-                recipient__user=self.student.user
+            Delivery.objects.filter(
+                message__sender=self.teacher.user,
+                user=self.student.user
             )
         )
-        message = MailboxReceived.objects.get(
-            sender__user=self.teacher.user,
-            recipient__user=self.student.user
+        message = Delivery.objects.get(
+            message__sender=self.teacher.user,
+            user=self.student.user
         ).message
         self.assertEqual(message.subject, form_data['subject'])
         self.assertEqual(message.text, form_data['text'])
 
+        # POST to all parents of the class -> every parent gets the mail
+        parents = [self.create_person('parent') for number in range(3)]
+        response = self.client_2.post(
+            reverse(
+                'yourgrades:create_message',
+                kwargs={
+                    'prefix': 2,
+                    'code': self.student.school_class.unique_code
+                }
+            ),
+            {'subject': 'To parents', 'text': 'Some text.'}
+        )
+        self.assertEqual(response.status_code, 302)
+        # The message is stored once, as a broadcast to the class parents
+        self.assertFalse(
+            Delivery.objects.filter(message__subject='To parents').exists()
+        )
+        for parent in parents:
+            self.assertTrue(
+                received_messages(parent.user).filter(
+                    subject='To parents'
+                ).exists()
+            )
+        self.assertEqual(
+            Message.objects.get(subject='To parents').recipient_name,
+            f'{self.student.school_class.name} parents'
+        )
+
 
 class MailboxViewTestCase(TestWithPermission):
 
@@ -1890,6 +2531,24 @@ class MailboxViewTestCase(TestWithPermission):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'yourgrades/mailbox.html')
 
+    def test_mailbox_queries(self):
+        teacher = self.create_person('teacher')
+        for number in range(20):
+            message = Message.objects.create(
+                subject=f'Subject {number}',
+                text='Text.'
+            )
+            send_message(message, teacher.user, [self.parent.user_id])
+            message = Message.objects.create(
+                subject=f'Reply {number}',
+                text='Text.'
+            )
+            send_message(message, self.parent.user, [teacher.user_id], 'T')
+        response = self.client_2.get(reverse('yourgrades:mailbox'))
+        self.assertEqual(len(response.context['received']), 15)
+        self.assertEqual(len(response.context['sent']), 15)
+        self.assertQueryBudget(response)
+
 
 class MailTextViewTestCase(TestWithPermission):
 
@@ -1910,18 +2569,13 @@ class MailTextViewTestCase(TestWithPermission):
         self.teacher = self.create_person('teacher')
         message = Message.objects.create(
             subject='Test subject',
-            text='Test text.'
+            text='Test text.',
+            sender=self.teacher.user
         )
-        recipient = Recipient.objects.create(
+        self.mailbox_received = Delivery.objects.create(
             user=self.student.user,
             message=message
         )
-        sender = Sender.objects.create(user=self.teacher.user, message=message)
-        self.mailbox_received = MailboxReceived.objects.create(
-            sender=sender,
-            recipient=recipient,
-            message=message,
-        )
 
     def test_mailbox(self):
         # GET, user without student/parent/teacher/manager permission -> 403
@@ -1929,7 +2583,7 @@ class MailTextViewTestCase(TestWithPermission):
             reverse(
                 'yourgrades:mail_text',
                 kwargs={
-                     'mailbox_id': self.mailbox_received.id,
+                     'mailbox_id': self.mailbox_received.message_id,
                      'mailbox_type': 1
                  }
             )
@@ -1942,7 +2596,7 @@ class MailTextViewTestCase(TestWithPermission):
             reverse(
                 'yourgrades:mail_text',
                 kwargs={
-                    'mailbox_id': self.mailbox_received.id,
+                    'mailbox_id': self.mailbox_received.message_id,
                     'mailbox_type': 1
                 }
             )
@@ -1951,22 +2605,29 @@ class MailTextViewTestCase(TestWithPermission):
         self.assertTemplateUsed(response, 'yourgrades/mailtext.html')
         # Checking if message is read
         self.assertEqual(
-            MailboxReceived.objects.get(id=self.mailbox_received.id).read,
+            Delivery.objects.get(id=self.mailbox_received.id).read,
             True
         )
+        self.assertEqual(UnreadCounter.get_unread(self.student.user), 0)
+        # Reading the same message again doesn't change the counter
+        UnreadCounter.increment([self.student.user.id])
+        self.client_2.get(
+            reverse(
+                'yourgrades:mail_text',
+                kwargs={
+                    'mailbox_id': self.mailbox_received.message_id,
+                    'mailbox_type': 1
+                }
+            )
+        )
+        self.assertEqual(UnreadCounter.get_unread(self.student.user), 1)
 
         # Mailbox type 2 (sent)
-        new_message = Message.objects.create(
+        mailbox_sent = Message.objects.create(
             subject='Test subject 2',
-            text='Test text 2.'
-        )
-        mailbox_sent = MailboxSent.objects.create(
-            sender=Sender.objects.create(
-                user=self.student.user,
-                message=new_message
-            ),
-            recipient='Jan Kowalski',
-            message=new_message
+            text='Test text 2.',
+            sender=self.student.user,
+            recipient_name='Jan Kowalski'
         )
         response = self.client_2.get(
             reverse(
@@ -1977,6 +2638,31 @@ class MailTextViewTestCase(TestWithPermission):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'yourgrades/mailtext.html')
 
+    def test_other_users_mail(self):
+        # Mails of other users can't be read
+        response = self.client_2.get(
+            reverse(
+                'yourgrades:mail_text',
+                kwargs={
+                    'mailbox_id': self.mailbox_received.message_id,
+                    'mailbox_type': 2
+                }
+            )
+        )
+        self.assertEqual(response.status_code, 404)
+        other = Delivery.objects.create(
+            user=self.teacher.user,
+            message=Message.objects.create(subject='Other', text='-')
+        )
+        response = self.client_2.get(
+            reverse(
+                'yourgrades:mail_text',
+                kwargs={'mailbox_id': other.message_id, 'mailbox_type': 1}
+            )
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Delivery.objects.get(id=other.id).read)
+
 
 class StudentParentViewTestCase(TestWithPermission):
 
@@ -2025,3 +2711,111 @@ class StudentParentViewTestCase(TestWithPermission):
         self.assertTemplateUsed(response, 'yourgrades/studentparent.html')
         # Checking user type (parent/student)
         self.assertEqual(response.context['person'], self.student)
+
+    def test_grade_sheet_queries(self):
+        # Grade sheet is loaded in a constant number of queries, no matter
+        # how many subjects and grades the student has
+        school_class = self.student.school_class
+        for number in range(5):
+            subject = Subject.objects.create(
+                name=f'Subject {number}',
+                unique_code=f'S{number}{school_class.unique_code}',
+                school_class=school_class
+            )
+            for grade in range(1, 4):
+                Grades.objects.create(
+                    grade=grade,
+                    weight=2,
+                    student=self.student,
+                    subject=subject
+                )
+        # session, user, 2x permissions, student, unread mails, subjects,
+        # grades, averages
+        response = self.client_3.get(reverse('yourgrades:student_parent'))
+        self.assertQueryBudget(response)
+        self.assertEqual(len(response.context['subjects_grades']), 5)
+        for grades in response.context['subjects_grades'].values():
+            self.assertEqual([grade.grade for grade in grades], [1, 2, 3])
+        for average in response.context['averages'].values():
+            self.assertEqual(average, 2)
+
+
+class RequestStatsViewTestCase(TestWithPermission):
+
+    def setUp(self):
+        super(RequestStatsViewTestCase, self).setUp()
+        middleware.reset()
+        self.student = self.create_person('student')
+        self.student.first_login = False
+        self.student.save()
+        self.client_1 = Client()
+        self.client_1.login(
+            username=self.student.user.username,
+            password=self.password
+        )
+        manager = self.create_manager()
+        self.client_2 = Client()
+        self.client_2.login(username=manager.username, password=self.password)
+
+    def test_server_timing(self):
+        response = self.client_1.get(reverse('yourgrades:student_parent'))
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[0-9.]+;desc="\d+ queries", tpl;dur=[0-9.]+, '
+            r'total;dur=[0-9.]+$'
+        )
+        self.assertEqual(
+            response.request_stats.view_name,
+            'yourgrades:student_parent'
+        )
+        self.assertGreater(response.request_stats.template_time, 0)
+
+    def test_request_stats(self):
+        # GET, user without manager permission -> 403
+        response = self.client_1.get(reverse('yourgrades:request_stats'))
+        self.assertEqual(response.status_code, 403)
+
+        # GET, user with manager permission -> 200
+        for number in range(3):
+            self.client_1.get(reverse('yourgrades:student_parent'))
+        response = self.client_2.get(reverse('yourgrades:request_stats'))
+        self.assertEqual(response.status_code, 200)
+        summary = response.json()['yourgrades:student_parent']
+        self.assertEqual(summary['requests'], 3)
+        self.assertLessEqual(
+            summary['queries_max'],
+            QUERY_BUDGETS['yourgrades:student_parent']
+        )
+
+
+class ExplainQueriesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_school(classes=1, students=2, subjects=2, grades=2,
+                      messages=1)
+
+    def test_explain_queries(self):
+        # Plans of the queries the views ran, nothing is left behind
+        output = io.StringIO()
+        errors = io.StringIO()
+        call_command('explain_queries', stdout=output, stderr=errors)
+        self.assertEqual(errors.getvalue(), '')
+        self.assertIn(
+            '== yourgrades:teacher_subject as teacher: query',
+            output.getvalue()
+        )
+        self.assertIn('yourgrades_grades', output.getvalue())
+        self.assertFalse(
+            User.objects.filter(username='explain_queries').exists()
+        )
+
+    def test_subject_without_teacher(self):
+        # Teacher views are skipped
+        SubjectTeachers.objects.all().delete()
+        subject, users = explain_queries.sample_users()
+        self.assertNotIn('teacher', users)
+        self.assertNotIn(
+            'teacher',
+            [role for role, view, kwargs in
+             explain_queries.hot_requests(subject, users)]
+        )
@@ -0,0 +1,84 @@
+"""
+Timetable grids (lessons x days) cached per school class and per teacher.
+
+Cached lesson dates are keyed with a generation number. Any change of lesson
+dates or subject teachers bumps the generation (see signals.py), so all
+grids built before the change are never read again and expire.
+"""
+import time
+from django.core.cache import cache
+from .models import SubjectDate
+
+LESSONS = 12
+DAYS = [day for day, name in SubjectDate.DAYS]
+DAY_INDEX = {day: index for index, day in enumerate(DAYS)}
+
+GENERATION_KEY = 'yourgrades:timetable:generation'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Start from current time, so generations used before the key was
+        # evicted are not reused
+        cache.add(GENERATION_KEY, int(time.time() * 1000), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, int(time.time() * 1000), None)
+
+
+def get_lessons(key, subject_dates):
+    """
+    Returns cached list of (lesson index, day index, subject) tuples,
+    evaluating subject_dates queryset only on a cache miss.
+    """
+    cache_key = f'yourgrades:timetable:{get_generation()}:{key}'
+    lessons = cache.get(cache_key)
+    if lessons is None:
+        lessons = [
+            (date.lesson_number - 1, DAY_INDEX[date.day], date.subject)
+            for date in subject_dates
+        ]
+        cache.set(cache_key, lessons, CACHE_TIMEOUT)
+    return lessons
+
+
+def build_grid(lessons, subject_id=None):
+    """
+    Returns LESSONS x DAYS grid with subjects in occupied cells and False in
+    free ones. With subject_id, cells contain True for lessons of that
+    subject only.
+    """
+    grid = [[False for day in DAYS] for lesson in range(LESSONS)]
+    for lesson, day, subject in lessons:
+        if subject_id is None:
+            grid[lesson][day] = subject
+        elif subject.id == subject_id:
+            grid[lesson][day] = True
+    return grid
+
+
+def school_class_lessons(school_class_id):
+    return get_lessons(
+        f'class:{school_class_id}',
+        SubjectDate.objects.filter(
+            subject__school_class_id=school_class_id
+        ).select_related('subject')
+    )
+
+
+def teacher_lessons(teacher_user_id):
+    return get_lessons(
+        f'teacher:{teacher_user_id}',
+        SubjectDate.objects.filter(
+            subject__subjectteachers__teacher__user_id=teacher_user_id,
+            subject__school_class__active=True
+        ).select_related('subject__school_class').distinct()
+    )
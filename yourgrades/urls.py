@@ -10,6 +10,10 @@ urlpatterns = [
          name='create_school_class'),
     path('/manager/editschoolclass/<str:class_unique_code>',
          views.EditSchoolClassView.as_view(), name='edit_school_class'),
+    path('/manager/editschoolclass/<str:class_unique_code>/importroster',
+         views.ImportRosterView.as_view(), name='import_roster'),
+    path('/manager/resetschoolclass/<str:class_unique_code>',
+         views.ResetSchoolClassView.as_view(), name='reset_school_class'),
     path('/manager/delstudent/<int:user_id>',
          views.DeleteStudentView.as_view(), name='del_student'),
     path('/manager/deactivationschoolclass/<str:class_unique_code>',
@@ -56,6 +60,8 @@ urlpatterns = [
     path('/teacher', views.TeacherPanelView.as_view(), name='teacher'),
     path('/teachersubject/<str:subject_unique_code>',
          views.TeacherSubjectView.as_view(), name='teacher_subject'),
+    path('/teachersubject/<str:subject_unique_code>/batch',
+         views.TeacherBatchGradeView.as_view(), name='teacher_batch_grades'),
     path('/timetable/<str:person>', views.TimetableView.as_view(),
          name='timetable'),
     path('/mailbox', views.MailboxView.as_view(), name='mailbox'),
@@ -71,4 +77,16 @@ urlpatterns = [
          name='manager_student'),
     path('/manager/history', views.ManagerGradesHistoryView.as_view(),
          name='manager_history'),
+    path('/manager/statistics', views.ManagerStatisticsView.as_view(),
+         name='manager_statistics'),
+    path('/manager/requeststats', views.RequestStatsView.as_view(),
+         name='request_stats'),
+    path('/manager/export/<str:export_format>',
+         views.ExportGradesView.as_view(), name='export_school'),
+    path('/manager/export/<str:export_format>/class/'
+         '<str:class_unique_code>', views.ExportGradesView.as_view(),
+         name='export_class'),
+    path('/manager/export/<str:export_format>/subject/'
+         '<str:subject_unique_code>', views.ExportGradesView.as_view(),
+         name='export_subject'),
 ]
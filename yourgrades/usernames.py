@@ -0,0 +1,257 @@
+"""
+Username allocation. Gradebook usernames are name + surname, followed by the
+lowest free number from 2 when the name is taken (JanKowalski, JanKowalski2,
+...). Taken names are read with one prefix query per base name instead of
+probing the numbers one by one.
+
+Callers usually write users inside their own transaction, whose snapshot
+(REPEATABLE READ on MySQL) doesn't show users committed after it started.
+So users are written with the UsernameLock rows of their bases locked, and
+taken names are read with a locking read, which sees the latest committed
+rows. Concurrent allocations of the same name wait for each other; writes
+that don't take the lock (roster import) are handled by repeating the
+allocation in a savepoint when the unique username constraint fails.
+"""
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+from .backends import deferred_credentials
+from .hashing import hash_passwords
+from .models import ActivationToken, UsernameLock
+
+MAX_ATTEMPTS = 5
+QUERY_BATCH_SIZE = 500
+
+
+def lock_bases(bases):
+    """
+    Locks UsernameLock rows of bases until the end of the current
+    transaction, creating missing ones. Rows are locked in a fixed order, so
+    two allocations can't deadlock on them.
+    """
+    bases = sorted({base[:150].lower() for base in bases})
+    UsernameLock.objects.bulk_create(
+        [UsernameLock(base=base) for base in bases],
+        batch_size=QUERY_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+    for start in range(0, len(bases), QUERY_BATCH_SIZE):
+        list(
+            UsernameLock.objects.select_for_update().filter(
+                base__in=bases[start:start + QUERY_BATCH_SIZE]
+            ).order_by('base')
+        )
+
+
+def taken_usernames(bases, lock=False):
+    """
+    Returns set of lowercased existing usernames starting with any of bases
+    in any case, as the unique constraint of usernames is case insensitive
+    on MySQL. lock=True reads them with a locking read (in a transaction),
+    which sees rows committed after the transaction's snapshot.
+    """
+    taken = set()
+    bases = list(dict.fromkeys(bases))
+    users = User.objects.select_for_update() if lock else User.objects
+    for start in range(0, len(bases), QUERY_BATCH_SIZE):
+        condition = Q()
+        for base in bases[start:start + QUERY_BATCH_SIZE]:
+            condition |= Q(username__istartswith=base)
+        taken.update(
+            username.lower()
+            for username in users.filter(condition).values_list(
+                'username',
+                flat=True
+            )
+        )
+    return taken
+
+
+def next_free(base, taken):
+    # taken holds lowercased usernames, see taken_usernames()
+    username = base
+    numbering = 2
+    while username.lower() in taken:
+        username = f'{base}{numbering}'
+        numbering += 1
+    return username
+
+
+def allocate_usernames(bases):
+    """
+    Returns list of free usernames for bases, in order, skipping names taken
+    in the database or earlier in the list.
+    """
+    taken = taken_usernames(bases)
+    usernames = []
+    for base in bases:
+        username = next_free(base, taken)
+        taken.add(username.lower())
+        usernames.append(username)
+    return usernames
+
+
+def create_user(name, surname, password_suffix):
+    """
+    Creates user with a free username for name + surname and the initial
+    password username + password_suffix (an activation token with deferred
+    credentials).
+    """
+    base = name + surname
+    deferred = deferred_credentials()
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                lock_bases([base])
+                username = next_free(base, taken_usernames([base], lock=True))
+                password = f'{username}{password_suffix}'
+                user = User.objects.create_user(
+                    username=username,
+                    password=None if deferred else password,
+                    first_name=name,
+                    last_name=surname
+                )
+                if deferred:
+                    ActivationToken.issue({user.id: password})
+                return user
+        except IntegrityError:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+
+
+def reset_username(user, password_suffix):
+    """
+    Gives user the lowest free username for its first + last name (keeping
+    its own username when that's the one) and the initial password.
+    """
+    base = user.first_name + user.last_name
+    current = user.username
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                lock_bases([base])
+                taken = taken_usernames([base], lock=True)
+                taken.discard(current.lower())
+                user.username = next_free(base, taken)
+                password = f'{user.username}{password_suffix}'
+                if deferred_credentials():
+                    user.set_unusable_password()
+                else:
+                    user.set_password(password)
+                user.save()
+                if deferred_credentials():
+                    ActivationToken.issue({user.id: password})
+                else:
+                    ActivationToken.consume(user)
+                return user
+        except IntegrityError:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+
+
+def plan_usernames(users, taken):
+    """
+    Returns new usernames of users, like reset_username() of each user in
+    turn: the lowest free username of its name, its own when that's the
+    one. Usernames the users had before don't become free for the others,
+    the new names are written with one UPDATE, which can't swap them.
+    """
+    taken = set(taken)
+    usernames = []
+    for user in users:
+        base = user.first_name + user.last_name
+        taken.discard(user.username.lower())
+        username = next_free(base, taken)
+        taken.add(username.lower())
+        # Still held until the update, other users can't take it
+        taken.add(user.username.lower())
+        usernames.append(username)
+    return usernames
+
+
+def initial_passwords(usernames, password_suffixes):
+    return [
+        f'{username}{suffix}'
+        for username, suffix in zip(usernames, password_suffixes)
+    ]
+
+
+def hash_reset_passwords(users, password_suffixes):
+    """
+    Returns {password: hash} of the initial passwords reset_usernames() will
+    most likely give users, hashed by hash_passwords() (in a process pool for
+    large classes). Call it before opening the transaction of the reset, so
+    the transaction isn't kept open while the CPU works, like the roster
+    import does. Empty with deferred credentials.
+    """
+    if deferred_credentials():
+        return {}
+    users = list(users)
+    bases = [user.first_name + user.last_name for user in users]
+    passwords = initial_passwords(
+        plan_usernames(users, taken_usernames(bases)),
+        password_suffixes
+    )
+    return dict(zip(passwords, hash_passwords(passwords)))
+
+
+def reset_usernames(users, password_suffixes, hashes=None):
+    """
+    Bulk version of reset_username() for many users; password_suffixes are
+    given per user. Usernames are chosen by plan_usernames(). hashes are
+    password hashes from hash_reset_passwords(), passwords missing from it
+    (allocation changed in the meantime) are hashed by hash_passwords().
+    Users are written with bulk_update.
+    """
+    users = list(users)
+    hashes = dict(hashes or {})
+    originals = [user.username for user in users]
+    bases = [user.first_name + user.last_name for user in users]
+    deferred = deferred_credentials()
+    for attempt in range(MAX_ATTEMPTS):
+        for user, username in zip(users, originals):
+            user.username = username
+        try:
+            with transaction.atomic():
+                lock_bases(bases)
+                usernames = plan_usernames(
+                    users,
+                    taken_usernames(bases, lock=True)
+                )
+                passwords = initial_passwords(
+                    usernames,
+                    password_suffixes
+                )
+                if deferred:
+                    password_hashes = [make_password(None)] * len(users)
+                else:
+                    missing = [password for password in passwords
+                               if password not in hashes]
+                    hashes.update(zip(missing, hash_passwords(missing)))
+                    password_hashes = [hashes[password]
+                                       for password in passwords]
+                for user, username, password_hash in zip(
+                        users,
+                        usernames,
+                        password_hashes):
+                    user.username = username
+                    user.password = password_hash
+                User.objects.bulk_update(
+                    users,
+                    ['username', 'password'],
+                    batch_size=QUERY_BATCH_SIZE
+                )
+                if deferred:
+                    ActivationToken.issue({
+                        user.id: password
+                        for user, password in zip(users, passwords)
+                    })
+                else:
+                    ActivationToken.objects.filter(
+                        user__in=users
+                    ).delete()
+                return users
+        except IntegrityError:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
@@ -1,30 +1,42 @@
+from datetime import datetime, time
 from django.shortcuts import render, get_object_or_404, get_list_or_404
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.contrib.auth import authenticate, login, logout
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import Http404
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.views import View
 from django.views.generic import TemplateView, FormView
 from django.views.generic.edit import FormMixin, ProcessFormView
-from django.core.exceptions import FieldError, ObjectDoesNotExist
+from django.core.exceptions import FieldError
 from django.db import IntegrityError, transaction, DataError
-from django.core.paginator import Paginator
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from .models import *
 from .permissions import *
 from .forms import *
+from .queries import load_grade_sheet, load_grade_matrix, \
+    load_class_rosters, load_averages
+from .messaging import send_message, send_broadcast, received_messages, \
+    get_unread, mark_read
+from .pagination import KeysetPaginator
+from .roster import RosterError, read_roster, validate_roster, \
+    import_roster
+from . import analytics
+from . import export
+from . import timetables
+from . import middleware
+from . import usernames
+from .roles import RoleRequiredMixin, get_role
+from .identity import identity_map
+from .grading import add_grades, grade_message
 
 
 class BaseView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        unread = MailboxReceived.objects.filter(
-            recipient__user=self.request.user,
-            read=False
-        )
-        context['unread'] = len(unread)
+        context['unread'] = get_unread(self.request.user)
         try:
             context['username'] = self.request.session['user']
         except KeyError:
@@ -43,14 +55,14 @@ class HomepageView(FormView):
             return self.render_to_response(self.get_context_data())
 
     def get_success_url(self):
-        user_permission = list(self.request.user.get_all_permissions())[0]
-        if user_permission == 'yourgrades.student':
+        user_role = get_role(self.request)
+        if user_role == 'student':
             return reverse('yourgrades:student_parent')
-        elif user_permission == 'yourgrades.parent':
+        elif user_role == 'parent':
             return reverse('yourgrades:student_parent')
-        elif user_permission == 'yourgrades.teacher':
+        elif user_role == 'teacher':
             return reverse('yourgrades:teacher')
-        elif user_permission == 'yourgrades.manager':
+        elif user_role == 'manager':
             return reverse('yourgrades:manager')
         else:
             raise ValueError("Unknown permission")
@@ -90,45 +102,36 @@ class LogOutView(View):
         return HttpResponseRedirect(reverse('yourgrades:homepage'))
 
 
-class FirstLoginView(LoginRequiredMixin, UserPassesTestMixin, ProcessFormView,
+class FirstLoginView(RoleRequiredMixin, ProcessFormView,
                      FormMixin, BaseView):
     template_name = 'yourgrades/firstlogin.html'
     form_class = FirstLoginForm
     permission = {
-        'yourgrades.student': Student,
-        'yourgrades.parent': Parent,
-        'yourgrades.teacher': Teacher
+        'student': Student,
+        'parent': Parent,
+        'teacher': Teacher
     }
 
-    def test_func(self):
-        test = False
-        if self.request.user.has_perm('yourgrades.student') \
-                or self.request.user.has_perm('yourgrades.parent') \
-                or self.request.user.has_perm('yourgrades.teacher'):
-            test = True
-        return test
+    roles = {'student', 'parent', 'teacher'}
 
     def get_success_url(self):
-        user_permission = list(self.request.user.get_all_permissions())[0]
-        if user_permission == 'yourgrades.student':
-            self.request.session['user'] = get_object_or_404(
-                Student,
-                user=self.request.user
-            ).__str__()
+        user_role = get_role(self.request)
+        if user_role == 'student':
+            self.request.session['user'] = identity_map(
+                self.request
+            ).get_or_404(Student, self.request.user.id).__str__()
             return reverse('yourgrades:student_parent')
-        elif user_permission == 'yourgrades.parent':
-            self.request.session['user'] = get_object_or_404(
-                Parent,
-                user=self.request.user
-            ).__str__()
+        elif user_role == 'parent':
+            self.request.session['user'] = identity_map(
+                self.request
+            ).get_or_404(Parent, self.request.user.id).__str__()
             return reverse('yourgrades:student_parent')
-        elif user_permission == 'yourgrades.teacher':
-            self.request.session['user'] = get_object_or_404(
-                Teacher,
-                user=self.request.user
-            ).__str__()
+        elif user_role == 'teacher':
+            self.request.session['user'] = identity_map(
+                self.request
+            ).get_or_404(Teacher, self.request.user.id).__str__()
             return reverse('yourgrades:teacher')
-        elif user_permission == 'yourgrades.manager':
+        elif user_role == 'manager':
             self.request.session['user'] = self.request.user.username
             return reverse('yourgrades:manager')
         else:
@@ -156,9 +159,16 @@ class FirstLoginView(LoginRequiredMixin, UserPassesTestMixin, ProcessFormView,
             if form.cleaned_data['password'] == \
                     form.cleaned_data['password_confirm']:
                 try:
+                    # The only password hash of accounts created with
+                    # deferred credentials is computed here
                     user.set_password(form.cleaned_data['password'])
                     user.save()
-                    login(self.request, user)
+                    ActivationToken.consume(user)
+                    login(
+                        self.request,
+                        user,
+                        backend='django.contrib.auth.backends.ModelBackend'
+                    )
                 except IntegrityError:
                     raise Http404('Password problem.')
             else:
@@ -167,76 +177,87 @@ class FirstLoginView(LoginRequiredMixin, UserPassesTestMixin, ProcessFormView,
                     'yourgrades/firstlogin.html',
                     {'form': form, 'pass_no_confirm': True, }
                 )
-            user_permission = list(self.request.user.get_all_permissions())[0]
-            person = get_object_or_404(
-                self.permission[user_permission],
-                user=user
+            person = identity_map(self.request).get_or_404(
+                self.permission[get_role(self.request)],
+                user.id
             )
             person.first_login = False
             person.save()
         return super().form_valid(form)
 
 
-class ManagerPanelView(LoginRequiredMixin, UserPassesTestMixin, BaseView):
+class ManagerPanelView(RoleRequiredMixin, BaseView):
     template_name = 'yourgrades/manager.html'
-    inactive_school_classes = None
-    inactive_teachers = None
+    show_inactive_classes = False
+    show_inactive_teachers = False
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def post(self, request, **kwargs):
-        try:
-            if request.POST['inactive_class'] == 'on':
-                self.inactive_school_classes = \
-                    SchoolClass.objects.filter(active=False).order_by('-year')
-            else:
-                self.inactive_school_classes = None
-            return super(ManagerPanelView, self).render_to_response(
-                self.get_context_data(**kwargs)
+        # Inactive classes / teachers are fetched only when they are toggled
+        if 'inactive_class' in request.POST:
+            self.show_inactive_classes = request.POST['inactive_class'] == 'on'
+        elif 'inactive_teachers' in request.POST:
+            self.show_inactive_teachers = \
+                request.POST['inactive_teachers'] == 'on'
+        else:
+            return HttpResponseRedirect(
+                self.request.META.get('HTTP_REFERER')
             )
-        except KeyError:
-            try:
-                if request.POST['inactive_teachers'] == 'on':
-                    self.inactive_teachers = \
-                        Teacher.objects.filter(active=False).order_by('name')
-                else:
-                    self.inactive_teachers = None
-                return super(ManagerPanelView, self).render_to_response(
-                    self.get_context_data(**kwargs)
-                )
-            except KeyError:
-                return HttpResponseRedirect(
-                    self.request.META.get('HTTP_REFERER')
-                )
+        return super(ManagerPanelView, self).render_to_response(
+            self.get_context_data(**kwargs)
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['classes'] = SchoolClass.objects.filter(
+        context['classes'] = list(
+            SchoolClass.objects.filter(active=True).order_by('name')
+        )
+        context['students'] = load_class_rosters(context['classes'])
+        context['teachers'] = Teacher.objects.filter(
             active=True
-        ).order_by('name')
-        context['ia_classes'] = self.inactive_school_classes
+        ).select_related('user').order_by('name')
+
+        context['ia_classes'] = None
+        if self.show_inactive_classes:
+            context['ia_classes'] = SchoolClass.objects.filter(
+                active=False
+            ).order_by('-year')
+        context['ia_teachers'] = None
+        if self.show_inactive_teachers:
+            context['ia_teachers'] = Teacher.objects.filter(
+                active=False
+            ).select_related('user').order_by('name')
+        return context
 
-        students = {}
-        for my_class in context['classes']:
-            all_students = Student.objects.filter(school_class=my_class)
-            students[my_class] = all_students
-        context['students'] = students
 
-        context['teachers'] = Teacher.objects.filter(
-            active=True
-        ).order_by('name')
-        context['ia_teachers'] = self.inactive_teachers
+class ManagerStatisticsView(RoleRequiredMixin, BaseView):
+    """
+    Grade statistics of classes and subjects, read from the GradeStatistics
+    snapshot refreshed by the refresh_grade_statistics command.
+    """
+    template_name = 'yourgrades/managerstatistics.html'
+
+    roles = {'manager'}
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['subjects'] = GradeStatistics.per_subject()
+        context['classes'] = GradeStatistics.per_class()
+        context['total'] = GradeStatistics.total(context['classes'])
+        context['refreshed'] = max(
+            (row['refreshed'] for row in context['subjects']),
+            default=None
+        )
         return context
 
 
-class CreateSchoolClassView(LoginRequiredMixin, UserPassesTestMixin,
+class CreateSchoolClassView(RoleRequiredMixin,
                             ProcessFormView, FormMixin, BaseView):
     template_name = 'yourgrades/managercreateschoolclass.html'
     form_class = SchoolClassForm
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def get_success_url(self):
         return reverse('yourgrades:manager')
@@ -250,22 +271,21 @@ class CreateSchoolClassView(LoginRequiredMixin, UserPassesTestMixin,
         return super().form_valid(form)
 
 
-class EditSchoolClassView(LoginRequiredMixin, UserPassesTestMixin,
+class EditSchoolClassView(RoleRequiredMixin,
                           ProcessFormView, FormMixin, BaseView):
     template_name = 'yourgrades/managereditschoolclass.html'
     form_class = CreateStudentForm
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['students'] = Student.objects.filter(
             school_class__unique_code=self.kwargs['class_unique_code']
         ).order_by('surname')
-        school_class = get_object_or_404(
+        school_class = identity_map(self.request).get_or_404(
             SchoolClass,
-            unique_code=self.kwargs['class_unique_code']
+            self.kwargs['class_unique_code']
         )
         context['current_class'] = school_class
         context['subjects'] = Subject.objects.filter(school_class=school_class)
@@ -298,24 +318,11 @@ class EditSchoolClassView(LoginRequiredMixin, UserPassesTestMixin,
             name = 'second_parent_name'
             surname = 'second_parent_surname'
 
-        username = form.cleaned_data[name] + form.cleaned_data[surname]
-        if not User.objects.filter(username=username).exists():
-            user = User.objects.create_user(
-                username=username,
-                password=username + prefix
-            )
-        else:
-            numbering = 2
-            while True:
-                new_username = f'{username}{numbering}'
-                if not User.objects.filter(username=new_username).exists():
-                    user = User.objects.create_user(
-                        username=new_username,
-                        password=f'{new_username}{prefix}'
-                    )
-                    break
-                else:
-                    numbering += 1
+        user = usernames.create_user(
+            form.cleaned_data[name],
+            form.cleaned_data[surname],
+            prefix
+        )
         # Add permission
         content_type = ContentType.objects.get_for_model(RightsSupport)
         permission = Permission.objects.get(
@@ -323,17 +330,15 @@ class EditSchoolClassView(LoginRequiredMixin, UserPassesTestMixin,
             codename=permission_codename
         )
         user.user_permissions.add(permission)
-        user.first_name = form.cleaned_data[name]
-        user.last_name = form.cleaned_data[surname]
         return user
 
     def form_valid(self, form, **kwargs):
         with transaction.atomic():
             user = self.create_gradebook_user(form, 'student')
             user.save()
-            school_class = get_object_or_404(
+            school_class = identity_map(self.request).get_or_404(
                 SchoolClass,
-                unique_code=self.kwargs['class_unique_code']
+                self.kwargs['class_unique_code']
             )
             student = Student(
                 user=user,
@@ -368,10 +373,92 @@ class EditSchoolClassView(LoginRequiredMixin, UserPassesTestMixin,
                 return super().form_valid(form)
 
 
-class DeactivationSchoolClassView(LoginRequiredMixin, UserPassesTestMixin,
+class ImportRosterView(RoleRequiredMixin,
+                       ProcessFormView, FormMixin, BaseView):
+    """
+    Creates all students of a roster file (CSV/JSON with the fields of
+    CreateStudentForm) in one go. Nothing is imported when any row is
+    invalid.
+    """
+    template_name = 'yourgrades/managerimportroster.html'
+    form_class = RosterImportForm
+
+    roles = {'manager'}
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['current_class'] = identity_map(self.request).get_or_404(
+            SchoolClass,
+            self.kwargs['class_unique_code']
+        )
+        return context
+
+    def form_valid(self, form):
+        school_class = identity_map(self.request).get_or_404(
+            SchoolClass,
+            self.kwargs['class_unique_code']
+        )
+        roster = form.cleaned_data['roster']
+        try:
+            rows = validate_roster(read_roster(
+                roster.read(),
+                roster.name.rsplit('.', 1)[-1].lower()
+            ))
+        except RosterError as error:
+            return self.render_to_response(self.get_context_data(
+                form=form,
+                error=str(error),
+                row_errors=error.errors
+            ))
+        stats = import_roster(school_class, rows)
+        return self.render_to_response(
+            self.get_context_data(form=self.get_form_class()(), stats=stats)
+        )
+
+
+class ResetSchoolClassView(RoleRequiredMixin, View):
+    """
+    Resets login data of all students and parents of a class at once, like
+    ManagerResetUserView does for one user: everyone gets the lowest free
+    username of its name. Usernames freed by the reset aren't given to
+    others of the class in the same reset (see usernames.plan_usernames).
+    """
+    roles = {'manager'}
+
+    def post(self, request, **kwargs):
+        current_class = get_object_or_404(
+            SchoolClass,
+            unique_code=kwargs['class_unique_code']
+        )
+        students = Student.objects.filter(school_class=current_class)
+        parents = Parent.objects.filter(student__school_class=current_class)
+        users = list(
+            User.objects.filter(student__in=students).order_by('id')
+        )
+        suffixes = [123] * len(users)
+        parent_users = list(
+            User.objects.filter(parent__in=parents).order_by('id')
+        )
+        users += parent_users
+        suffixes += [345] * len(parent_users)
+        # Hashing takes most of the time, it's done before the transaction
+        # (in a process pool for large classes, like ImportRosterView)
+        hashes = usernames.hash_reset_passwords(users, suffixes)
+        with transaction.atomic():
+            usernames.reset_usernames(users, suffixes, hashes)
+            students.update(first_login=True)
+            parents.update(first_login=True)
+        return HttpResponseRedirect(
+            reverse(
+                'yourgrades:edit_school_class',
+                kwargs={'class_unique_code': kwargs['class_unique_code']}
+            )
+        )
+
+
+class DeactivationSchoolClassView(RoleRequiredMixin,
                                   View):
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def post(self, request, **kwargs):
         current_class = get_object_or_404(
@@ -388,10 +475,8 @@ class DeactivationSchoolClassView(LoginRequiredMixin, UserPassesTestMixin,
         )
 
 
-class DeactivationTeacherView(LoginRequiredMixin, UserPassesTestMixin, View):
-
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+class DeactivationTeacherView(RoleRequiredMixin, View):
+    roles = {'manager'}
 
     def get(self, request, **kwargs):
         teacher = get_object_or_404(
@@ -403,9 +488,8 @@ class DeactivationTeacherView(LoginRequiredMixin, UserPassesTestMixin, View):
         return HttpResponseRedirect(reverse('yourgrades:manager'))
 
 
-class ActivationSchoolClassView(LoginRequiredMixin, UserPassesTestMixin, View):
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+class ActivationSchoolClassView(RoleRequiredMixin, View):
+    roles = {'manager'}
 
     def post(self, request, **kwargs):
         current_class = get_object_or_404(
@@ -422,9 +506,8 @@ class ActivationSchoolClassView(LoginRequiredMixin, UserPassesTestMixin, View):
         )
 
 
-class ActivationTeacherView(LoginRequiredMixin, UserPassesTestMixin, View):
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+class ActivationTeacherView(RoleRequiredMixin, View):
+    roles = {'manager'}
 
     def get(self, request, **kwargs):
         teacher = get_object_or_404(
@@ -436,9 +519,8 @@ class ActivationTeacherView(LoginRequiredMixin, UserPassesTestMixin, View):
         return HttpResponseRedirect(reverse('yourgrades:manager'))
 
 
-class DeleteStudentView(LoginRequiredMixin, UserPassesTestMixin, View):
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+class DeleteStudentView(RoleRequiredMixin, View):
+    roles = {'manager'}
 
     def get(self, request, **kwargs):
         student = get_object_or_404(Student, user__id=kwargs['user_id'])
@@ -463,24 +545,23 @@ class DeleteStudentView(LoginRequiredMixin, UserPassesTestMixin, View):
         )
 
 
-class AddTeacherView(LoginRequiredMixin, UserPassesTestMixin, ProcessFormView,
+class AddTeacherView(RoleRequiredMixin, ProcessFormView,
                      FormMixin, BaseView):
     template_name = 'yourgrades/manageraddteacher.html'
     form_class = CreateTeacherForm
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def get_success_url(self):
         return reverse('yourgrades:manager')
 
     def form_valid(self, form):
         # Method is called only when data is valid
-        username = form.cleaned_data['name'] + form.cleaned_data['surname']
-        if not User.objects.filter(username=username).exists():
-            user = User.objects.create_user(
-                username=username,
-                password=f'{username}234'
+        with transaction.atomic():
+            user = usernames.create_user(
+                form.cleaned_data['name'],
+                form.cleaned_data['surname'],
+                '234'
             )
             content_type = ContentType.objects.get_for_model(RightsSupport)
             permission = Permission.objects.get(
@@ -488,30 +569,6 @@ class AddTeacherView(LoginRequiredMixin, UserPassesTestMixin, ProcessFormView,
                 codename='teacher'
             )
             user.user_permissions.add(permission)
-        else:
-            numbering = 2
-            while True:
-                new_username = username + str(numbering)
-                if not User.objects.filter(username=new_username).exists():
-                    user = User.objects.create_user(
-                        username=new_username,
-                        password=f'{new_username}123'
-                    )
-                    content_type = ContentType.objects.get_for_model(
-                        RightsSupport
-                    )
-                    permission = Permission.objects.get(
-                        content_type=content_type,
-                        codename='teacher'
-                    )
-                    user.user_permissions.add(permission)
-                    break
-                else:
-                    numbering += 1
-        user.first_name = form.cleaned_data['name']
-        user.last_name = form.cleaned_data['surname']
-        with transaction.atomic():
-            user.save()
             teacher = Teacher(
                 user=user,
                 name=form.cleaned_data['name'],
@@ -521,13 +578,12 @@ class AddTeacherView(LoginRequiredMixin, UserPassesTestMixin, ProcessFormView,
         return super().form_valid(form)
 
 
-class AddSubjectView(LoginRequiredMixin, UserPassesTestMixin, ProcessFormView,
+class AddSubjectView(RoleRequiredMixin, ProcessFormView,
                      FormMixin, BaseView):
     template_name = 'yourgrades/manageraddsubject.html'
     form_class = CreateSubjectForm
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def get_success_url(self):
         return reverse(
@@ -575,13 +631,12 @@ class AddSubjectView(LoginRequiredMixin, UserPassesTestMixin, ProcessFormView,
         return super().form_valid(form)
 
 
-class ManagerSubjectView(LoginRequiredMixin, UserPassesTestMixin,
+class ManagerSubjectView(RoleRequiredMixin,
                          ProcessFormView, FormMixin, BaseView):
     template_name = 'yourgrades/managersubjectpanel.html'
     form_class = AddSubjectDateForm
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def get_success_url(self):
         return reverse(
@@ -594,26 +649,21 @@ class ManagerSubjectView(LoginRequiredMixin, UserPassesTestMixin,
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        subject = get_object_or_404(
+        lookup = identity_map(self.request)
+        subject = lookup.get_or_404(
             Subject,
-            unique_code=self.kwargs['subject_unique_code']
+            self.kwargs['subject_unique_code']
         )
-        school_class = get_object_or_404(
+        school_class = lookup.get_or_404(
             SchoolClass,
-            unique_code=self.kwargs['class_unique_code']
+            self.kwargs['class_unique_code']
         )
         context['subject'] = subject
         context['class'] = school_class
-        subject_dates = SubjectDate.objects.filter(subject=subject)
-        dates = [[False for days in range(1, 7)] for lessons in range(1, 13)]
-        for subject_date in subject_dates:
-            iteration = -1
-            for day in ['Mo', 'Tu', 'We', 'Th', 'Fr', 'St']:
-                iteration += 1
-                if subject_date.day == day:
-                    break
-            dates[subject_date.lesson_number - 1][iteration] = True
-        context['dates'] = dates
+        context['dates'] = timetables.build_grid(
+            timetables.school_class_lessons(subject.school_class_id),
+            subject_id=subject.id
+        )
 
         try:
             subject_teachers = SubjectTeachers.objects.get(subject=subject)
@@ -623,17 +673,18 @@ class ManagerSubjectView(LoginRequiredMixin, UserPassesTestMixin,
         grades = Grades.objects.filter(
             subject=subject,
             manager_mode=False
-        ).order_by('date')
+        ).select_related('subject', 'student__school_class')
         manager_grades = Grades.objects.filter(
             subject=subject,
             manager_mode=True
-        ).order_by('date')
-        manager_canceled_grades = CanceledGrades.objects.filter(
+        ).select_related('subject', 'student__school_class')
+        manager_canceled_grades = GradeEvent.objects.filter(
+            kind=GradeEvent.CANCELED,
             subject=subject
-        ).order_by('date')
-        paginator_grades = Paginator(grades, 10)
-        paginator_manager_grades = Paginator(manager_grades, 10)
-        paginator_manager_canceled_grades = Paginator(
+        ).select_related('subject', 'student__school_class')
+        paginator_grades = KeysetPaginator(grades, 10)
+        paginator_manager_grades = KeysetPaginator(manager_grades, 10)
+        paginator_manager_canceled_grades = KeysetPaginator(
             manager_canceled_grades,
             10
         )
@@ -664,24 +715,27 @@ class ManagerSubjectView(LoginRequiredMixin, UserPassesTestMixin,
         except SubjectDate.DoesNotExist:
             with transaction.atomic():
                 subject_date = form.save(commit=False)
-                subject = get_object_or_404(
-                    Subject,
-                    unique_code=self.kwargs['subject_unique_code']
-                )
-                subject_date.subject = subject
+                subject_date.subject = identity_map(
+                    self.request
+                ).get_or_404(Subject, self.kwargs['subject_unique_code'])
                 subject_date.save()
         return super().form_valid(form)
 
 
-class DeleteSubjectDateView(LoginRequiredMixin, UserPassesTestMixin, View):
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+class DeleteSubjectDateView(RoleRequiredMixin, View):
+    roles = {'manager'}
 
     def get(self, request, **kwargs):
-        days = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'St']
-        day = days[kwargs['day'] - 1]
-        lesson = kwargs['lesson']
-        date = get_object_or_404(SubjectDate, lesson_number=lesson, day=day)
+        if not 1 <= kwargs['day'] <= len(timetables.DAYS):
+            raise Http404("Wrong day of the week")
+        day = timetables.DAYS[kwargs['day'] - 1]
+        date = get_object_or_404(
+            SubjectDate,
+            subject__unique_code=kwargs['subject_unique_code'],
+            lesson_number=kwargs['lesson'],
+            day=day
+        )
+        # Timetable caches are invalidated by the post_delete signal
         date.delete()
         return HttpResponseRedirect(
             reverse(
@@ -694,68 +748,41 @@ class DeleteSubjectDateView(LoginRequiredMixin, UserPassesTestMixin, View):
         )
 
 
-class TimetableView(LoginRequiredMixin, UserPassesTestMixin, BaseView):
+class TimetableView(RoleRequiredMixin, BaseView):
     template_name = 'yourgrades/timetable.html'
 
-    def test_func(self):
-        test = False
-        if self.request.user.has_perm('yourgrades.student') or \
-                self.request.user.has_perm('yourgrades.parent') or \
-                self.request.user.has_perm('yourgrades.teacher'):
-            test = True
-        return test
+    roles = {'student', 'parent', 'teacher'}
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['person'] = self.kwargs['person']
+        lookup = identity_map(self.request)
         if self.kwargs['person'] == 'student':
-            try:
-                student = Student.objects.get(user=self.request.user)
-            except Student.DoesNotExist:
-                student = get_list_or_404(
+            if get_role(self.request) == 'student':
+                student = lookup.get_or_404(Student, self.request.user.id)
+            else:
+                student = lookup.get_or_404(
                     Parent,
-                    user=self.request.user
-                )[0].student
-            subjects = Subject.objects.filter(
-                school_class=student.school_class
-            )
-
+                    self.request.user.id,
+                    select_related=('student',)
+                ).student
+            lessons = timetables.school_class_lessons(student.school_class_id)
         elif self.kwargs['person'] == 'teacher':
-            teacher = get_object_or_404(Teacher, user=self.request.user)
-            subject_teacher = SubjectTeachers.objects.filter(
-                teacher=teacher,
-                subject__school_class__active=True
-            )
-            subjects = [subject.subject for subject in subject_teacher]
-
-        all_subject_dates = {}
-        for subject in subjects:
-            all_subject_dates[subject] = SubjectDate.objects.filter(
-                subject=subject,
-            )
-        dates = [[False for days in range(1, 7)] for lessons in range(1, 13)]
-
-        for subject_dates in all_subject_dates.values():
-            for subject_date in subject_dates:
-                iteration = -1
-                for day in ['Mo', 'Tu', 'We', 'Th', 'Fr', 'St']:
-                    iteration += 1
-                    if subject_date.day == day:
-                        break
-                dates[subject_date.lesson_number - 1][iteration] = \
-                    subject_date.subject
-        context['dates'] = dates
+            teacher = lookup.get_or_404(Teacher, self.request.user.id)
+            lessons = timetables.teacher_lessons(teacher.user_id)
+        else:
+            raise Http404("Unknown timetable type")
+        context['dates'] = timetables.build_grid(lessons)
 
         return context
 
 
-class ManagerStudentView(LoginRequiredMixin, UserPassesTestMixin,
+class ManagerStudentView(RoleRequiredMixin,
                          ProcessFormView, FormMixin, BaseView):
     template_name = 'yourgrades/managerstudent.html'
     form_class = AddGradeForm
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def get_success_url(self):
         return reverse(
@@ -765,9 +792,9 @@ class ManagerStudentView(LoginRequiredMixin, UserPassesTestMixin,
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        student = get_object_or_404(
+        student = identity_map(self.request).get_or_404(
             Student,
-            user__id=self.kwargs['user_id']
+            self.kwargs['user_id']
         )
         context['student'] = student
         parents = Parent.objects.filter(student=student)
@@ -780,18 +807,21 @@ class ManagerStudentView(LoginRequiredMixin, UserPassesTestMixin,
                 parents_active[parent] = None
 
         context['parents_active'] = parents_active
-        subjects = Subject.objects.filter(
-            school_class=student.school_class
+        context['subject_grades'] = load_grade_sheet(student)
+        context['statistics'] = analytics.summarize(
+            analytics.from_grades(
+                grade
+                for grades in context['subject_grades'].values()
+                for grade in grades
+            ),
+            'subject'
         )
-
-        subject_grades = {}
-        for subject in subjects:
-            subject_grades[subject] = Grades.objects.filter(
-                subject=subject,
-                student=student
-            )
-        context['subject_grades'] = subject_grades
+        context['averages'] = load_averages('subject_id', student=student)
         context['invalid'] = self.get_second_form()
+        context['at'], context['grades_at'] = self.get_grades_at(
+            student,
+            context['subject_grades']
+        )
 
         try:
             context['del'] = self.kwargs['del']
@@ -800,6 +830,28 @@ class ManagerStudentView(LoginRequiredMixin, UserPassesTestMixin,
 
         return context
 
+    def get_grades_at(self, student, subject_grades):
+        """
+        Returns (day, {subject: [grades]}) with the student's grades at the
+        end of the day from the 'at' GET parameter, rebuilt from the grade
+        log. (None, None) without a valid day. Grades canceled before the
+        log existed are missing before the day they were canceled (see
+        migration 0011).
+        """
+        try:
+            day = parse_date(self.request.GET.get('at', ''))
+        except ValueError:
+            day = None
+        if day is None:
+            return None, None
+        end = timezone.make_aware(datetime.combine(day, time.max))
+        grades_at = {subject: [] for subject in subject_grades}
+        subjects_by_id = {subject.id: subject for subject in grades_at}
+        for grade in GradeCheckpoint.grades_at(student, end):
+            if grade.subject_id in subjects_by_id:
+                grades_at[subjects_by_id[grade.subject_id]].append(grade)
+        return day, grades_at
+
     def get_second_form(self):
         if self.request.method == 'POST':
             try:
@@ -820,42 +872,27 @@ class ManagerStudentView(LoginRequiredMixin, UserPassesTestMixin,
                 Grades,
                 id=self.request.POST.get('del_grade')
             )
-            canceled_grade = CanceledGrades(
-                weight=grade.weight,
-                grade=grade.grade,
-                date=grade.date,
-                subject=grade.subject,
-                student=grade.student
-            )
-            canceled_grade.save()
             with transaction.atomic():
                 message = Message(
                     subject='Grade canceled',
                     text=f'Your grade for the subject {grade.subject.name} '
                          f'has been canceled({grade.grade}/{grade.weight}).'
                 )
-                message.save()
-                sender = Sender(user=self.request.user, message=message)
-                sender.save()
-                recipient = Recipient(user=grade.student.user, message=message)
-                recipient.save()
-                mailbox_received = MailboxReceived(
-                    sender=sender,
-                    recipient=recipient,
-                    message=message
+                NotificationEvent.enqueue(
+                    message,
+                    self.request.user,
+                    [grade.student_id]
                 )
-                mailbox_received.save()
-            grade.delete()
+                # Appends the CANCELED event to the grade log
+                grade.delete()
             self.kwargs['del'] = True
         form = AddGradeForm()
         return super().form_invalid(form)
 
     def form_valid(self, form):
-        subject = get_object_or_404(
-            Subject,
-            unique_code=self.request.POST.get('subject')
-        )
-        student = get_object_or_404(Student, user__id=self.kwargs['user_id'])
+        lookup = identity_map(self.request)
+        subject = lookup.get_or_404(Subject, self.request.POST.get('subject'))
+        student = lookup.get_or_404(Student, self.kwargs['user_id'])
         try:
             grade = form.save(commit=False)
             grade.student = student
@@ -872,18 +909,11 @@ class ManagerStudentView(LoginRequiredMixin, UserPassesTestMixin,
                 text=f'Wprowadzono nowa ocene z przedmiotu {subject.name}. '
                      f'Twoja ocena to  {grade.grade} o wadze {grade.weight}.',
             )
-            with transaction.atomic():
-                message.save()
-                sender = Sender(user=self.request.user, message=message)
-                sender.save()
-                recipient = Recipient(user=student.user, message=message)
-                recipient.save()
-                mailbox_received = MailboxReceived(
-                    sender=sender,
-                    recipient=recipient,
-                    message=message
-                )
-                mailbox_received.save()
+            NotificationEvent.enqueue(
+                message,
+                self.request.user,
+                [student.user_id]
+            )
         except FieldError:
             raise Http404(
                 "There was a problem sending messages about new grade"
@@ -891,20 +921,23 @@ class ManagerStudentView(LoginRequiredMixin, UserPassesTestMixin,
         return super().form_valid(form)
 
 
-class ManagerGradesHistoryView(LoginRequiredMixin, UserPassesTestMixin,
+class ManagerGradesHistoryView(RoleRequiredMixin,
                                BaseView):
     template_name = 'yourgrades/managerhistory.html'
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        grades = Grades.objects.filter(manager_mode=True)
-        canceled_grades = CanceledGrades.objects.all()
+        grades = Grades.objects.filter(
+            manager_mode=True
+        ).select_related('subject')
+        canceled_grades = GradeEvent.objects.filter(
+            kind=GradeEvent.CANCELED
+        ).select_related('subject')
 
-        paginator_grades = Paginator(grades, 10)
-        paginator_canceled_grades = Paginator(canceled_grades, 10)
+        paginator_grades = KeysetPaginator(grades, 10)
+        paginator_canceled_grades = KeysetPaginator(canceled_grades, 10)
         context['grades'] = paginator_grades.get_page(
             self.request.GET.get('page1')
         )
@@ -914,9 +947,45 @@ class ManagerGradesHistoryView(LoginRequiredMixin, UserPassesTestMixin,
         return context
 
 
-class DeleteSubjectView(LoginRequiredMixin, UserPassesTestMixin, View):
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+class ExportGradesView(RoleRequiredMixin, View):
+    """
+    Streams grades of the whole school, a school class
+    (class_unique_code) or a subject (subject_unique_code) as CSV or XLSX.
+    """
+    roles = {'manager'}
+
+    def get(self, request, **kwargs):
+        export_format = self.kwargs['export_format']
+        if export_format not in export.FORMATS:
+            raise Http404("Unknown export format")
+        school_class = subject = None
+        name = 'school'
+        if 'class_unique_code' in self.kwargs:
+            school_class = get_object_or_404(
+                SchoolClass,
+                unique_code=self.kwargs['class_unique_code']
+            )
+            name = school_class.unique_code
+        if 'subject_unique_code' in self.kwargs:
+            subject = get_object_or_404(
+                Subject,
+                unique_code=self.kwargs['subject_unique_code']
+            )
+            name = subject.unique_code
+        response = StreamingHttpResponse(
+            export.export_chunks(
+                export.grades_queryset(school_class, subject),
+                export_format
+            ),
+            content_type=export.CONTENT_TYPES[export_format]
+        )
+        response['Content-Disposition'] = \
+            f'attachment; filename="grades_{name}.{export_format}"'
+        return response
+
+
+class DeleteSubjectView(RoleRequiredMixin, View):
+    roles = {'manager'}
 
     def get(self, request, **kwargs):
         subject = get_object_or_404(
@@ -931,9 +1000,8 @@ class DeleteSubjectView(LoginRequiredMixin, UserPassesTestMixin, View):
         )
 
 
-class DeleteSubjectTeacherView(LoginRequiredMixin, UserPassesTestMixin, View):
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+class DeleteSubjectTeacherView(RoleRequiredMixin, View):
+    roles = {'manager'}
 
     def get(self, request, **kwargs):
         teacher = Teacher.objects.get(user__id=self.kwargs['teacher_user_id'])
@@ -950,9 +1018,8 @@ class DeleteSubjectTeacherView(LoginRequiredMixin, UserPassesTestMixin, View):
         return HttpResponseRedirect(self.request.META.get('HTTP_REFERER'))
 
 
-class ManagerDeleteTeacherView(LoginRequiredMixin, UserPassesTestMixin, View):
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+class ManagerDeleteTeacherView(RoleRequiredMixin, View):
+    roles = {'manager'}
 
     def get(self, request, **kwargs):
         teacher = Teacher.objects.get(user__id=self.kwargs['teacher_user_id'])
@@ -961,33 +1028,13 @@ class ManagerDeleteTeacherView(LoginRequiredMixin, UserPassesTestMixin, View):
         return HttpResponseRedirect(reverse('yourgrades:manager'))
 
 
-class ManagerResetUserView(LoginRequiredMixin, UserPassesTestMixin, View):
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+class ManagerResetUserView(RoleRequiredMixin, View):
+    roles = {'manager'}
 
     def get(self, request, **kwargs):
         user = get_object_or_404(User, id=self.kwargs['user_id'])
-        username = user.first_name + user.last_name
-        try:
-            existing_user = User.objects.get(username=username)
-            if existing_user.id == user.id:
-                user.set_password(username + str(self.kwargs['prefix']))
-            else:
-                numbering = 2
-                while True:
-                    new_username = username + str(numbering)
-                    if not User.objects.filter(username=new_username).exists():
-                        user.username = new_username
-                        user.set_password(
-                            new_username + str(self.kwargs['prefix'])
-                        )
-                        break
-                    numbering += 1
-        except User.DoesNotExist:
-            user.username = username
-            user.set_password(username + str(self.kwargs['prefix']))
         with transaction.atomic():
-            user.save()
+            usernames.reset_username(user, self.kwargs['prefix'])
             if self.kwargs['prefix'] == 123:
                 student = get_object_or_404(Student, user=user)
                 student.first_login = True
@@ -1003,13 +1050,12 @@ class ManagerResetUserView(LoginRequiredMixin, UserPassesTestMixin, View):
         return HttpResponseRedirect(self.request.META.get('HTTP_REFERER'))
 
 
-class ManagerTeacherEditView(LoginRequiredMixin, UserPassesTestMixin,
+class ManagerTeacherEditView(RoleRequiredMixin,
                              ProcessFormView, FormMixin, BaseView):
     template_name = 'yourgrades/managereditteacher.html'
     form_class = CreateTeacherForm
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def get_success_url(self):
         return reverse('yourgrades:manager_teacher', kwargs={
@@ -1041,13 +1087,12 @@ class ManagerTeacherEditView(LoginRequiredMixin, UserPassesTestMixin,
         return super().form_valid(form)
 
 
-class ManagerStudentEditView(LoginRequiredMixin, UserPassesTestMixin,
+class ManagerStudentEditView(RoleRequiredMixin,
                              ProcessFormView, FormMixin, BaseView):
     template_name = 'yourgrades/managereditstudent.html'
     form_class = CreateStudentForm
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1112,13 +1157,12 @@ class ManagerStudentEditView(LoginRequiredMixin, UserPassesTestMixin,
         return super().form_valid(form)
 
 
-class AddSubjectTeacherView(LoginRequiredMixin, UserPassesTestMixin,
+class AddSubjectTeacherView(RoleRequiredMixin,
                             ProcessFormView, FormMixin, BaseView):
     template_name = 'yourgrades/manageraddsubjectteacher.html'
     form_class = AddSubjectTeacherForm
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def get_success_url(self):
         return reverse(
@@ -1131,21 +1175,22 @@ class AddSubjectTeacherView(LoginRequiredMixin, UserPassesTestMixin,
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['class'] = get_object_or_404(
+        lookup = identity_map(self.request)
+        context['class'] = lookup.get_or_404(
             SchoolClass,
-            unique_code=self.kwargs['class_unique_code']
+            self.kwargs['class_unique_code']
         )
-        context['subject'] = get_object_or_404(
+        context['subject'] = lookup.get_or_404(
             Subject,
-            unique_code=self.kwargs['subject_unique_code']
+            self.kwargs['subject_unique_code']
         )
         return context
 
     def form_valid(self, form):
         # Method is called only when data is valid
-        subject = get_object_or_404(
+        subject = identity_map(self.request).get_or_404(
             Subject,
-            unique_code=self.kwargs['subject_unique_code']
+            self.kwargs['subject_unique_code']
         )
         with transaction.atomic():
             try:
@@ -1159,11 +1204,10 @@ class AddSubjectTeacherView(LoginRequiredMixin, UserPassesTestMixin,
         return super().form_valid(form)
 
 
-class ManagerTeacherView(LoginRequiredMixin, UserPassesTestMixin, BaseView):
+class ManagerTeacherView(RoleRequiredMixin, BaseView):
     template_name = 'yourgrades/managerteacher.html'
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.manager')
+    roles = {'manager'}
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1178,21 +1222,30 @@ class ManagerTeacherView(LoginRequiredMixin, UserPassesTestMixin, BaseView):
         return context
 
 
-class TeacherPanelView(LoginRequiredMixin, UserPassesTestMixin, BaseView):
+class RequestStatsView(RoleRequiredMixin, View):
+    roles = {'manager'}
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(middleware.summary())
+
+
+class TeacherPanelView(RoleRequiredMixin, BaseView):
     template_name = 'yourgrades/teacher.html'
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.teacher')
+    roles = {'teacher'}
 
     def get(self, request, *args, **kwargs):
-        teacher = get_object_or_404(Teacher, user=self.request.user)
+        teacher = identity_map(request).get_or_404(Teacher, request.user.id)
         if teacher.first_login is True:
             return HttpResponseRedirect(reverse('yourgrades:first_login'))
         return super().get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        teacher = get_object_or_404(Teacher, user=self.request.user)
+        teacher = identity_map(self.request).get_or_404(
+            Teacher,
+            self.request.user.id
+        )
         try:
             subject_teacher = SubjectTeachers.objects.filter(teacher=teacher)
             subjects = [subject.subject for subject in subject_teacher]
@@ -1208,13 +1261,12 @@ class TeacherPanelView(LoginRequiredMixin, UserPassesTestMixin, BaseView):
         return context
 
 
-class TeacherSubjectView(LoginRequiredMixin, UserPassesTestMixin,
+class TeacherSubjectView(RoleRequiredMixin,
                          ProcessFormView, FormMixin, BaseView):
     template_name = 'yourgrades/teachersubject.html'
     form_class = AddGradeForm
 
-    def test_func(self):
-        return self.request.user.has_perm('yourgrades.teacher')
+    roles = {'teacher'}
 
     def get_success_url(self):
         return reverse('yourgrades:teacher_subject', kwargs={
@@ -1222,34 +1274,41 @@ class TeacherSubjectView(LoginRequiredMixin, UserPassesTestMixin,
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        subject = get_object_or_404(
+        subject = identity_map(self.request).get_or_404(
             Subject,
-            unique_code=self.kwargs['subject_unique_code']
+            self.kwargs['subject_unique_code']
         )
         context['subject'] = subject
-        students = Student.objects.filter(
-            school_class=subject.school_class
-        ).order_by('surname')
-        context['students'] = [
-            (student, Grades.objects.filter(subject=subject, student=student))
-            for student in students
-        ]
-        context['form2'] = self.get_second_form()[0]
-        context['invalid_student'] = self.get_second_form()[1]
+        context['students'] = load_grade_matrix(subject)
+        grades = analytics.from_grades(
+            grade
+            for student, student_grades in context['students']
+            for grade in student_grades
+        )
+        context['statistics'] = analytics.summarize(grades, 'student')
+        context['averages'] = load_averages('student_id', subject=subject)
+        context['distribution'] = analytics.distribution(grades)
+        form2, invalid_student_id = self.get_second_form()
+        context['form2'] = form2
+        context['invalid_student'] = None
+        for student, grades in context['students']:
+            if str(student.user_id) == invalid_student_id:
+                context['invalid_student'] = student
         grades = Grades.objects.filter(
             subject=subject,
             manager_mode=False
-        ).order_by('date')
+        ).select_related('subject', 'student__school_class')
         manager_grades = Grades.objects.filter(
             subject=subject,
             manager_mode=True
-        ).order_by('date')
-        manager_canceled_grades = CanceledGrades.objects.filter(
-            subject=subject,
-        ).order_by('date')
-        paginator_grades = Paginator(grades, 10)
-        paginator_manager_grades = Paginator(manager_grades, 10)
-        paginator_manager_canceled_grades = Paginator(
+        ).select_related('subject', 'student__school_class')
+        manager_canceled_grades = GradeEvent.objects.filter(
+            kind=GradeEvent.CANCELED,
+            subject=subject
+        ).select_related('subject', 'student__school_class')
+        paginator_grades = KeysetPaginator(grades, 10)
+        paginator_manager_grades = KeysetPaginator(manager_grades, 10)
+        paginator_manager_canceled_grades = KeysetPaginator(
             manager_canceled_grades,
             10
         )
@@ -1266,20 +1325,14 @@ class TeacherSubjectView(LoginRequiredMixin, UserPassesTestMixin,
         return context
 
     def get_second_form(self):
-        if self.request.method == 'POST':
-            current_form = AddGradeForm(self.request.POST)
-            if not current_form.is_valid():
-                try:
-                    student = get_object_or_404(
-                        Student,
-                        user__id=self.request.POST.get('student')
-                    )
-                    return current_form, student
-                except KeyError:
-                    return None, None
-        return None, None
+        """
+        Returns the invalid, already validated form posted for one student
+        and the student's user id, (None, None) otherwise.
+        """
+        return getattr(self, 'second_form', (None, None))
 
     def form_invalid(self, form):
+        self.second_form = form, self.request.POST.get('student')
         form = AddGradeForm()
         return self.render_to_response(
             self.get_context_data(form=form, wrong=True)
@@ -1287,14 +1340,12 @@ class TeacherSubjectView(LoginRequiredMixin, UserPassesTestMixin,
 
     def form_valid(self, form):
         # Method is called only when data is valid
-        subject = get_object_or_404(
+        lookup = identity_map(self.request)
+        subject = lookup.get_or_404(
             Subject,
-            unique_code=self.kwargs['subject_unique_code']
-        )
-        student = get_object_or_404(
-            Student,
-            user__id=self.request.POST.get('student')
+            self.kwargs['subject_unique_code']
         )
+        student = lookup.get_or_404(Student, self.request.POST.get('student'))
         try:
             grade = form.save(commit=False)
             grade.student = student
@@ -1304,35 +1355,61 @@ class TeacherSubjectView(LoginRequiredMixin, UserPassesTestMixin,
             raise Http404(
                 "There was a problem with grade saving. Try again later"
             )
-        message = Message(
-            subject='New grade',
-            text=f'You have a new grade for the subject {subject.name}. '
-                 f'Your grade is {grade.grade} with weight {grade.weight}.'
+        try:
+            NotificationEvent.enqueue(
+                grade_message(subject, grade.grade, grade.weight),
+                self.request.user,
+                [student.user_id]
+            )
+        except (DataError, TypeError):
+            raise Http404('Text or subject too long or wrong datatype')
+        return super().form_valid(form)
+
+
+class TeacherBatchGradeView(RoleRequiredMixin,
+                            ProcessFormView, FormMixin, BaseView):
+    """
+    Grades of the whole class (e.g. of a test) entered in one form. All
+    grades are validated together and saved with bulk inserts.
+    """
+    template_name = 'yourgrades/teacherbatchgrades.html'
+    form_class = BatchGradeForm
+
+    roles = {'teacher'}
+
+    def get_subject(self):
+        return identity_map(self.request).get_or_404(
+            Subject,
+            self.kwargs['subject_unique_code']
+        )
+
+    def get_success_url(self):
+        return reverse('yourgrades:teacher_subject', kwargs={
+            'subject_unique_code': self.kwargs['subject_unique_code']})
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['students'] = Student.objects.filter(
+            school_class_id=self.get_subject().school_class_id
+        ).order_by('surname')
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['subject'] = self.get_subject()
+        return context
+
+    def form_valid(self, form):
+        add_grades(
+            self.get_subject(),
+            form.cleaned_data['weight'],
+            form.grades(),
+            self.request.user
         )
-        with transaction.atomic():
-            try:
-                message.save()
-            except (DataError, TypeError):
-                raise Http404('Text or subject too long or wrong datatype')
-            sender = Sender(user=self.request.user, message=message)
-            sender.save()
-            recipient = Recipient(user=student.user, message=message)
-            recipient.save()
-            try:
-                mailbox_received = MailboxReceived(
-                    sender=sender,
-                    recipient=recipient,
-                    message=message
-                )
-                mailbox_received.save()
-            except FieldError:
-                raise Http404(
-                    "There was a problem sending messages about new grade"
-                )
         return super().form_valid(form)
 
 
-class CreateMessageView(LoginRequiredMixin, UserPassesTestMixin,
+class CreateMessageView(RoleRequiredMixin,
                         ProcessFormView, FormMixin, BaseView):
     """
     Passes messages between users. The view uses 2 variables
@@ -1355,24 +1432,17 @@ class CreateMessageView(LoginRequiredMixin, UserPassesTestMixin,
     template_name = 'yourgrades/message.html'
     form_class = MessageForm
 
-    def test_func(self):
-        test = False
-        if self.request.user.has_perm('yourgrades.student') or \
-                self.request.user.has_perm('yourgrades.parent') or \
-                self.request.user.has_perm('yourgrades.teacher') or \
-                self.request.user.has_perm('yourgrades.manager'):
-            test = True
-        return test
+    roles = {'student', 'parent', 'teacher', 'manager'}
 
     def get_success_url(self):
-        user_permission = list(self.request.user.get_all_permissions())[0]
-        if user_permission == 'yourgrades.student':
+        user_role = get_role(self.request)
+        if user_role == 'student':
             return reverse('yourgrades:student_parent')
-        elif user_permission == 'yourgrades.parent':
+        elif user_role == 'parent':
             return reverse('yourgrades:student_parent')
-        elif user_permission == 'yourgrades.teacher':
+        elif user_role == 'teacher':
             return reverse('yourgrades:teacher')
-        elif user_permission == 'yourgrades.manager':
+        elif user_role == 'manager':
             return reverse('yourgrades:manager')
         else:
             raise ValueError("Unknown permission")
@@ -1424,256 +1494,160 @@ class CreateMessageView(LoginRequiredMixin, UserPassesTestMixin,
         return context
 
     def form_valid(self, form):
-        # Message and sender models are save the same way for all types
-        # of users
-        with transaction.atomic():
-            message = form.save()
-            sender = Sender(user=self.request.user, message=message)
-            sender.save()
-            # Recipient and MailboxReceived models depend on the type of
-            # target user
-            if self.kwargs['prefix'] in {1, 2}:
-                school_class = get_object_or_404(
-                    SchoolClass,
-                    unique_code=self.kwargs['code']
-                )
-                recipient_name = school_class.name
-                if self.kwargs['prefix'] == 2:
-                    recipient_name += ' parents'
-                students = Student.objects.filter(school_class=school_class)
-                if not students:
-                    return self.render_to_response(
-                        self.get_context_data(
-                            form=form,
-                            no_students=True,
-                            back=True
-                        )
-                    )
-                if not students:
-                    raise Http404("Wrong class unique_code")
-                for student in students:
-                    if self.kwargs['prefix'] == 1:
-                        recipient = Recipient(
-                            user=student.user,
-                            message=message
-                        )
-                        recipient.save()
-                        mailbox_received = MailboxReceived(
-                            sender=sender,
-                            recipient=recipient,
-                            message=message
-                        )
-                        mailbox_received.save()
-                    else:
-                        parents = Parent.objects.filter(student=student)
-                        for parent in parents:
-                            recipient = Recipient(
-                                user=parent.user,
-                                message=message
-                            )
-                            recipient.save()
-                            mailbox_received = MailboxReceived(
-                                sender=sender,
-                                recipient=recipient,
-                                message=message
-                            )
-                            mailbox_received.save()
-            elif self.kwargs['prefix'] == 3:
-                subject = get_object_or_404(
-                    Subject,
-                    unique_code=self.kwargs['code']
-                )
-                recipient_name = f'{subject.name} teachers'
-                subject_teachers = get_object_or_404(
-                    SubjectTeachers,
-                    subject=subject
-                )
-                teachers = subject_teachers.teacher.all()
-                for teacher in teachers:
-                    recipient = Recipient(user=teacher.user, message=message)
-                    recipient.save()
-                    mailbox_received = MailboxReceived(
-                        sender=sender,
-                        recipient=recipient,
-                        message=message
-                    )
-                    mailbox_received.save()
-            elif self.kwargs['prefix'] == 4:
-                student = get_object_or_404(
-                    Student,
-                    user__id=self.kwargs['code']
-                )
-                recipient_name = student.__str__()
-                recipient = Recipient(user=student.user, message=message)
-                recipient.save()
-                mailbox_received = MailboxReceived(
-                    sender=sender,
-                    recipient=recipient,
-                    message=message
-                )
-                mailbox_received.save()
-            elif self.kwargs['prefix'] == 5:
-                student = get_object_or_404(
-                    Student,
-                    user__id=self.kwargs['code']
-                )
-                recipient_name = f'{student.__str__()} parents'
-                parents = Parent.objects.filter(student=student)
-                for parent in parents:
-                    recipient = Recipient(user=parent.user, message=message)
-                    recipient.save()
-                    mailbox_received = MailboxReceived(
-                        sender=sender,
-                        recipient=recipient,
-                        message=message
-                    )
-                    mailbox_received.save()
-            elif self.kwargs['prefix'] == 6:
-                permission = Permission.objects.get(codename='manager')
-                managers = User.objects.filter(user_permissions=permission)
-                recipient_name = 'Managers'
-                for manager in managers:
-                    recipient = Recipient(user=manager, message=message)
-                    recipient.save()
-                    mailbox_received = MailboxReceived(
-                        sender=sender,
-                        recipient=recipient,
-                        message=message
+        # Class, class parents and subject teachers get one broadcast row.
+        # For other targets recipient users are resolved with a single query
+        # and the message is delivered to all of them in bulk
+        prefix = self.kwargs['prefix']
+        broadcast = {}
+        if prefix in {1, 2}:
+            school_class = get_object_or_404(
+                SchoolClass,
+                unique_code=self.kwargs['code']
+            )
+            if not Student.objects.filter(school_class=school_class).exists():
+                return self.render_to_response(
+                    self.get_context_data(
+                        form=form,
+                        no_students=True,
+                        back=True
                     )
-                    mailbox_received.save()
-            elif self.kwargs['prefix'] == 7:
-                teacher = get_object_or_404(
-                    Teacher,
-                    user__id=self.kwargs['code']
-                )
-                recipient_name = teacher.__str__()
-                recipient = Recipient(user=teacher.user, message=message)
-                recipient.save()
-                mailbox_received = MailboxReceived(
-                    sender=sender,
-                    recipient=recipient,
-                    message=message
                 )
-                mailbox_received.save()
-            # Same for all type of senders
-            mailbox_sent = MailboxSent(
-                sender=sender,
-                recipient=recipient_name,
-                message=message
+            recipient_name = school_class.name
+            broadcast['school_class'] = school_class
+            if prefix == 1:
+                broadcast['audience'] = Broadcast.SCHOOL_CLASS
+            else:
+                recipient_name += ' parents'
+                broadcast['audience'] = Broadcast.CLASS_PARENTS
+        elif prefix == 3:
+            subject = get_object_or_404(
+                Subject,
+                unique_code=self.kwargs['code']
+            )
+            recipient_name = f'{subject.name} teachers'
+            get_object_or_404(SubjectTeachers, subject=subject)
+            broadcast['subject'] = subject
+            broadcast['audience'] = Broadcast.SUBJECT_TEACHERS
+        elif prefix == 4:
+            student = get_object_or_404(
+                Student,
+                user__id=self.kwargs['code']
+            )
+            recipient_name = student.__str__()
+            users = User.objects.filter(id=student.user_id)
+        elif prefix == 5:
+            student = get_object_or_404(
+                Student,
+                user__id=self.kwargs['code']
+            )
+            recipient_name = f'{student.__str__()} parents'
+            users = User.objects.filter(parent__student=student)
+        elif prefix == 6:
+            recipient_name = 'Managers'
+            users = User.objects.filter(
+                user_permissions__codename='manager',
+                user_permissions__content_type__app_label='yourgrades'
+            )
+        elif prefix == 7:
+            teacher = get_object_or_404(
+                Teacher,
+                user__id=self.kwargs['code']
+            )
+            recipient_name = teacher.__str__()
+            users = User.objects.filter(id=teacher.user_id)
+        else:
+            raise Http404("Unknown recipient type")
+
+        message = form.save(commit=False)
+        if broadcast:
+            send_broadcast(
+                message,
+                self.request.user,
+                recipient_name=recipient_name,
+                **broadcast
+            )
+        else:
+            send_message(
+                message,
+                self.request.user,
+                users.values_list('id', flat=True),
+                recipient_name
             )
-            mailbox_sent.save()
         return super().form_valid(form)
 
 
-class MailboxView(LoginRequiredMixin, UserPassesTestMixin, BaseView):
+class MailboxView(RoleRequiredMixin, BaseView):
     template_name = 'yourgrades/mailbox.html'
 
-    def test_func(self):
-        test = False
-        if self.request.user.has_perm('yourgrades.student') or\
-                self.request.user.has_perm('yourgrades.parent') or\
-                self.request.user.has_perm('yourgrades.teacher') or\
-                self.request.user.has_perm('yourgrades.manager'):
-            test = True
-        return test
+    roles = {'student', 'parent', 'teacher', 'manager'}
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        sent = MailboxSent.objects.filter(
-            sender__user=self.request.user
-        ).order_by('-id')
-        received = MailboxReceived.objects.filter(
-            recipient__user=self.request.user
-        ).order_by('-id')
-        paginator_sent = Paginator(sent, 15)
-        paginator_received = Paginator(received, 15)
+        sent = Message.objects.filter(
+            sender=self.request.user,
+            recipient_name__isnull=False
+        )
+        received = received_messages(self.request.user)
+        paginator_sent = KeysetPaginator(sent, 15, ordering=('-id',))
+        paginator_received = KeysetPaginator(received, 15, ordering=('-id',))
         context['received'] = paginator_received.get_page(
             self.request.GET.get('page2')
         )
         context['sent'] = paginator_sent.get_page(
             self.request.GET.get('page1')
         )
-        try:
-            context['user_type'] = list(
-                self.request.user.get_all_permissions()
-            )[0]
-        except IndexError:
-            raise Http404("User not recognized.")
+        context['user_type'] = f'yourgrades.{get_role(self.request)}'
         return context
 
 
-class MailTextView(LoginRequiredMixin, UserPassesTestMixin, BaseView):
+class MailTextView(RoleRequiredMixin, BaseView):
     template_name = 'yourgrades/mailtext.html'
 
-    def test_func(self):
-        test = False
-        if self.request.user.has_perm('yourgrades.student') or\
-                self.request.user.has_perm('yourgrades.parent') or\
-                self.request.user.has_perm('yourgrades.teacher') or\
-                self.request.user.has_perm('yourgrades.manager'):
-            test = True
-        return test
+    roles = {'student', 'parent', 'teacher', 'manager'}
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        # Users can open only mails from their own mailboxes
         if self.kwargs['mailbox_type'] == 1:
-            mailbox = get_object_or_404(
-                MailboxReceived,
+            context['message'] = get_object_or_404(
+                received_messages(self.request.user),
                 id=self.kwargs['mailbox_id']
             )
-            context['mailbox'] = mailbox
-            mailbox.read = True
-            mailbox.save()
+            mark_read(self.request.user, context['message'])
         elif self.kwargs['mailbox_type'] == 2:
-            mailbox = get_object_or_404(
-                MailboxSent,
-                id=self.kwargs['mailbox_id']
+            context['message'] = get_object_or_404(
+                Message,
+                id=self.kwargs['mailbox_id'],
+                sender=self.request.user
             )
-            context['mailbox'] = mailbox
         return context
 
 
-class StudentParentView(LoginRequiredMixin, UserPassesTestMixin, BaseView):
+class StudentParentView(RoleRequiredMixin, BaseView):
     template_name = 'yourgrades/studentparent.html'
 
-    def test_func(self):
-        test = False
-        if self.request.user.has_perm('yourgrades.student') or \
-                self.request.user.has_perm('yourgrades.parent'):
-            test = True
-        return test
+    roles = {'student', 'parent'}
 
     def get(self, request, *args, **kwargs):
-        try:
-            person = Student.objects.get(user=self.request.user)
-        except ObjectDoesNotExist:
-            person = get_object_or_404(Parent, user=self.request.user)
-        if person.first_login is True:
+        # Person is loaded once per request and reused in get_context_data
+        lookup = identity_map(request)
+        if get_role(request) == 'student':
+            self.person = lookup.get_or_404(Student, request.user.id)
+            self.student = self.person
+        else:
+            self.person = lookup.get_or_404(
+                Parent,
+                request.user.id,
+                select_related=('student',)
+            )
+            self.student = self.person.student
+        if self.person.first_login is True:
             return HttpResponseRedirect(reverse('yourgrades:first_login'))
         return super().get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        try:
-            permission = list(self.request.user.get_all_permissions())[0]
-        except IndexError:
-            raise Http404("User not recognized.")
-
-        if permission == 'yourgrades.student':
-            student = get_object_or_404(Student, user=self.request.user)
-            context['person'] = student
-        elif permission == 'yourgrades.parent':
-            parent = get_object_or_404(Parent, user=self.request.user)
-            student = parent.student
-            context['person'] = parent
-
-        subjects = Subject.objects.filter(school_class=student.school_class)
-        subjects_grades = {}
-        for subject in subjects:
-            subjects_grades[subject] = Grades.objects.filter(
-                subject=subject,
-                student=student
-            )
-        context['subjects_grades'] = subjects_grades
-
+        context['person'] = self.person
+        context['subjects_grades'] = load_grade_sheet(self.student)
+        context['averages'] = load_averages('subject_id', student=self.student)
         return context